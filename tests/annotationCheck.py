@@ -0,0 +1,131 @@
+import numpy as np
+
+STRIP_FACTOR = 2 # 帯の高さ (四角形の高さの中央値の倍数)
+CHUNK_PAIRS = 1 << 20 # 1回にまとめて判定する候補の組の数 (メモリ使用量の上限)
+MAX_PAIRS = 1000000 # 求める当たっている組の数の上限 (超えた分は求めない)
+
+
+# 四角形の検証結果
+# pairs : 当たっている四角形のキーの組 ((m, 2) の配列、各組は小さいキーが先、キー順)
+# inverted : 左右、上下が逆の四角形のキー    empty : 幅、高さが0の四角形のキー
+# outside : 画像の範囲外に出ている四角形のキー
+# truncated : 当たっている組が上限を超え、一部のみ求めた場合 True
+class Conflicts:
+    def __init__(self, pairs, inverted, empty, outside, version=None, truncated=False):
+        self.pairs = pairs
+        self.truncated = truncated
+        self.inverted = inverted
+        self.empty = empty
+        self.outside = outside
+        self.version = version # 検証した時点の AnnotationStore.version
+        self.partners = {} # キー -> 当たっている四角形のキーのリスト
+        for a, b in pairs.tolist():
+            self.partners.setdefault(a, []).append(b)
+            self.partners.setdefault(b, []).append(a)
+        self.inverted_set = set(inverted.tolist())
+        self.empty_set = set(empty.tolist())
+        self.outside_set = set(outside.tolist())
+        self.keys = np.unique(np.concatenate([pairs.reshape(-1), inverted, empty, outside]).astype(np.int64)) # 問題のある四角形のキー
+
+    def __len__(self):
+        return len(self.pairs) + len(self.inverted) + len(self.empty) + len(self.outside)
+
+    # 四角形の問題の短い説明 (問題が無い場合は空文字)
+    # id_of : キーから表示されるidを求める関数
+    def describe(self, key, id_of):
+        texts = []
+        partners = self.partners.get(key)
+        if partners:
+            texts.append("重なり " + ",".join(str(id_of(k)) for k in partners[:3]) + ("…" if len(partners) > 3 else ""))
+        if key in self.inverted_set:
+            texts.append("反転")
+        if key in self.empty_set:
+            texts.append("大きさ0")
+        if key in self.outside_set:
+            texts.append("範囲外")
+        return " ".join(texts)
+
+    def summary(self):
+        return (f"重なり {len(self.pairs)}組{'以上' if self.truncated else ''}、反転 {len(self.inverted)}件、"
+                f"大きさ0 {len(self.empty)}件、範囲外 {len(self.outside)}件")
+
+
+# 当たっている四角形の組を全て求める (hit_square と同じく同じ値の辺は当たっていないと判断)
+# 縦方向を帯に分け、帯ごとに左端で並べた四角形を走査し、右端より左から始まる四角形のみを候補とする
+# 同じ組が複数の帯で見つかる場合は、重なり部分の上端を含む帯でのみ数える
+# keys : キーの配列    coords : (n, 4) の座標配列 x1,y1 : 左下    x2,y2 : 右上 (逆の場合も並べ直して判定)
+# limit : 求める組の数の上限 (超えた場合はその時点で打ち切る)
+# 戻り値 : ((m, 2) のキーの組の配列, 打ち切ったか)
+def overlapping_pairs(keys, coords, limit=MAX_PAIRS):
+    keys = np.asarray(keys, dtype=np.int64)
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 4)
+    left = np.minimum(coords[:, 0], coords[:, 2])
+    right = np.maximum(coords[:, 0], coords[:, 2])
+    top = np.minimum(coords[:, 1], coords[:, 3])
+    bottom = np.maximum(coords[:, 1], coords[:, 3])
+    if len(keys) < 2:
+        return np.zeros((0, 2), dtype=np.int64), False
+    origin = top.min()
+    top, bottom = top - origin, bottom - origin
+    strip = max(int(np.median(bottom - top)) * STRIP_FACTOR, 1)
+
+    # 四角形を掛かる帯ごとに展開し、(帯, 左端) の順に並べる (高さ0の四角形は上端の帯のみ)
+    first = top // strip
+    last = np.maximum((bottom - 1) // strip, first)
+    counts = last - first + 1
+    owner = np.repeat(np.arange(len(keys)), counts)
+    band = first[owner] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    base = -left.min()
+    span = int(right.max() + base) + 1
+    sort_key = band * span + (left[owner] + base)
+    order = np.argsort(sort_key, kind='stable')
+    owner, band, sort_key = owner[order], band[order], sort_key[order]
+
+    # 各四角形について、同じ帯で右端より左から始まる後ろの四角形までが候補
+    end = np.searchsorted(sort_key, band * span + (right[owner] + base), side='left')
+    counts = end - np.arange(len(owner)) - 1
+    found = []
+    total = 0
+    starts = np.flatnonzero(counts > 0)
+    totals = np.cumsum(counts[starts])
+    begin = 0
+    while begin < len(starts):
+        stop = int(np.searchsorted(totals, (totals[begin - 1] if begin else 0) + CHUNK_PAIRS, side='right'))
+        stop = max(stop, begin + 1)
+        positions = starts[begin:stop]
+        n = counts[positions]
+        i = np.repeat(positions, n)
+        j = i + 1 + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        a, b = owner[i], owner[j]
+        hit = (right[b] > left[a]) & (left[b] < right[a]) & (bottom[a] > top[b]) & (top[a] < bottom[b])
+        # 重なり部分の上端を含む帯でのみ数える
+        hit &= np.maximum(top[a], top[b]) // strip == band[i]
+        found.append(np.stack([a[hit], b[hit]], axis=1))
+        total += len(found[-1])
+        begin = stop
+        if total >= limit:
+            break
+    if not found:
+        return np.zeros((0, 2), dtype=np.int64), False
+    # 並べ替えてから上限で切り詰める (残す組を見つかった順に依らず揃える)
+    pairs = keys[np.concatenate(found)]
+    pairs.sort(axis=1)
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    return pairs[:limit], total > limit or begin < len(starts)
+
+
+# 四角形の一括検証 (重なり、左右上下の反転、大きさ0、画像の範囲外)
+# size : 画像の (幅, 高さ) (省略時は範囲外の判定をしない)
+def find_conflicts(keys, coords, size=None, version=None):
+    keys = np.asarray(keys, dtype=np.int64)
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 4)
+    x1, y1, x2, y2 = coords.T
+    inverted = keys[(x1 > x2) | (y2 > y1)]
+    empty = keys[(x1 == x2) | (y1 == y2)]
+    if size is not None:
+        width, height = size
+        outside = keys[(coords.min(axis=1) < 0) | (np.maximum(x1, x2) > width) | (np.maximum(y1, y2) > height)]
+    else:
+        outside = np.zeros(0, dtype=np.int64)
+    pairs, truncated = overlapping_pairs(keys, coords)
+    return Conflicts(pairs, inverted, empty, outside, version, truncated)
@@ -0,0 +1,301 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from xml.sax.saxutils import escape
+import numpy as np
+from PIL import Image
+from annotationIO import read_csv_chunks
+from tileRenderer import IMAGE_EXTENSIONS
+from cropExport import CROP_FORMATS, export_crops, parse_size
+
+FORMATS = ('coco', 'yolo', 'voc', 'crops') # 出力形式 (crops : 四角形ごとの切り抜き画像)
+DEFAULT_FORMATS = ('coco', 'yolo', 'voc') # 出力形式の省略時
+QUEUED_PER_WORKER = 4 # ワーカープロセス1つあたりに先行して渡しておく画像数
+PROGRESS_LOG = "progress.log" # 変換済み画像の記録 (中断後の再開用)
+CLASSES_FILE = "classes.txt" # クラス名の一覧 (YOLOのクラス番号 = 行番号、COCOのカテゴリid = 行番号 + 1)
+COCO_IMAGES_PART = "coco_images.part" # COCOの images 要素 (1行1件、最後にまとめて coco.json を作成)
+COCO_ANNOTATIONS_PART = "coco_annotations.part" # COCOの annotations 要素
+
+
+# データセットのディレクトリから (画像の相対パス, 画像パス, CSVパス) を列挙
+# CSVは画像と同じ場所、同じ名前の .csv とし、無い場合は四角形なしの画像として扱う
+def find_pairs(dataset_dir):
+    for root, dirs, files in os.walk(dataset_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            image_path = os.path.join(root, filename)
+            csv_path = os.path.join(root, stem + ".csv")
+            rel = os.path.relpath(image_path, dataset_dir).replace(os.sep, '/')
+            yield rel, image_path, csv_path if os.path.exists(csv_path) else None
+
+
+# 四角形の座標を (xmin, ymin, xmax, ymax) に変換
+# x1,y1 : 左下    x2,y2 : 右上 (画像の y は下向きのため ymin = y2, ymax = y1)
+def to_xyxy(coords):
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 4)
+    return np.stack([np.minimum(coords[:, 0], coords[:, 2]), np.minimum(coords[:, 1], coords[:, 3]),
+                     np.maximum(coords[:, 0], coords[:, 2]), np.maximum(coords[:, 1], coords[:, 3])], axis=1)
+
+
+# Pascal VOC XML の出力
+def write_voc(path, filename, width, height, depth, names, boxes):
+    lines = ["<annotation>",
+             f"  <filename>{escape(filename)}</filename>",
+             f"  <size><width>{width}</width><height>{height}</height><depth>{depth}</depth></size>"]
+    for name, (xmin, ymin, xmax, ymax) in zip(names, boxes.tolist()):
+        lines += ["  <object>",
+                  f"    <name>{escape(name)}</name>",
+                  "    <difficult>0</difficult>",
+                  f"    <bndbox><xmin>{xmin}</xmin><ymin>{ymin}</ymin><xmax>{xmax}</xmax><ymax>{ymax}</ymax></bndbox>",
+                  "  </object>"]
+    lines.append("</annotation>")
+    write_text(path, "\n".join(lines) + "\n")
+
+
+# YOLO txt の出力 (クラス番号 中心x 中心y 幅 高さ、画像サイズで正規化)
+def write_yolo(path, class_ids, boxes, width, height):
+    boxes = boxes.astype(np.float64)
+    rows = np.column_stack([(boxes[:, 0] + boxes[:, 2]) / 2 / width, (boxes[:, 1] + boxes[:, 3]) / 2 / height,
+                            (boxes[:, 2] - boxes[:, 0]) / width, (boxes[:, 3] - boxes[:, 1]) / height])
+    write_text(path, "".join(f"{c} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n"
+                             for c, (x, y, w, h) in zip(class_ids, rows.tolist())))
+
+
+# 一時ファイルに書き込み、完了後に置き換える (中断時に書きかけのファイルを残さない)
+def write_text(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+# 画像1枚分の変換 (ワーカープロセスで実行)
+# 画像はヘッダーのみ読み込んでサイズを取得し、デコードは切り抜き画像を出力する場合のみ行う
+# crop_options : 切り抜き画像の出力設定 (export_crops に渡す padding, size, ext, workers の辞書)
+# 戻り値 : (相対パス, 幅, 高さ, 名前のリスト, (n, 4) の xmin,ymin,xmax,ymax 配列, 問題のあった (箇所, 理由) のリスト)
+def convert_image(rel, image_path, csv_path, out_dir, formats, crop_options=None):
+    with Image.open(image_path) as im:
+        width, height = im.size
+        depth = len(im.getbands())
+
+    names, coords, errors = [], [], []
+    if csv_path:
+        for chunk in read_csv_chunks(csv_path):
+            names.extend(chunk.names)
+            coords.append(chunk.coords)
+            errors.extend((f"{line}行目", reason) for line, reason in chunk.errors)
+    boxes = to_xyxy(np.concatenate(coords) if coords else np.zeros((0, 4)))
+
+    if 'voc' in formats:
+        write_voc(os.path.join(out_dir, "voc", os.path.splitext(rel)[0] + ".xml"),
+                  os.path.basename(rel), width, height, depth, names, boxes)
+    if 'crops' in formats and names:
+        # 画像ごとのディレクトリに id_名前 で出力 (id は表示される id と同じ1始まりの通し番号)
+        _, crop_errors = export_crops(image_path, os.path.join(out_dir, "crops", os.path.splitext(rel)[0]),
+                                      range(1, len(names) + 1), names, boxes, **(crop_options or {}))
+        errors.extend((f"id {iid}", reason) for iid, reason in crop_errors)
+    return rel, width, height, names, boxes, errors
+
+
+# 変換の進捗管理 (メインプロセスで実行)
+# クラス番号の割り当て、COCOの要素、YOLOの出力は全画像で通し番号が必要なためメインプロセスで行う
+class Converter:
+    def __init__(self, out_dir, formats, restart=False):
+        self.out_dir = out_dir
+        self.formats = formats
+        os.makedirs(out_dir, exist_ok=True)
+        self.log_path = os.path.join(out_dir, PROGRESS_LOG)
+        self.classes_path = os.path.join(out_dir, CLASSES_FILE)
+        self.images_path = os.path.join(out_dir, COCO_IMAGES_PART)
+        self.annotations_path = os.path.join(out_dir, COCO_ANNOTATIONS_PART)
+        if restart:
+            for path in (self.log_path, self.classes_path, self.images_path, self.annotations_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        # クラス名の一覧
+        self.classes = {}
+        if os.path.exists(self.classes_path):
+            with open(self.classes_path, encoding="utf-8") as f:
+                for line in f:
+                    self.classes.setdefault(line.rstrip("\n"), len(self.classes))
+
+        # 変換済み画像の記録 (1行1件: [相対パス, images要素のバイト数, annotations要素のバイト数, 次の四角形id])
+        self.done = set()
+        log_size = images_size = annotations_size = 0
+        self.next_ann_id = 1
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break # 書き込み途中で中断された行
+                    try:
+                        rel, images_size, annotations_size, self.next_ann_id = json.loads(line)
+                    except ValueError:
+                        break # 書き込み途中で中断された行
+                    self.done.add(rel)
+                    log_size += len(line)
+        self.next_image_id = len(self.done) + 1
+
+        # 記録、COCOの要素は最後に記録した位置まで戻し、記録されていない画像の分を捨てる
+        self.log_file = self.open_part(self.log_path, log_size)
+        self.images_file = self.open_part(self.images_path, images_size)
+        self.annotations_file = self.open_part(self.annotations_path, annotations_size)
+        self.classes_file = open(self.classes_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def open_part(path, size):
+        f = open(path, "ab")
+        f.truncate(size)
+        f.seek(size)
+        return f
+
+    # クラス名からクラス番号を取得 (新しいクラス名は末尾に追加)
+    def class_id(self, name):
+        cid = self.classes.get(name)
+        if cid is None:
+            cid = self.classes[name] = len(self.classes)
+            self.classes_file.write(name + "\n")
+            self.classes_file.flush()
+        return cid
+
+    # 画像1枚分の変換結果の出力と記録
+    def add(self, rel, width, height, names, boxes):
+        class_ids = [self.class_id(name) for name in names]
+        if 'yolo' in self.formats:
+            write_yolo(os.path.join(self.out_dir, "yolo", os.path.splitext(rel)[0] + ".txt"),
+                       class_ids, boxes, width, height)
+        if 'coco' in self.formats:
+            image_id = self.next_image_id
+            self.images_file.write((json.dumps({"id": image_id, "file_name": rel, "width": width, "height": height},
+                                               ensure_ascii=False) + "\n").encode("utf-8"))
+            lines = []
+            for cid, (xmin, ymin, xmax, ymax) in zip(class_ids, boxes.tolist()):
+                w, h = xmax - xmin, ymax - ymin
+                lines.append(json.dumps({"id": self.next_ann_id, "image_id": image_id, "category_id": cid + 1,
+                                         "bbox": [xmin, ymin, w, h], "area": w * h, "iscrowd": 0}) + "\n")
+                self.next_ann_id += 1
+            self.annotations_file.write("".join(lines).encode("utf-8"))
+            self.images_file.flush()
+            self.annotations_file.flush()
+
+        # 出力が済んでから変換済みとして記録
+        self.log_file.write((json.dumps([rel, self.images_file.tell(), self.annotations_file.tell(),
+                                         self.next_ann_id], ensure_ascii=False) + "\n").encode("utf-8"))
+        self.log_file.flush()
+        self.done.add(rel)
+        self.next_image_id += 1
+
+    # coco.json の作成 (要素は1行ずつ読み出して書き込み、全件をメモリに持たない)
+    def finish(self):
+        for f in (self.images_file, self.annotations_file, self.log_file, self.classes_file):
+            f.close()
+        if 'coco' not in self.formats:
+            return
+        path = os.path.join(self.out_dir, "coco.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as out:
+            out.write('{"images": [')
+            self.copy_lines(self.images_path, out)
+            out.write('],\n"annotations": [')
+            self.copy_lines(self.annotations_path, out)
+            out.write('],\n"categories": ')
+            out.write(json.dumps([{"id": cid + 1, "name": name} for name, cid in self.classes.items()],
+                                 ensure_ascii=False))
+            out.write('}\n')
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def copy_lines(path, out):
+        with open(path, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                out.write((",\n" if i else "\n") + line.rstrip("\n"))
+
+
+# データセット全体の変換
+# 画像ごとの読み込み、VOCの出力はワーカープロセスで並列に行い、先行して渡す画像数を制限してメモリ使用量を抑える
+def convert_dataset(dataset_dir, out_dir, formats=DEFAULT_FORMATS, workers=None, restart=False, log=sys.stderr,
+                    crop_options=None):
+    converter = Converter(out_dir, formats, restart)
+    pairs = (pair for pair in find_pairs(dataset_dir) if pair[0] not in converter.done)
+    converted = failed = 0
+    workers = workers or os.cpu_count() or 1
+    limit = workers * QUEUED_PER_WORKER
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        try:
+            while True:
+                # 先行して渡す画像数の上限まで変換を依頼
+                while len(running) < limit:
+                    pair = next(pairs, None)
+                    if pair is None:
+                        break
+                    rel, image_path, csv_path = pair
+                    running[pool.submit(convert_image, rel, image_path, csv_path, out_dir, formats, crop_options)] = rel
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rel = running.pop(future)
+                    try:
+                        rel, width, height, names, boxes, errors = future.result()
+                    except Exception as e:
+                        # 変換できなかった画像は記録せず、再実行時に再度変換する
+                        print(f"{rel}: 変換に失敗しました: {e}", file=log)
+                        failed += 1
+                        continue
+                    for where, reason in errors:
+                        print(f"{rel}: {where}: {reason}", file=log)
+                    converter.add(rel, width, height, names, boxes)
+                    converted += 1
+                    if converted % 1000 == 0:
+                        print(f"{converted}件変換しました", file=log)
+        finally:
+            # 中断された場合も変換済みの分の記録は残す
+            for future in running:
+                future.cancel()
+            converter.finish()
+    print(f"{converted}件変換しました (変換済み {len(converter.done)}件, 失敗 {failed}件)", file=log)
+    return failed == 0
+
+
+# コマンドライン実行処理
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="座標情報CSVを COCO / YOLO / Pascal VOC 形式、切り抜き画像に変換する")
+    parser.add_argument("dataset", help="画像と同名のCSVを含むディレクトリ")
+    parser.add_argument("-o", "--output", required=True, help="出力先ディレクトリ")
+    parser.add_argument("-f", "--formats", default=",".join(DEFAULT_FORMATS),
+                        help="出力形式 (カンマ区切り、coco,yolo,voc,crops)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="ワーカープロセス数 (省略時はCPU数)")
+    parser.add_argument("--restart", action="store_true", help="変換済みの記録を破棄して最初から変換する")
+    parser.add_argument("--crop-padding", type=int, default=0, help="切り抜き画像で四角形の周囲に加えるピクセル数")
+    parser.add_argument("--crop-size", default="", help="切り抜き画像の出力サイズ (幅x高さ、省略時は切り抜いたまま)")
+    parser.add_argument("--crop-format", default="png", choices=sorted(CROP_FORMATS), help="切り抜き画像の形式")
+    parser.add_argument("--crop-workers", type=int, default=1,
+                        help="画像1枚あたりの切り抜き画像を書き込むワーカースレッド数")
+    args = parser.parse_args(argv)
+
+    formats = tuple(f.strip() for f in args.formats.split(",") if f.strip())
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown:
+        parser.error(f"不明な出力形式です: {','.join(unknown)}")
+    if args.crop_padding < 0:
+        parser.error(f"余白は0以上で指定してください: {args.crop_padding}")
+    try:
+        crop_size = parse_size(args.crop_size)
+    except ValueError as e:
+        parser.error(str(e))
+    crop_options = {'padding': args.crop_padding, 'size': crop_size, 'ext': args.crop_format,
+                    'workers': max(1, args.crop_workers)}
+    return 0 if convert_dataset(args.dataset, args.output, formats, args.workers, args.restart,
+                                crop_options=crop_options) else 1
+
+
+# メイン実行処理
+if __name__ == "__main__":
+    sys.exit(main())
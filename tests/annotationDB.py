@@ -0,0 +1,206 @@
+import os
+import queue
+import sqlite3
+import threading
+import numpy as np
+
+FETCH_ROWS = 50000 # 1回にまとめて読み出す行数
+WRITE_BATCH = 1000 # 1回のトランザクションにまとめる変更数の上限
+LAST_PROJECT_FILE = os.path.join(os.path.expanduser("~"), ".imageViewer_project") # 最後に開いたプロジェクトの記録 (起動時の復元用)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS annotations (
+    image_id INTEGER NOT NULL,
+    key INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    x1 INTEGER NOT NULL, y1 INTEGER NOT NULL, x2 INTEGER NOT NULL, y2 INTEGER NOT NULL,
+    PRIMARY KEY (image_id, key)
+) WITHOUT ROWID;
+-- 以前の版で作成した範囲検索用の索引 (座標情報は読み込み後メモリ上で検索するため使用しない)
+DROP INDEX IF EXISTS annotations_region;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+# 座標情報のプロジェクトデータベース (SQLite、WALモード)
+# 画像パスごとに座標情報を保持し、変更は専用の書き込みスレッドで小さなトランザクションとして反映する
+# 読み出しは呼び出し元のスレッドごとに別の接続で行う (書き込み中も読み出せる)
+class ProjectDB:
+    # on_error : 書き込みに失敗した場合に例外を受け取る関数 (書き込みスレッドから呼び出される)
+    def __init__(self, path, on_error=None):
+        self.path = path
+        self.on_error = on_error
+        self.queue = queue.Queue() # 書き込み待ちの変更
+        conn = self.connect()
+        with conn:
+            conn.executescript(SCHEMA)
+        conn.close()
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # 書き込みスレッド (溜まっている変更をまとめて1トランザクションで反映)
+    def writer(self):
+        conn = self.connect()
+        image_ids = {} # 画像パス -> 画像id
+        while True:
+            ops = [self.queue.get()]
+            while ops[-1] is not None and len(ops) < WRITE_BATCH:
+                try:
+                    ops.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    for op in ops:
+                        if op is not None:
+                            self.apply(conn, image_ids, *op)
+            except sqlite3.Error as e:
+                image_ids.clear()
+                if self.on_error:
+                    self.on_error(e)
+            for _ in ops:
+                self.queue.task_done()
+            if ops[-1] is None:
+                break
+        conn.close()
+
+    # 変更1件の反映 (書き込みスレッドで実行)
+    def apply(self, conn, image_ids, action, path, *args):
+        if action == 'meta':
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (path, args[0]))
+            return
+        image_id = image_ids.get(path)
+        if image_id is None:
+            conn.execute("INSERT OR IGNORE INTO images (path) VALUES (?)", (path,))
+            image_id = image_ids[path] = conn.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone()[0]
+        if action == 'put':
+            conn.executemany("INSERT OR REPLACE INTO annotations (image_id, key, name, x1, y1, x2, y2) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             ((image_id, key, name, *box) for key, name, box in zip(*args)))
+        elif action == 'delete':
+            conn.executemany("DELETE FROM annotations WHERE image_id = ? AND key = ?", ((image_id, key) for key in args[0]))
+        elif action == 'clear':
+            conn.execute("DELETE FROM annotations WHERE image_id = ?", (image_id,))
+
+    # 書き込み待ちの変更が全て反映されるまで待つ
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    # 画像1枚分の変更の記録先
+    def journal(self, path):
+        return ImageJournal(self, path)
+
+    def set_meta(self, key, value):
+        self.queue.put(('meta', key, value))
+
+    def get_meta(self, key):
+        with self.reader() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    # 読み出し用の接続 (with 文で使い、終了時に閉じる)
+    def reader(self):
+        return ReadConnection(self)
+
+    # 画像の座標情報の読み込み (書き込み待ちの変更の反映後に読み出す)
+    # 戻り値 : (キーの配列, 名前のリスト, (n, 4) の座標配列)、プロジェクトに無い画像の場合 None
+    def load(self, path):
+        self.flush()
+        with self.reader() as conn:
+            row = conn.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return None
+            keys, names, coords = [], [], []
+            for chunk_keys, chunk_names, chunk_coords in self.fetch_chunks(conn, row[0]):
+                keys.append(chunk_keys)
+                names.extend(chunk_names)
+                coords.append(chunk_coords)
+        if not keys:
+            return np.zeros(0, dtype=np.int64), [], np.zeros((0, 4), dtype=np.int64)
+        return np.concatenate(keys), names, np.concatenate(coords)
+
+    # 画像の座標情報を表示順に FETCH_ROWS 件ずつ読み出す
+    def fetch_chunks(self, conn, image_id):
+        cursor = conn.execute("SELECT key, name, x1, y1, x2, y2 FROM annotations WHERE image_id = ? ORDER BY key", (image_id,))
+        while True:
+            rows = cursor.fetchmany(FETCH_ROWS)
+            if not rows:
+                break
+            keys, names, *coords = zip(*rows)
+            yield np.array(keys, dtype=np.int64), list(names), np.array(coords, dtype=np.int64).T
+
+    # CSV出力用に画像の座標情報を (名前のリスト, 座標配列) のチャンクで返す
+    def iter_csv_chunks(self, path):
+        self.flush()
+        with self.reader() as conn:
+            row = conn.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return
+            for _, names, coords in self.fetch_chunks(conn, row[0]):
+                yield names, coords
+
+
+# 読み出し用の接続
+class ReadConnection:
+    def __init__(self, db):
+        self.db = db
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.db.connect()
+        return self.conn
+
+    def __exit__(self, *exc):
+        self.conn.close()
+
+
+# 画像1枚分の変更の記録 (AnnotationStore の変更を書き込み待ちに追加する)
+class ImageJournal:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+
+    # 追加、変更 (keys : キーのリスト    names : 名前のリスト    coords : (n, 4) の座標)
+    def put(self, keys, names, coords):
+        self.db.queue.put(('put', self.path, list(keys), list(names), np.asarray(coords).tolist()))
+
+    def delete(self, keys):
+        self.db.queue.put(('delete', self.path, list(keys)))
+
+    def clear(self):
+        self.db.queue.put(('clear', self.path))
+
+
+# 最後に開いたプロジェクトのパス (無い場合 None)
+def last_project():
+    try:
+        with open(LAST_PROJECT_FILE, encoding="utf-8") as f:
+            path = f.read().strip()
+    except OSError:
+        return None
+    return path if path and os.path.exists(path) else None
+
+
+# 最後に開いたプロジェクトの記録
+def remember_project(path):
+    try:
+        with open(LAST_PROJECT_FILE, "w", encoding="utf-8") as f:
+            f.write(path or "")
+    except OSError:
+        pass
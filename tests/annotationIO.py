@@ -0,0 +1,121 @@
+import csv
+import locale
+import os
+import numpy as np
+
+CHUNK_ROWS = 50000 # 1回にまとめて読み書きする行数
+CSV_HEADER = ["id", "name", "x1", "y1", "x2", "y2"]
+COORD_MIN, COORD_MAX = -2**24, 2**24 # 読み込む座標の範囲 (画像の大きさとして扱える範囲。超える行は読み込みエラーとする)
+
+# CSV読み込み結果1チャンク分
+# names : 名前のリスト    coords : (n, 4) の座標配列
+# errors : 読み込めなかった行 (行番号, 理由) のリスト
+# done_bytes, total_bytes : 読み込み済みバイト数、ファイルサイズ
+class CsvChunk:
+    def __init__(self, names, coords, errors, done_bytes, total_bytes):
+        self.names = names
+        self.coords = coords
+        self.errors = errors
+        self.done_bytes = done_bytes
+        self.total_bytes = total_bytes
+
+
+# 1行分の検証と変換 (不正な行は ValueError)
+def parse_row(row):
+    if len(row) != 6:
+        raise ValueError(f"列数が6ではありません ({len(row)}列)")
+    try:
+        int(row[0])
+    except ValueError:
+        raise ValueError(f"idが整数ではありません ({row[0]!r})")
+    try:
+        coords = tuple(int(v) for v in row[2:])
+    except ValueError:
+        raise ValueError(f"座標が整数ではありません ({','.join(row[2:])})")
+    if not all(COORD_MIN <= v <= COORD_MAX for v in coords):
+        raise ValueError(f"座標が範囲外です ({COORD_MIN}～{COORD_MAX})")
+    return row[1], coords
+
+
+# 複数行の変換
+# rows : (行番号, 行) のリスト
+# 通常はまとめて数値変換し、変換できない行がある場合のみ1行ずつ検証して行番号を特定する
+def parse_rows(rows):
+    if all(len(row) == 6 for _, row in rows):
+        try:
+            np.array([row[0] for _, row in rows]).astype(np.int64) # idが整数であることの検証
+            coords = np.array([row[2:] for _, row in rows]).astype(np.int64).reshape(-1, 4)
+            if coords.min() >= COORD_MIN and coords.max() <= COORD_MAX:
+                return [row[1] for _, row in rows], coords, []
+        except (ValueError, OverflowError):
+            pass
+
+    names, coords, errors = [], [], []
+    for line, row in rows:
+        try:
+            name, box = parse_row(row)
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        names.append(name)
+        coords.append(box)
+    return names, np.array(coords, dtype=np.int64).reshape(-1, 4), errors
+
+
+# CSVを分割して読み込み、チャンクごとに返す
+# cancel : 中止フラグ (threading.Event、セットされたら読み込みを止める)
+def read_csv_chunks(filepath, chunk_rows=CHUNK_ROWS, cancel=None):
+    encoding = locale.getpreferredencoding(False)
+    total = os.path.getsize(filepath)
+    with open(filepath, "rb") as f:
+        reader = csv.reader(line.decode(encoding) for line in f)
+        next(reader, None) # ヘッダー行をスキップ
+
+        rows = []
+        for row in reader:
+            if row:
+                rows.append((reader.line_num, row))
+            if len(rows) >= chunk_rows:
+                if cancel is not None and cancel.is_set():
+                    return
+                yield CsvChunk(*parse_rows(rows), f.tell(), total)
+                rows = []
+        if rows and not (cancel is not None and cancel.is_set()):
+            yield CsvChunk(*parse_rows(rows), total, total)
+
+
+# CSV出力 (一時ファイルに書き込み、完了後に置き換える)
+# names : 名前のリスト    coords : (n, 4) の座標配列 (表示順)
+# progress : 書き込み済み行数、全行数を受け取る関数
+# 戻り値 : 最後まで書き込んだか (中止された場合 False)
+def write_csv(filepath, names, coords, cancel=None, progress=None, chunk_rows=CHUNK_ROWS):
+    chunks = ((names[start:start + chunk_rows], coords[start:start + chunk_rows])
+              for start in range(0, len(names), chunk_rows))
+    return write_csv_chunks(filepath, chunks, len(names), cancel, progress)
+
+
+# チャンクごとのCSV出力 (全件をメモリに持たずに書き込む)
+# chunks : (名前のリスト, (n, 4) の座標配列) を表示順に返すイテレーター    total : 全行数
+def write_csv_chunks(filepath, chunks, total, cancel=None, progress=None):
+    tmppath = filepath + ".tmp"
+    cancelled = False
+    done = 0
+    with open(tmppath, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER) # ヘッダー
+        for names, coords in chunks:
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+            writer.writerows([iid, name, *box] for iid, name, box in
+                             zip(range(done + 1, done + len(names) + 1), names, np.asarray(coords).tolist()))
+            done += len(names)
+            if progress:
+                progress(done, max(total, done))
+
+    # 中止された場合は書き込み途中のファイルを削除し、既存のファイルは残す
+    if cancelled:
+        os.remove(tmppath)
+        return False
+    os.replace(tmppath, filepath)
+    return True
@@ -0,0 +1,595 @@
+from array import array
+from collections import defaultdict
+import numpy as np
+
+CELL_SIZE = 256 # 空間インデックスの格子1マスの一辺 (画像上のピクセル数)
+TREE_UPDATE_RATIO = 64 # フェニック木を1件ずつ更新する件数の上限 (容量に対する割合の逆数。超える場合は作り直す)
+MAX_BOX_CELLS = 256 # 格子に登録する四角形1つあたりの格子数の上限 (超える四角形は格子に登録せず、全ての判定で候補にする)
+
+# 2組の四角形の当たり判定行列 (同じ値は当たっていないと判断)
+# boxes, others : (m, 4), (n, 4) の座標配列 x1,y1 : 左下    x2,y2 : 右上
+# 戻り値 : (m, n) の当たり判定行列
+def box_overlap(boxes, others):
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    x1, y1, x2, y2 = (boxes[:, i, None] for i in range(4))
+    ax1, ay1, ax2, ay2 = np.asarray(others, dtype=np.int64).reshape(-1, 4).T
+    return (x1 < ax2) & (x2 > ax1) & (y1 > ay2) & (y2 < ay1)
+
+
+# 四角形の一様格子空間インデックス
+# 四角形が掛かる格子にキーを登録し、点、範囲の当たり判定の候補を絞り込む
+# 掛かる格子が MAX_BOX_CELLS を超える大きな四角形は格子に展開せず large に登録し、常に候補とする
+class GridIndex:
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = defaultdict(lambda: array('q')) # 格子番号 -> 四角形のキー
+        self.large = set() # 格子に登録しない大きな四角形のキー
+
+    # 範囲が掛かる格子番号の範囲 (cx0, cy0, cx1, cy1、cx1, cy1 を含む)
+    def cell_range(self, x1, y1, x2, y2):
+        cs = self.cell_size
+        return (int(min(x1, x2) // cs), int(min(y1, y2) // cs),
+                int(max(x1, x2) // cs), int(max(y1, y2) // cs))
+
+    # 範囲が掛かる格子番号の一覧
+    def cells_of(self, x1, y1, x2, y2):
+        cx0, cy0, cx1, cy1 = self.cell_range(x1, y1, x2, y2)
+        return [(cx, cy) for cy in range(cy0, cy1 + 1) for cx in range(cx0, cx1 + 1)]
+
+    # 格子に展開しない大きな四角形か
+    def is_large(self, coords):
+        cx0, cy0, cx1, cy1 = self.cell_range(*coords)
+        return (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > MAX_BOX_CELLS
+
+    # 四角形の登録
+    def insert(self, key, coords):
+        if self.is_large(coords):
+            self.large.add(key)
+            return
+        for cell in self.cells_of(*coords):
+            self.cells[cell].append(key)
+
+    # 複数の四角形の一括登録
+    # keys : キーの配列    coords : (n, 4) の座標配列
+    def insert_many(self, keys, coords):
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, 4)
+        keys = np.asarray(keys)
+        cs = self.cell_size
+        cx0 = np.minimum(coords[:, 0], coords[:, 2]) // cs
+        cy0 = np.minimum(coords[:, 1], coords[:, 3]) // cs
+        cols = np.maximum(coords[:, 0], coords[:, 2]) // cs - cx0 + 1
+        counts = cols * (np.maximum(coords[:, 1], coords[:, 3]) // cs - cy0 + 1)
+
+        # 大きな四角形は格子に展開しない
+        large = counts > MAX_BOX_CELLS
+        if large.any():
+            self.large.update(keys[large].tolist())
+            small = ~large
+            keys, cx0, cy0, cols, counts = keys[small], cx0[small], cy0[small], cols[small], counts[small]
+
+        # 四角形を掛かる格子ごとの (キー, 格子番号) に展開
+        owner = np.repeat(np.arange(len(keys)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = cx0[owner] + local % cols[owner]
+        cy = cy0[owner] + local // cols[owner]
+
+        # 格子番号ごとにまとめて登録
+        order = np.lexsort((cy, cx))
+        cx, cy, owner = cx[order], cy[order], keys[owner[order]]
+        if not len(owner):
+            return
+        starts = np.flatnonzero(np.r_[True, (np.diff(cx) != 0) | (np.diff(cy) != 0)])
+        ends = np.r_[starts[1:], len(owner)]
+        for start, end, gx, gy in zip(starts.tolist(), ends.tolist(), cx[starts].tolist(), cy[starts].tolist()):
+            self.cells[(gx, gy)].extend(owner[start:end].tolist())
+
+    # 四角形の登録解除 (coords : 登録時の座標)
+    def remove(self, key, coords):
+        if self.is_large(coords):
+            self.large.discard(key)
+            return
+        for cell in self.cells_of(*coords):
+            keys = self.cells.get(cell)
+            if keys and key in keys:
+                keys.remove(key)
+                if not keys:
+                    del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.large.clear()
+
+    # 座標の格子に登録されている四角形のキー
+    def point_candidates(self, x, y):
+        keys = self.cells.get((int(x // self.cell_size), int(y // self.cell_size)), ())
+        return list(keys) + list(self.large) if self.large else keys
+
+    # 範囲に掛かる格子に登録されている四角形のキー (当たり判定の候補)
+    # 範囲の格子数が登録済みの格子数より多い場合は、登録済みの格子から範囲内の格子を探す
+    def candidates(self, x1, y1, x2, y2):
+        found = set(self.large)
+        cx0, cy0, cx1, cy1 = self.cell_range(x1, y1, x2, y2)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            for (cx, cy), keys in self.cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    found.update(keys)
+            return found
+        for cell in self.cells_of(x1, y1, x2, y2):
+            keys = self.cells.get(cell)
+            if keys:
+                found.update(keys)
+        return found
+
+
+# 有効な四角形のキーの累積個数を管理するフェニック木
+# キーの並び順 = 表示順とし、キーからid(表示順の番号)、idからキーを O(log n) で求める
+class OrderTree:
+    def __init__(self, capacity=1024):
+        self.size = capacity
+        self.tree = [0] * (capacity + 1)
+        self.alive = bytearray(capacity + 1) # キーごとの有効フラグ
+
+    # 容量を拡張し、有効フラグから木を作り直す (O(n))
+    def grow(self, key):
+        size = self.size
+        while size < key:
+            size *= 2
+        self.alive += bytearray(size - self.size)
+        self.size = size
+        self.rebuild()
+
+    # 有効フラグ配列から木を作り直す (O(n))
+    def rebuild(self):
+        alive = np.frombuffer(bytes(self.alive), dtype=np.uint8).astype(np.int64)
+        prefix = np.cumsum(alive)
+        idx = np.arange(1, self.size + 1)
+        tree = prefix[idx] - prefix[idx - (idx & -idx)]
+        self.tree = [0] + tree.tolist()
+
+    # first 以上 last 未満のキーを一括で有効にする
+    # 範囲内の節点と、範囲の末尾のキーを含む後ろの節点のみ更新する (O(範囲の長さ + log n))
+    def fill(self, first, last):
+        if last - 1 > self.size:
+            self.grow(last - 1)
+        old = np.frombuffer(bytes(self.alive[first:last]), dtype=np.uint8).astype(np.int64)
+        self.alive[first:last] = b'\x01' * (last - first)
+        # added[i] : first から first + i - 1 までのキーのうち新たに有効にした数
+        added = np.concatenate([[0], np.cumsum(1 - old)])
+        nodes = np.arange(first, last)
+        lower = np.maximum(nodes - (nodes & -nodes), first - 1) - (first - 1)
+        self.tree[first:last] = (np.array(self.tree[first:last], dtype=np.int64) + added[1:] - added[lower]).tolist()
+        key = last - 1
+        key += key & -key
+        while key <= self.size:
+            self.tree[key] += int(added[-1] - added[max(key - (key & -key), first - 1) - (first - 1)])
+            key += key & -key
+
+    # 指定したキーの有効フラグを一括で変更
+    # 容量に比べて少数の場合は1件ずつ O(log n) で更新し、多い場合は木を作り直す
+    def set_many(self, keys, flag):
+        last = int(keys.max())
+        if last > self.size:
+            self.grow(last)
+        if len(keys) <= self.size // TREE_UPDATE_RATIO:
+            for key in keys.tolist():
+                self.set(key, flag)
+            return
+        np.frombuffer(self.alive, dtype=np.uint8)[keys] = flag
+        self.rebuild()
+
+    def set(self, key, flag):
+        if key > self.size:
+            self.grow(key)
+        delta = flag - self.alive[key]
+        if not delta:
+            return
+        self.alive[key] = flag
+        while key <= self.size:
+            self.tree[key] += delta
+            key += key & -key
+
+    # キー以下の有効な四角形の個数 (= キーのid)
+    def rank(self, key):
+        key = min(key, self.size)
+        total = 0
+        while key > 0:
+            total += self.tree[key]
+            key -= key & -key
+        return total
+
+    # 先頭から数えて n 番目の有効なキー
+    def select(self, n):
+        key = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = key + step
+            if nxt <= self.size and self.tree[nxt] < n:
+                key = nxt
+                n -= self.tree[nxt]
+            step >>= 1
+        return key + 1
+
+    def clear(self):
+        self.tree = [0] * (self.size + 1)
+        self.alive = bytearray(self.size + 1)
+
+
+# 座標情報1件分の参照
+# 値は AnnotationStore の配列に保持し、ann['name'] のように辞書と同じ形で参照する
+class Annotation:
+    __slots__ = ('store', 'key')
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+
+    def __getitem__(self, field):
+        if field == 'key':
+            return self.key
+        if field == 'name':
+            return self.store.names[self.key]
+        if field == 'image_coords':
+            return tuple(self.store.coords[self.key].tolist())
+        raise KeyError(field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    # 現在の値を辞書で複製 (取り消し処理用)
+    def copy(self):
+        return {'key': self.key, 'name': self['name'], 'image_coords': self['image_coords']}
+
+    def __eq__(self, other):
+        return isinstance(other, Annotation) and other.store is self.store and other.key == self.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"Annotation({self.copy()})"
+
+
+# 座標情報の保持
+# 四角形ごとに変化しないキーを割り当て、キーを行番号とした座標配列 (x1,y1,x2,y2)、名前表に保持する
+# 表示されるid (1始まりの表示順) は削除で詰め直さずキーの順位から求める
+class AnnotationStore:
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.coords = np.zeros((capacity, 4), dtype=np.int32) # キー -> x1,y1,x2,y2
+        self.alive = np.zeros(capacity, dtype=bool) # キー -> 有効フラグ
+        self.names = [''] * capacity # キー -> 名前
+        self.count = 0 # 有効な四角形の数
+        self.order = OrderTree() # 表示順
+        self.index = GridIndex() # 当たり判定用の空間インデックス
+        self.next_key = 1 # 次に追加する四角形のキー (0は未使用)
+        self.journal = None # 変更の記録先 (プロジェクトデータベースに保存する場合のみ)
+        self.listeners = [] # 変更の通知先 (全体表示など。journal と同じく put, delete, clear を持つ)
+        self.version = 0 # 変更のたびに増える番号 (検証結果などが最新か判定する)
+
+    def __len__(self):
+        return self.count
+
+    # 表示順に座標情報を取得
+    def __iter__(self):
+        return self.iter_from(0)
+
+    # 指定キーより後ろの座標情報を表示順に取得
+    def iter_from(self, key):
+        for k in self.keys(key).tolist():
+            yield Annotation(self, k)
+
+    # 指定キーより後ろの有効なキーの配列 (表示順)
+    def keys(self, after=0):
+        return np.flatnonzero(self.alive[after + 1:self.next_key]) + (after + 1)
+
+    # 配列の容量拡張
+    def grow(self, key):
+        capacity = self.capacity
+        while capacity <= key:
+            capacity *= 2
+        coords = np.zeros((capacity, 4), dtype=np.int32)
+        coords[:self.capacity] = self.coords
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.capacity] = self.alive
+        self.names.extend([''] * (capacity - self.capacity))
+        self.coords, self.alive, self.capacity = coords, alive, capacity
+
+    # 末尾に四角形を追加
+    def add(self, name, coords):
+        return self.restore({'key': self.next_key, 'name': name, 'image_coords': coords})
+
+    # 削除した四角形を元の表示位置に戻す
+    def restore(self, ann):
+        self.version += 1
+        key = ann['key']
+        if key >= self.capacity:
+            self.grow(key)
+        if not self.alive[key]:
+            self.count += 1
+        else:
+            self.index.remove(key, self.coords[key].tolist())
+        self.names[key] = ann['name']
+        self.coords[key] = ann['image_coords']
+        self.alive[key] = True
+        self.order.set(key, 1)
+        self.index.insert(key, ann['image_coords'])
+        self.next_key = max(self.next_key, key + 1)
+        self.notify('put', [key], [ann['name']], [self.coords[key]])
+        return Annotation(self, key)
+
+    # 削除 (配列の値は取り消し処理で戻せるよう残す)
+    def remove(self, key):
+        self.version += 1
+        self.alive[key] = False
+        self.count -= 1
+        self.order.set(key, 0)
+        self.index.remove(key, self.coords[key].tolist())
+        self.notify('delete', [key])
+        return Annotation(self, key)
+
+    # 名前、座標の変更 (Noneの項目は変更しない。削除済みのキーは KeyError)
+    def update(self, key, name=None, coords=None):
+        if not self.get(key):
+            raise KeyError(key)
+        self.version += 1
+        if name is not None:
+            self.names[key] = name
+        if coords is not None:
+            self.index.remove(key, self.coords[key].tolist())
+            self.coords[key] = coords
+            self.index.insert(key, coords)
+        self.notify('put', [key], [self.names[key]], [self.coords[key]])
+        return Annotation(self, key)
+
+    # 変更の記録先、通知先への通知
+    def notify(self, action, *args):
+        if self.journal:
+            getattr(self.journal, action)(*args)
+        for listener in self.listeners:
+            getattr(listener, action)(*args)
+
+    def get(self, key):
+        if 0 < key < self.next_key and self.alive[key]:
+            return Annotation(self, key)
+        return None
+
+    # キーから表示されるidを取得
+    def id_of(self, key):
+        return self.order.rank(key)
+
+    # 表示されるidからキーを取得
+    def key_of(self, iid):
+        if iid < 1 or iid > self.count:
+            return None
+        return self.order.select(iid)
+
+    def clear(self):
+        self.version += 1
+        self.coords[:self.next_key] = 0
+        self.alive[:] = False
+        self.names = [''] * self.capacity
+        self.count = 0
+        self.order.clear()
+        self.index.clear()
+        self.next_key = 1
+        self.notify('clear')
+
+    # 削除済みの行を詰め、キーを振り直す (表示順、表示されるidは変わらない)
+    # keep : 削除済みでも残すキーの配列 (取り消し記録から参照されているキーなど。有効なキーは常に残す)
+    # 配列は残すキーの数に合わせて作り直し、記録先、通知先には全件を記録し直す
+    # 戻り値 : 元のキー -> 新しいキーの配列 (残さないキーは0)
+    def compact(self, keep=()):
+        self.version += 1
+        keep = np.asarray(keep, dtype=np.int64)
+        kept = self.alive[:self.next_key].copy()
+        kept[keep[(keep > 0) & (keep < self.next_key)]] = True
+        old = np.flatnonzero(kept)
+        mapping = np.zeros(self.next_key, dtype=np.int64)
+        mapping[old] = np.arange(1, len(old) + 1)
+
+        capacity = 1024
+        while capacity <= len(old):
+            capacity *= 2
+        coords = np.zeros((capacity, 4), dtype=np.int32)
+        coords[1:len(old) + 1] = self.coords[old]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[1:len(old) + 1] = self.alive[old]
+        names = [''] * capacity
+        names[1:len(old) + 1] = [self.names[key] for key in old.tolist()]
+        self.coords, self.alive, self.names, self.capacity = coords, alive, names, capacity
+        self.next_key = len(old) + 1
+
+        keys = self.keys()
+        self.order = OrderTree()
+        if len(keys):
+            self.order.set_many(keys, 1)
+        self.index.clear()
+        self.index.insert_many(keys, self.coords[keys])
+        self.notify('clear')
+        if len(keys):
+            self.notify('put', keys.tolist(), [self.names[key] for key in keys.tolist()], self.coords[keys])
+        return mapping
+
+    # 複数の四角形を一括で末尾に追加
+    # names : 名前のリスト    coords : (n, 4) の座標配列
+    # keys : 割り当てるキーの配列 (昇順、既存のキーより後ろ。保存済みの座標情報を読み込む場合のみ指定)
+    # 戻り値 : 追加した四角形のキーの配列
+    def extend(self, names, coords, keys=None):
+        self.version += 1
+        coords = np.asarray(coords, dtype=np.int32).reshape(-1, 4)
+        if not len(coords):
+            return np.zeros(0, dtype=np.int64)
+        first = self.next_key
+        if keys is None:
+            keys = np.arange(first, first + len(coords))
+        keys = np.asarray(keys, dtype=np.int64)
+        last = int(keys[-1]) + 1
+        if last > self.capacity:
+            self.grow(last)
+        self.coords[keys] = coords
+        self.alive[keys] = True
+        if keys[0] == first and last - first == len(keys):
+            self.names[first:last] = names
+            self.order.fill(first, last)
+        else:
+            for key, name in zip(keys.tolist(), names):
+                self.names[key] = name
+            self.order.set_many(keys, 1)
+        self.count += len(coords)
+        self.next_key = last
+        self.index.insert_many(keys, coords)
+        self.notify('put', keys.tolist(), names, coords)
+        return keys
+
+    # 複数の四角形を一括で削除 (配列の値は取り消し処理で戻せるよう残す)
+    # keys : キーの配列 (削除済みのキーは無視する)
+    def remove_many(self, keys):
+        self.version += 1
+        keys = np.asarray(keys, dtype=np.int64)
+        keys = keys[self.alive[keys]]
+        if not len(keys):
+            return
+        self.alive[keys] = False
+        self.count -= len(keys)
+        self.order.set_many(keys, 0)
+        if len(keys) > self.count:
+            # 残りの方が少ない場合は空間インデックスを作り直す
+            self.index.clear()
+            rest = self.keys()
+            self.index.insert_many(rest, self.coords[rest])
+        else:
+            for key, coords in zip(keys.tolist(), self.coords[keys].tolist()):
+                self.index.remove(key, coords)
+        self.notify('delete', keys.tolist())
+
+    # 削除した複数の四角形を配列に残っている値で一括で元の表示位置に戻す
+    # keys : 削除済みのキーの配列 (有効なキーは無視する)
+    def restore_many(self, keys):
+        self.version += 1
+        keys = np.asarray(keys, dtype=np.int64)
+        keys = keys[~self.alive[keys]]
+        if not len(keys):
+            return
+        self.alive[keys] = True
+        self.count += len(keys)
+        self.order.set_many(keys, 1)
+        self.index.insert_many(keys, self.coords[keys])
+        self.next_key = max(self.next_key, int(keys.max()) + 1)
+        self.notify('put', keys.tolist(), [self.names[key] for key in keys.tolist()], self.coords[keys])
+
+    # 複数の四角形の名前、座標を一括で変更 (Noneの項目は変更しない)
+    # keys : 有効なキーの配列    names : 名前のリスト    coords : (n, 4) の座標配列
+    def update_many(self, keys, names=None, coords=None):
+        self.version += 1
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(keys):
+            return
+        if names is not None:
+            for key, name in zip(keys.tolist(), names):
+                self.names[key] = name
+        if coords is not None:
+            for key, old in zip(keys.tolist(), self.coords[keys].tolist()):
+                self.index.remove(key, old)
+            self.coords[keys] = np.asarray(coords, dtype=np.int32).reshape(-1, 4)
+            self.index.insert_many(keys, self.coords[keys])
+        self.notify('put', keys.tolist(), [self.names[key] for key in keys.tolist()], self.coords[keys])
+
+    # 拡大率分変換したキャンバス上の座標 (keys 省略時は全件、表示順)
+    def canvas_coords(self, scale, keys=None):
+        if keys is None:
+            keys = self.keys()
+        return self.coords[keys] * scale
+
+    # 候補の四角形と保持している四角形の当たり判定を一括で行う (同じ値は当たっていないと判断)
+    # boxes : (m, 4) の候補座標 x1,y1 : 左下    x2,y2 : 右上
+    # keys : 判定対象のキー (省略時は全件)
+    # 戻り値 : (m, len(keys)) の当たり判定行列
+    def overlap_matrix(self, boxes, keys=None):
+        if keys is None:
+            keys = self.keys()
+        return box_overlap(boxes, self.coords[keys])
+
+    # 複数の四角形の一括変更で、変更後の座標が他の四角形、変更する四角形同士で当たっているか
+    # 変更後の座標を一時的な格子に登録し、同じ格子に登録されている四角形のみ判定する (大きな四角形は全件と判定)
+    # keys : 変更する四角形のキーの配列    coords : 変更後の (n, 4) の座標配列
+    # 戻り値 : 当たっている四角形の keys 内の位置の配列
+    def batch_hits(self, keys, coords):
+        keys = np.asarray(keys, dtype=np.int64)
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, 4)
+        grid = GridIndex(self.index.cell_size)
+        grid.insert_many(np.arange(len(keys)), coords)
+        changing = set(keys.tolist())
+        hits = np.zeros(len(keys), dtype=bool)
+        for cell, positions in grid.cells.items():
+            positions = np.frombuffer(positions, dtype=np.int64)
+            boxes = coords[positions]
+            others = [key for key in self.index.cells.get(cell, ()) if key not in changing]
+            if others:
+                hits[positions[self.overlap_matrix(boxes, others).any(axis=1)]] = True
+            if len(positions) > 1:
+                matrix = box_overlap(boxes, boxes)
+                np.fill_diagonal(matrix, False)
+                hits[positions[matrix.any(axis=1)]] = True
+
+        # 格子に登録しない大きな四角形 (変更後の大きな四角形は変更しない四角形、変更する四角形の全件と判定)
+        large = np.fromiter(grid.large, dtype=np.int64)
+        if len(large):
+            rest = self.keys()
+            rest = rest[~np.isin(rest, keys)]
+            hits[large[self.overlap_matrix(coords[large], rest).any(axis=1)]] = True
+            matrix = box_overlap(coords[large], coords)
+            matrix[np.arange(len(large)), large] = False
+            hits[large[matrix.any(axis=1)]] = True
+            hits[matrix.any(axis=0)] = True
+        others = [key for key in self.index.large if key not in changing]
+        if others:
+            hits[self.overlap_matrix(coords, others).any(axis=1)] = True
+        return np.flatnonzero(hits)
+
+    # 範囲に一部でも掛かる四角形のキー (表示順)
+    def keys_in_region(self, x1, y1, x2, y2):
+        keys = self.keys()
+        ax1, ay1, ax2, ay2 = self.coords[keys].T
+        left, right = min(x1, x2), max(x1, x2)
+        top, bottom = min(y1, y2), max(y1, y2)
+        inside = (np.minimum(ax1, ax2) <= right) & (np.maximum(ax1, ax2) >= left) & \
+                 (np.minimum(ay1, ay2) <= bottom) & (np.maximum(ay1, ay2) >= top)
+        return keys[inside]
+
+    # キーを列の値で並べ替え (同じ値の四角形は表示順)
+    # column : 'name', 'x1', 'y1', 'x2', 'y2' のいずれか
+    def sort_keys(self, keys, column, descending=False):
+        if column == 'name':
+            values = np.array([self.names[key] for key in keys.tolist()], dtype=str)
+        else:
+            values = self.coords[keys, ('x1', 'y1', 'x2', 'y2').index(column)].astype(np.int64)
+        order = np.argsort(values, kind='stable')
+        return keys[order[::-1]] if descending else keys[order]
+
+    # 名前に文字列を含む四角形のキー (表示順)
+    def keys_named(self, text, keys=None):
+        if keys is None:
+            keys = self.keys()
+        names = np.array([self.names[key] for key in keys.tolist()], dtype=str)
+        return keys[np.char.find(names, text) >= 0] if len(keys) else keys
+
+    # 座標を含む四角形のうち表示順が最も先頭の四角形 (同じ値は当たっていると判断)
+    # ax1,ay1 : 左下    ax2,ay2 : 右上
+    def hit_point(self, x, y):
+        keys = np.fromiter(self.index.point_candidates(x, y), dtype=np.int64)
+        if not len(keys):
+            return None
+        ax1, ay1, ax2, ay2 = self.coords[keys].T
+        keys = keys[(x >= ax1) & (x <= ax2) & (y <= ay1) & (y >= ay2)]
+        return Annotation(self, int(keys.min())) if len(keys) else None
+
+    # 四角形と当たっている四角形があるか (skip_key の四角形は除く)
+    def hit_rect(self, x1, y1, x2, y2, skip_key=0):
+        keys = np.fromiter(self.index.candidates(x1, y1, x2, y2), dtype=np.int64)
+        keys = keys[keys != skip_key]
+        if not len(keys):
+            return False
+        return bool(self.overlap_matrix((x1, y1, x2, y2), keys).any())
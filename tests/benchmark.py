@@ -0,0 +1,436 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+try:
+    import resource # 最大常駐メモリの取得 (Windows には無く、画像の計測も tracemalloc で行う)
+except ImportError:
+    resource = None
+from PIL import Image
+import annotationDB
+from annotations import AnnotationStore
+from annotationIO import read_csv_chunks, write_csv
+from tileRenderer import load_image
+
+BOX_COUNTS = (100, 10000, 100000, 1000000) # 四角形数 (既定値)
+MEGAPIXELS = (1, 16, 64) # 画像サイズ (メガピクセル、既定値)
+REPEAT = 5 # 1項目あたりの計測回数 (中央値を結果とする)
+QUERIES = 2000 # 当たり判定の計測で1回に行う判定数
+CHUNK_ROWS = 5000 # チャンクごとの追加の計測での1チャンクの行数 (CSV読み込みで画面に反映する行数と同じ)
+VIEW_SIZE = (1920, 1080) # 描画計測時の表示範囲 (キャンバス上のピクセル数)
+BOX_SPACE = (20000, 15000) # 画像を使わない計測で四角形を配置する範囲
+THRESHOLD = 0.25 # 比較時に劣化と判断する増加率
+MIN_SECONDS = 0.002 # 比較時に劣化と判断する最小の差 (これより短い差は誤差とみなす)
+MIN_BYTES = 1024 * 1024 # 比較時に劣化と判断する最小のメモリ差
+TK_TIMEOUT = 600 # Tk の計測で1回の処理完了を待つ上限秒数
+NAMES = ('cat', 'dog', 'car', 'person', 'bicycle', 'bird', 'sign', 'tree') # 生成する四角形の名前
+
+
+# 合成画像の作成 (同じサイズ、形式の画像が作業ディレクトリにあれば再利用)
+# 小さな乱数画像を拡大して作るため、圧縮率、デコード時間は写真に近くなる
+def make_image(directory, megapixels, ext=".jpg", seed=0):
+    path = os.path.join(directory, f"synthetic_{megapixels}mp{ext}")
+    if os.path.exists(path):
+        return path
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(height // 64, 2), max(width // 64, 2), 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+    image.save(path + ".tmp", format=Image.registered_extensions()[ext], quality=90)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+# 重ならない四角形の生成 (範囲を格子に分け、1マスに1つずつ大きさ、位置をずらして配置)
+# 戻り値 : (名前のリスト, (n, 4) の座標配列)  x1,y1 : 左下    x2,y2 : 右上
+def make_boxes(n, width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    cols = max(int(np.ceil((n * width / height) ** 0.5)), 1)
+    rows = (n + cols - 1) // cols
+    cw, ch = width / cols, height / rows
+    cell = np.arange(n)
+    left, top = (cell % cols) * cw, (cell // cols) * ch
+    bw = np.maximum(cw * rng.uniform(0.3, 0.9, n), 1)
+    bh = np.maximum(ch * rng.uniform(0.3, 0.9, n), 1)
+    x1 = left + rng.uniform(0, 1, n) * (cw - bw)
+    y2 = top + rng.uniform(0, 1, n) * (ch - bh)
+    coords = np.stack([x1, y2 + bh, x1 + bw, y2], axis=1).astype(np.int64)
+    names = [NAMES[i] for i in rng.integers(0, len(NAMES), n).tolist()]
+    return names, coords
+
+
+# 当たり判定の問い合わせ座標 (四角形の範囲内外が混ざるよう範囲全体から一様に選ぶ)
+def make_queries(count, width, height, seed=1):
+    rng = np.random.default_rng(seed)
+    x = rng.integers(0, width, count)
+    y = rng.integers(0, height, count)
+    size = rng.integers(5, 80, count)
+    return np.stack([x, y + size, x + size, y], axis=1).tolist()
+
+
+# 計測結果の記録
+class Results:
+    def __init__(self, repeat=REPEAT):
+        self.repeat = repeat
+        self.entries = {} # 項目名 -> 結果
+
+    # 処理時間、メモリ使用量のピークの計測
+    # func : 計測する処理 (setup の戻り値を引数に受け取る)
+    # setup : 計測ごとの準備 (計測時間に含めない、省略時は引数なし)
+    # 時間は repeat 回の中央値、メモリは別に1回 tracemalloc で Python、numpy の確保量を計測する
+    # isolate : 別プロセスで実行して最大常駐メモリの増加量を計測する画像の処理 (image_task の引数)
+    #           tracemalloc では Pillow の C の確保量が計測されないため、画像のデコード、描画に使う
+    def measure(self, name, func, setup=None, repeat=None, isolate=None, **params):
+        times = []
+        for _ in range(repeat or self.repeat):
+            args = setup() if setup else ()
+            gc.collect()
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+            del args
+
+        if isolate and resource is not None:
+            peak = isolated_peak(isolate)
+            memory = "rss"
+        else:
+            args = setup() if setup else ()
+            gc.collect()
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            func(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del args
+            memory = "tracemalloc"
+
+        self.entries[name] = {"seconds": statistics.median(times), "min": min(times), "repeat": len(times),
+                              "peak_bytes": peak, "memory": memory, "params": params}
+        print(f"{name:<40} {statistics.median(times) * 1000:10.2f} ms {peak / 1024 / 1024:10.1f} MB", flush=True)
+
+    # 計測できなかった項目の記録
+    def skip(self, name, reason):
+        self.entries[name] = {"skipped": reason}
+        print(f"{name:<40} skipped: {reason}", flush=True)
+
+    def to_json(self):
+        return {
+            "meta": {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "numpy": np.__version__,
+                "pillow": Image.__version__,
+                "repeat": self.repeat,
+            },
+            "results": self.entries,
+        }
+
+
+# 座標情報の計測 (表示なし)
+def bench_annotations(results, counts, workdir):
+    width, height = BOX_SPACE
+    queries = make_queries(QUERIES, width, height)
+    for n in counts:
+        names, coords = make_boxes(n, width, height)
+
+        def filled():
+            store = AnnotationStore()
+            store.extend(names, coords)
+            return (store,)
+
+        results.measure(f"store.extend/n={n}", lambda: AnnotationStore().extend(names, coords), n=n)
+
+        # チャンクごとの追加 (CSV読み込みで画面に反映する単位。チャンクが後ろになっても遅くならない)
+        def extend_chunks():
+            store = AnnotationStore()
+            for start in range(0, n, CHUNK_ROWS):
+                store.extend(names[start:start + CHUNK_ROWS], coords[start:start + CHUNK_ROWS])
+        results.measure(f"store.extend_chunks/n={n}", extend_chunks, n=n, chunk=CHUNK_ROWS)
+
+        store, = filled()
+        keys = store.keys()
+
+        # 当たり判定 (hit_square、hit_vertex と同じ処理)
+        results.measure(f"hit_square/n={n}", lambda: [store.hit_rect(*q) for q in queries], n=n, queries=QUERIES)
+        results.measure(f"hit_vertex/n={n}", lambda: [store.hit_point(q[0], q[3]) for q in queries], n=n, queries=QUERIES)
+
+        # リスト表示の表示対象 (refresh_tree と同じ処理)
+        results.measure(f"list.keys/n={n}", store.keys, n=n)
+        results.measure(f"list.sort_name/n={n}", lambda: store.sort_keys(keys, 'name'), n=n)
+        results.measure(f"list.sort_x1/n={n}", lambda: store.sort_keys(keys, 'x1', True), n=n)
+        results.measure(f"list.filter_name/n={n}", lambda: store.keys_named('ca', keys), n=n)
+        results.measure(f"list.filter_region/n={n}", lambda: store.keys_in_region(0, height // 2, width // 2, 0), n=n)
+
+        # 全件の削除、復元 (CSV読み込みの取り消し、再実行と同じ処理)
+        results.measure(f"store.remove_restore/n={n}",
+                        lambda s: (s.remove_many(s.keys()), s.restore_many(np.arange(1, n + 1))), setup=filled, n=n)
+
+        # 選択中の1件の削除と取り消し (Delete キー、Ctrl+Z と同じ処理。件数によらず O(log n))
+        one = np.array([n // 2 + 1])
+        results.measure(f"store.delete_one/n={n}", lambda s: (s.remove_many(one), s.restore_many(one)), setup=filled, n=n)
+
+        # CSVの書き込み、読み込み
+        csv_path = os.path.join(workdir, f"boxes_{n}.csv")
+        results.measure(f"csv.write/n={n}", lambda: write_csv(csv_path, names, coords), n=n)
+        results.measure(f"csv.read/n={n}", lambda: [chunk for chunk in read_csv_chunks(csv_path)], n=n)
+
+
+# 表示範囲の中央のタイル描画
+def render_view(renderer, scale):
+    vw, vh = VIEW_SIZE
+    sw, sh = renderer.scaled_size(scale)
+    x0, y0 = (sw - min(sw, vw)) // 2, (sh - min(sh, vh)) // 2
+    for tile in renderer.visible_tiles(scale, x0, y0, x0 + min(sw, vw), y0 + min(sh, vh), margin=0):
+        renderer.render_tile(scale, *tile)
+
+
+# 画像の計測処理 (別プロセスでも同じ処理を作れるよう、種類と引数の文字列から作る)
+# kind : 'open' 読み込み, 'render' 描画    path : 画像ファイル    scale : 描画の拡大率
+# 戻り値 : (計測する処理, 引数)
+def image_task(kind, path, scale=None):
+    if kind == 'open':
+        return load_image, (path,)
+    return render_view, (load_image(path), float(scale))
+
+
+# 常駐メモリ (バイト)
+# field : /proc/self/status の項目 (VmRSS 現在、VmHWM 最大)
+# /proc の無い環境では最大常駐メモリ (ru_maxrss、Linux では exec 前の親プロセスの値を引き継ぐため /proc を優先)
+def rss(field="VmRSS"):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+# 最大常駐メモリを現在の常駐メモリに戻す (Linux のみ。戻せない場合は何もしない)
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+# 画像の処理を別プロセスで1回実行した時の、処理前の常駐メモリからの最大常駐メモリの増加量
+# (準備、モジュール読み込みの分は含めない)
+def isolated_peak(task):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--peak-rss", *map(str, task)],
+                            capture_output=True, text=True, check=True)
+    return int(result.stdout.split()[-1])
+
+
+# 表示範囲のタイル描画の計測 (表示なし、毎回読み込み直してキャッシュなしの状態から描画)
+def bench_render(results, megapixels, workdir):
+    vw, vh = VIEW_SIZE
+    for mp in megapixels:
+        path = make_image(workdir, mp)
+        results.measure(f"image.open/mp={mp}", lambda: load_image(path), isolate=('open', path), mp=mp)
+        size = load_image(path).image.size
+        fit = min(vw / size[0], vh / size[1], 1.0)
+        for label, scale in (("fit", fit), ("1x", 1.0)):
+            results.measure(f"image.render_{label}/mp={mp}", render_view,
+                            setup=lambda scale=scale: (load_image(path), scale),
+                            isolate=('render', path, scale), mp=mp, scale=scale)
+
+
+# 仮想画面 (Xvfb) の起動 (DISPLAY が設定されている場合はその画面を使う)
+# 戻り値 : 起動した Xvfb のプロセス (起動していない場合 None)
+def start_display():
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"):
+        return None
+    xvfb = shutil.which("Xvfb")
+    if xvfb is None:
+        raise RuntimeError("DISPLAY が無く、Xvfb も見つかりません")
+    display = 90 + os.getpid() % 100
+    process = subprocess.Popen([xvfb, f":{display}", "-screen", "0", "1920x1080x24", "-nolisten", "tcp"],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while not os.path.exists(f"/tmp/.X11-unix/X{display}"):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError("Xvfb を起動できませんでした")
+        time.sleep(0.05)
+    os.environ["DISPLAY"] = f":{display}"
+    return process
+
+
+# 画面表示を含む処理の計測 (AnnotatorApp を実際に作成し、処理が完了して画面が更新されるまでを計測)
+def bench_tk(results, counts, megapixels, workdir):
+    import tkinter as tk
+    import imageViewer
+
+    # 利用者の前回のプロジェクトを開かないようにする
+    annotationDB.LAST_PROJECT_FILE = os.path.join(workdir, "last_project")
+
+    root = tk.Tk()
+    root.geometry(f"{VIEW_SIZE[0]}x{VIEW_SIZE[1]}")
+    app = imageViewer.AnnotatorApp(root)
+    root.update()
+
+    # 条件を満たすまでイベントを処理し、描画待ちの処理が無くなるまで画面を更新
+    def run_until(done):
+        deadline = time.monotonic() + TK_TIMEOUT
+        while not done():
+            if time.monotonic() > deadline:
+                raise TimeoutError("処理が完了しませんでした")
+            root.update()
+            time.sleep(0.001)
+        while app.render_job is not None or app.list_job is not None:
+            root.update()
+        root.update_idletasks()
+
+    def open_image(path):
+        app.open_image(path)
+        run_until(lambda: not app.loading)
+
+    def import_csv(csv_path):
+        app.import_csv_file(csv_path)
+        run_until(lambda: app.io_cancel is None)
+
+    try:
+        for mp in megapixels:
+            path = make_image(workdir, mp)
+            results.measure(f"tk.open_image/mp={mp}", open_image, setup=lambda: (path,), mp=mp)
+
+        # 四角形数ごとの計測は最も小さい画像で行う
+        path = make_image(workdir, min(megapixels))
+        open_image(path)
+        width, height = app.image.size
+        queries = make_queries(QUERIES, width, height)
+        for n in counts:
+            names, coords = make_boxes(n, width, height)
+            csv_path = os.path.join(workdir, f"boxes_{n}_{width}x{height}.csv")
+            write_csv(csv_path, names, coords)
+            results.measure(f"tk.import_csv/n={n}", import_csv, setup=lambda: (csv_path,), n=n)
+
+            def update_image():
+                app.update_image()
+                run_until(lambda: True)
+            results.measure(f"tk.update_image/n={n}", update_image, n=n)
+
+            def refresh_tree():
+                app.refresh_tree()
+                run_until(lambda: True)
+            results.measure(f"tk.refresh_tree/n={n}", refresh_tree, n=n)
+
+            def zoom():
+                app.scale = 0.5 if app.scale == 1.0 else 1.0
+                app.request_render(rescale=True)
+                run_until(lambda: True)
+            results.measure(f"tk.zoom/n={n}", zoom, n=n)
+
+            results.measure(f"tk.hit_square/n={n}", lambda: [app.hit_square(*q) for q in queries], n=n, queries=QUERIES)
+            results.measure(f"tk.hit_vertex/n={n}", lambda: [app.hit_vertex(q[0], q[3]) for q in queries], n=n, queries=QUERIES)
+    finally:
+        app.close()
+
+
+# 基準の結果との比較 (処理時間、メモリ使用量が threshold の割合を超えて増えた項目を劣化とする)
+# 戻り値 : 劣化した項目名のリスト
+def compare(current, baseline, threshold=THRESHOLD):
+    regressions = []
+    for name, entry in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base or "seconds" not in base or "seconds" not in entry:
+            continue
+        ratio = entry["seconds"] / max(base["seconds"], 1e-9)
+        # メモリの計測方法が異なる場合 (tracemalloc と最大常駐メモリ) はメモリを比較しない
+        grew = entry["peak_bytes"] - base["peak_bytes"] if entry.get("memory") == base.get("memory") else 0
+        slower = ratio > 1 + threshold and entry["seconds"] - base["seconds"] > MIN_SECONDS
+        larger = grew > base["peak_bytes"] * threshold and grew > MIN_BYTES
+        mark = "劣化" if slower or larger else ""
+        print(f"{name:<40} {base['seconds'] * 1000:10.2f} -> {entry['seconds'] * 1000:10.2f} ms ({ratio:5.2f}x)"
+              f" {grew / 1024 / 1024:+8.1f} MB {mark}")
+        if slower or larger:
+            regressions.append(name)
+    return regressions
+
+
+def parse_list(text, kind=int):
+    return tuple(kind(v) for v in text.split(",") if v.strip())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="描画、当たり判定、CSV読み書きの処理時間とメモリ使用量を計測する")
+    parser.add_argument("-o", "--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("-n", "--boxes", default=",".join(map(str, BOX_COUNTS)), help="四角形数 (カンマ区切り)")
+    parser.add_argument("-m", "--megapixels", default=",".join(map(str, MEGAPIXELS)),
+                        help="画像サイズ (メガピクセル、カンマ区切り)")
+    parser.add_argument("-r", "--repeat", type=int, default=REPEAT, help="1項目あたりの計測回数")
+    parser.add_argument("--tk", action="store_true", help="画面表示を含む処理も計測する (DISPLAY が無い場合は Xvfb を起動)")
+    parser.add_argument("--workdir", help="合成画像、CSVの作成先 (省略時は一時ディレクトリ、指定すると次回以降再利用)")
+    parser.add_argument("--compare", help="比較する基準の結果のJSONファイル")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="劣化と判断する増加率 (0.25 = 25%%)")
+    parser.add_argument("--peak-rss", nargs='+', help=argparse.SUPPRESS) # 画像の処理のメモリ計測用の子プロセス
+    args = parser.parse_args(argv)
+
+    # 子プロセスとして画像の処理を1回実行し、最大常駐メモリの増加量を出力
+    if args.peak_rss:
+        func, task_args = image_task(*args.peak_rss)
+        gc.collect()
+        before = rss()
+        reset_peak_rss()
+        func(*task_args)
+        print(max(rss("VmHWM") - before, 0))
+        return 0
+
+    counts = parse_list(args.boxes)
+    megapixels = parse_list(args.megapixels, float)
+    megapixels = tuple(int(mp) if mp == int(mp) else mp for mp in megapixels)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="imageViewer_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = Results(args.repeat)
+    bench_annotations(results, counts, workdir)
+    bench_render(results, megapixels, workdir)
+    if args.tk:
+        process = None
+        try:
+            process = start_display()
+            bench_tk(results, counts, megapixels, workdir)
+        except Exception as e:
+            results.skip("tk", str(e))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    current = results.to_json()
+    if args.output:
+        with open(args.output + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=1)
+        os.replace(args.output + ".tmp", args.output)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}項目が劣化しました: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+# メイン実行処理
+if __name__ == "__main__":
+    sys.exit(main())
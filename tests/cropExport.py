@@ -0,0 +1,147 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from PIL import Image
+from tileRenderer import ImagePyramid, ImageSource
+
+CROP_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'tif': 'TIFF', 'webp': 'WEBP', 'bmp': 'BMP'} # 拡張子 -> 保存形式
+QUEUED_PER_WORKER = 4 # ワーカースレッド1つあたりに先行して渡しておく切り抜き数 (メモリ使用量の上限)
+MAX_NAME = 64 # ファイル名に含める名前の最大文字数
+JPEG_QUALITY = 95 # JPEGで保存する際の画質
+
+
+# 出力サイズ ("幅x高さ"、空欄の場合 None) の変換 (不正な値は ValueError)
+def parse_size(text):
+    text = text.strip()
+    if not text:
+        return None
+    parts = text.lower().split('x')
+    if len(parts) != 2:
+        raise ValueError(f"出力サイズは 幅x高さ で指定してください ({text})")
+    w, h = int(parts[0]), int(parts[1])
+    if w < 1 or h < 1:
+        raise ValueError(f"出力サイズは1以上で指定してください ({text})")
+    return w, h
+
+
+# 出力設定 ("余白,幅x高さ,形式") の変換 (不正な値は ValueError)
+# 戻り値 : export_crops に渡す padding, size, ext の辞書
+def parse_options(text):
+    parts = [part.strip() for part in text.split(',')]
+    if len(parts) != 3:
+        raise ValueError("余白,幅x高さ,形式 の3項目を指定してください")
+    padding = int(parts[0] or 0)
+    if padding < 0:
+        raise ValueError(f"余白は0以上で指定してください ({padding})")
+    ext = parts[2].lower().lstrip('.') or 'png'
+    if ext not in CROP_FORMATS:
+        raise ValueError(f"不明な形式です ({ext})")
+    return {'padding': padding, 'size': parse_size(parts[1]), 'ext': ext}
+
+
+# ファイル名に使えない文字、空白を _ に置き換えた名前
+def safe_name(name):
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', name).strip('._')[:MAX_NAME]
+
+
+# 切り抜き画像のファイル名 (id_名前.拡張子、idは digits 桁に0埋めして名前順とid順を揃える)
+def crop_filename(iid, name, ext, digits=1):
+    name = safe_name(name)
+    return f"{iid:0{digits}d}_{name}.{ext}" if name else f"{iid:0{digits}d}.{ext}"
+
+
+# 切り抜く範囲 (xmin, ymin, xmax, ymax) の配列
+# 四角形の周囲に padding ピクセル加え、画像の範囲内に収める (範囲外の四角形は幅、高さが0になる)
+def crop_boxes(coords, size, padding=0):
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 4)
+    w, h = size
+    x0 = np.clip(np.minimum(coords[:, 0], coords[:, 2]) - padding, 0, w)
+    y0 = np.clip(np.minimum(coords[:, 1], coords[:, 3]) - padding, 0, h)
+    x1 = np.clip(np.maximum(coords[:, 0], coords[:, 2]) + padding, 0, w)
+    y1 = np.clip(np.maximum(coords[:, 1], coords[:, 3]) + padding, 0, h)
+    return np.stack([x0, y0, x1, y1], axis=1)
+
+
+# 元の解像度の表示用画像の範囲の読み込み
+# 範囲を指定して読み込める画像は範囲に掛かるタイルのみ、それ以外は画像全体を一度だけデコードして切り抜く
+def read_region(pyramid, box):
+    if pyramid.lazy_regions():
+        return pyramid.region(*box)
+    return pyramid.level(0).crop(box)
+
+
+# 画像の保存 (一時ファイルに書き込み、完了後に置き換える)
+def save_image(image, path, ext):
+    fmt = CROP_FORMATS[ext]
+    options = {}
+    if fmt == 'JPEG':
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB' if len(image.getbands()) >= 3 else 'L')
+        options['quality'] = JPEG_QUALITY
+    image.save(path + ".tmp", fmt, **options)
+    os.replace(path + ".tmp", path)
+
+
+# 切り抜き画像1枚分の書き込み (ワーカースレッドで実行)
+def write_crop(pyramid, box, size, path, ext):
+    image = read_region(pyramid, box)
+    if size:
+        image = image.resize(size, Image.LANCZOS)
+    save_image(image, path, ext)
+
+
+# 四角形ごとの切り抜き画像の出力
+# 元画像は一度だけ読み込み、切り抜き、拡縮、書き込みはワーカースレッドで並列に行う
+# 先行して渡す切り抜き数を制限し、切り抜き済みの画像を溜め込まない
+# source : 元画像 (ImagePyramid、ImageSource、PIL の画像、またはファイルパス)
+# ids : ファイル名に使う id のリスト    names : 名前のリスト    coords : (n, 4) の座標配列
+# padding : 四角形の周囲に加えるピクセル数    size : 出力サイズ (幅, 高さ) (None の場合は切り抜いたまま)
+# ext : 出力形式の拡張子    workers : ワーカースレッド数 (省略時はCPU数)
+# cancel : 中止フラグ    progress : 処理済み数、全件数を受け取る関数
+# 戻り値 : (書き込んだ数, 書き込めなかった (id, 理由) のリスト)
+def export_crops(source, out_dir, ids, names, coords, padding=0, size=None, ext='png', workers=None,
+                 cancel=None, progress=None):
+    if isinstance(source, str):
+        source = ImageSource.open(source)
+    pyramid = source if isinstance(source, ImagePyramid) else ImagePyramid(source)
+    ids = list(ids)
+    boxes = crop_boxes(coords, pyramid.source.size, padding)
+    digits = len(str(max(ids))) if ids else 1
+    os.makedirs(out_dir, exist_ok=True)
+
+    # 範囲を指定して読み込む場合は、近い範囲が続けて読み込まれるよう上から順に処理
+    order = np.lexsort((boxes[:, 0], boxes[:, 1])) if pyramid.lazy_regions() else np.arange(len(boxes))
+    tasks = iter(order.tolist())
+    written = 0
+    errors = []
+    workers = workers or os.cpu_count() or 1
+    limit = workers * QUEUED_PER_WORKER
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while True:
+            # 先行して渡す切り抜き数の上限まで書き込みを依頼 (中止された場合は依頼済みの分のみ待つ)
+            while len(running) < limit and not (cancel is not None and cancel.is_set()):
+                i = next(tasks, None)
+                if i is None:
+                    break
+                x0, y0, x1, y1 = boxes[i].tolist()
+                if x1 <= x0 or y1 <= y0:
+                    errors.append((ids[i], "画像の範囲外です"))
+                    continue
+                path = os.path.join(out_dir, crop_filename(ids[i], names[i], ext, digits))
+                running[pool.submit(write_crop, pyramid, (x0, y0, x1, y1), size, path, ext)] = ids[i]
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                iid = running.pop(future)
+                try:
+                    future.result()
+                    written += 1
+                except Exception as e:
+                    errors.append((iid, str(e)))
+            if progress:
+                progress(written + len(errors), len(ids))
+    return written, errors
@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from functools import wraps
+
+MAX_EVENTS = 200000 # 保持する計測記録の上限数 (古いものから破棄)
+
+
+# 計測区間 (with 文で使い、終了時に記録する)
+class Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler = self.profiler
+        profiler.record(self.name, self.start, time.perf_counter(), 'main')
+        profiler.depth -= 1
+        if profiler.depth == 0:
+            profiler.end_frame(self.start)
+
+
+# 計測無効時の何もしない区間
+class NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NO_STAGE = NoStage()
+
+
+# 処理段階ごとの処理時間の計測
+# メインループで最も外側の区間が終わるまでを1フレームとし、フレーム内の区間ごとの合計時間を保持する
+# 記録は Chrome の trace 形式 (chrome://tracing、Perfetto で表示できる JSON) で書き出せる
+# 無効時は区間の開始、終了とも何もしない
+class FrameProfiler:
+    def __init__(self, max_events=MAX_EVENTS):
+        self.enabled = False
+        self.events = deque(maxlen=max_events) # 計測記録 (名前, 種類, 開始, 終了, スレッド)
+        self.lock = threading.Lock() # ワーカースレッドからの記録用
+        self.origin = time.perf_counter() # 記録の時刻の基準
+        self.depth = 0 # メインループで実行中の区間の入れ子の深さ
+        self.frame = defaultdict(float) # 実行中のフレームの区間名 -> 合計秒数
+        self.last_frame = None # 直前のフレーム (合計秒数, [(区間名, 秒数)] 時間の長い順)
+        self.on_frame = None # フレーム終了時に呼び出す関数 (計測結果の表示用)
+
+    # メインループでの計測区間 (with 文で使う)
+    def stage(self, name):
+        if not self.enabled:
+            return NO_STAGE
+        return Stage(self, name)
+
+    # ワーカースレッドで実行する関数の計測 (無効時は関数をそのまま返す)
+    def wrap(self, name, func):
+        if not self.enabled:
+            return func
+
+        @wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter(), 'worker')
+        return timed
+
+    def record(self, name, start, end, category):
+        with self.lock:
+            self.events.append((name, category, start, end, threading.get_ident()))
+            self.frame[name] += end - start
+
+    # フレームの終了 (ワーカースレッドの区間は終了したフレームに含める)
+    def end_frame(self, start):
+        total = time.perf_counter() - start
+        with self.lock:
+            stages = sorted(self.frame.items(), key=lambda item: -item[1])
+            self.frame.clear()
+        self.last_frame = (total, stages)
+        if self.on_frame:
+            self.on_frame(total, stages)
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        self.depth = 0
+        with self.lock:
+            self.frame.clear()
+        if not enabled:
+            self.last_frame = None
+
+    # 計測記録を Chrome の trace 形式で書き出し
+    def dump(self, path):
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        trace = [{"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                  "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6}
+                 for name, category, start, end, tid in events]
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+        os.replace(path + ".tmp", path)
+        return len(trace)
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.frame.clear()
+        self.last_frame = None
+
+
+# メソッド全体を計測区間とするデコレータ (self.profiler で計測する)
+def profiled(name):
+    def decorate(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.profiler.enabled:
+                return method(self, *args, **kwargs)
+            with self.profiler.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate
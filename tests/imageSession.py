@@ -0,0 +1,131 @@
+import os
+from collections import OrderedDict
+import numpy as np
+from tileRenderer import load_image, IMAGE_EXTENSIONS
+from annotationIO import read_csv_chunks, write_csv
+
+PREFETCH_AHEAD = 3 # 先読みする後ろの画像数
+PREFETCH_BEHIND = 1 # 先読みする前の画像数
+PREFETCH_BYTES = 512 * 1024 * 1024 # 先読みした画像の保持に使う上限バイト数
+
+
+# フォルダ内の画像ファイルの一覧 (名前順)
+def list_images(directory):
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+
+
+# 画像ごとの座標情報の保存先 (画像と同じ場所、同じ名前の .csv)
+def annotation_path(image_path):
+    return os.path.splitext(image_path)[0] + ".csv"
+
+
+# 読み込み済み画像1枚分 (描画用レンダラー、座標情報)
+class SessionImage:
+    def __init__(self, path, renderer, names, coords):
+        self.path = path
+        self.renderer = renderer
+        self.names = names
+        self.coords = coords
+
+    # おおよそのメモリ使用量 (デコード済みの縮小段階、描画済みタイル、座標)
+    def bytes(self):
+        return self.renderer.bytes() + self.coords.nbytes
+
+
+# 画像1枚分の読み込み (ワーカースレッドで実行)
+# scale, view : 拡大率と表示範囲 (キャンバス座標)、表示範囲のタイルと全体表示用の縮小画像を先に作成しておく
+# saving : 保存中の座標情報の書き込み (完了を待ってから読み込む)
+def load_session_image(path, scale, view, saving=None):
+    if saving is not None:
+        saving.exception() # 完了待ち
+    renderer = load_image(path)
+    if view:
+        for tile in renderer.visible_tiles(scale, *view, margin=0):
+            renderer.render_tile(scale, *tile)
+    renderer.overview()
+
+    names, coords = [], []
+    csv_path = annotation_path(path)
+    if os.path.exists(csv_path):
+        for chunk in read_csv_chunks(csv_path):
+            names.extend(chunk.names)
+            coords.append(chunk.coords)
+    coords = np.concatenate(coords) if coords else np.zeros((0, 4), dtype=np.int64)
+    return SessionImage(path, renderer, names, coords)
+
+
+# 座標情報の書き込み (ワーカースレッドで実行、同じ画像の前回の書き込みが済んでから書き込む)
+def save_annotations(path, names, coords, previous=None):
+    if previous is not None:
+        previous.exception() # 完了待ち
+    return write_csv(annotation_path(path), names, coords)
+
+
+# フォルダ内の画像を順に表示するセッション
+# 表示中の前後の画像をワーカースレッドで先読みし、上限バイト数を超えたら表示中から遠いものから破棄する
+class ImageSession:
+    # submit : ワーカースレッドで処理を実行する関数 (ThreadPoolExecutor.submit)
+    def __init__(self, paths, submit, max_bytes=PREFETCH_BYTES):
+        self.paths = paths
+        self.submit = submit
+        self.max_bytes = max_bytes
+        self.index = 0 # 表示中の画像の位置
+        self.entries = OrderedDict() # 画像の位置 -> 読み込み処理 (Future)
+        self.saving = {} # 画像パス -> 座標情報の書き込み処理 (Future)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def path(self, index):
+        return self.paths[index]
+
+    # 画像の読み込み (先読み済みの場合はその結果)
+    def get(self, index, scale, view):
+        future = self.entries.get(index)
+        if future is None or (future.done() and future.exception()):
+            path = self.paths[index]
+            future = self.entries[index] = self.submit(load_session_image, path, scale, view, self.saving.get(path))
+        return future
+
+    # 表示中の前後の画像の先読み
+    def prefetch(self, scale, view):
+        for step in list(range(1, PREFETCH_AHEAD + 1)) + list(range(-1, -PREFETCH_BEHIND - 1, -1)):
+            index = self.index + step
+            if 0 <= index < len(self.paths) and index not in self.entries:
+                self.get(index, scale, view)
+        self.trim()
+
+    # 上限バイト数を超えた分、表示中から遠い画像から破棄 (表示中の画像、読み込み中の画像は残す)
+    def trim(self):
+        done = [(index, future.result().bytes()) for index, future in self.entries.items()
+                if future.done() and not future.exception()]
+        total = sum(size for _, size in done)
+        for index, size in sorted(done, key=lambda item: -abs(item[0] - self.index)):
+            if total <= self.max_bytes:
+                break
+            if index != self.index:
+                del self.entries[index]
+                total -= size
+
+        # 先読み範囲から外れた読み込み待ちの処理は取り消す
+        for index in [i for i, f in self.entries.items() if not f.done()]:
+            if not -PREFETCH_BEHIND <= index - self.index <= PREFETCH_AHEAD and self.entries[index].cancel():
+                del self.entries[index]
+
+    # 座標情報の保存 (ワーカースレッドで書き込み、先読み済みの座標情報も置き換える)
+    # names : 名前のリスト    coords : (n, 4) の座標配列 (表示順)
+    def save(self, index, names, coords):
+        path = self.paths[index]
+        future = self.entries.get(index)
+        if future is not None and future.done() and not future.exception():
+            image = future.result()
+            image.names, image.coords = names, coords
+        self.saving[path] = self.submit(save_annotations, path, names, coords, self.saving.get(path))
+        return self.saving[path]
+
+    # 先読み中の処理の取り消し
+    def close(self):
+        for future in self.entries.values():
+            future.cancel()
+        self.entries.clear()
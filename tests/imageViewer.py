@@ -1,8 +1,37 @@
 import tkinter as tk
-from tkinter import filedialog, colorchooser, ttk
+from tkinter import filedialog, colorchooser, messagebox, simpledialog
 from PIL import Image, ImageTk
-import math
-import csv
+import os
+import queue
+import threading
+import traceback
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from tileRenderer import load_image, IMAGE_FILETYPES
+from annotations import AnnotationStore
+from annotationIO import read_csv_chunks, write_csv, write_csv_chunks
+from annotationDB import ProjectDB, last_project, remember_project
+from virtualList import VirtualList, SHIFT_MASK, CONTROL_MASK
+from imageSession import ImageSession, list_images, annotation_path
+from undoLog import UndoLog, Change
+from frameProfiler import FrameProfiler, profiled
+from annotationCheck import find_conflicts
+from minimap import Minimap
+from cropExport import export_crops, parse_options
+
+REFINE_DELAY = 250 # 拡縮操作が止まってから高画質で描き直すまでの待ち時間 (ms)
+RENDER_WORKERS = 4 # 画像の読み込み、拡縮を行うワーカースレッド数
+POLL_INTERVAL = 15 # ワーカースレッドの処理結果を確認する間隔 (ms)
+IMPORT_CHUNK_ROWS = 5000 # CSV読み込み時に1回で画面に反映する行数
+IMPORT_QUEUE_CHUNKS = 4 # 画面に未反映のまま先読みしておくCSVのチャンク数
+MAX_REPORTED_ERRORS = 20 # CSV読み込みエラーとして表示する最大行数
+CROP_OPTIONS = "0,,png" # 切り抜き画像の出力設定の初期値 (余白,幅x高さ,形式)
+PROFILE_STAGES = 8 # 処理時間の表示で内訳を表示する区間数
+SELECT_COLOR = 'red' # 選択中の四角形の枠線の色
+COMPACT_ROWS = 100000 # 削除済みの行を詰め直す目安 (取り消し記録から参照されない削除済みの行が、有効な行とこの数の多い方を超えたら詰め直す)
+VALIDATE_DELAY = 500 # 座標情報の変更が止まってから検証し直すまでの待ち時間 (ms)
+RESAMPLE_NAMES = {Image.LANCZOS: "LANCZOS", Image.BILINEAR: "BILINEAR"} # 処理時間の計測で表示する補間方法の名前
 
 class AnnotatorApp(tk.Frame):
     def __init__(self, master):
@@ -10,22 +39,64 @@ class AnnotatorApp(tk.Frame):
         self.master = master
         self.pack(fill=tk.BOTH, expand=True)
 
+        self.profiler = FrameProfiler() # 処理段階ごとの処理時間の計測 (有効時のみ記録)
+        self.profiler.on_frame = self.draw_profile
         self.image = None # 読み込み画像
+        self.renderer = None # 表示範囲タイル描画用
+        self.tiles = {} # 表示中タイル (タイル番号 -> キャンバス上の識別番号, 表示画像)
         #self.image = Image.open(image_path) # 読み込み画像
         self.scale = 1.0 # 画像拡大率
-        self.annotations = [] # 座標情報
-        self.undo_stack = [] # 取り消し処理用スタック
-        self.redo_stack = [] # 取り消し処理再実行用スタック
-        self.next_id = 1 # 次描画する四角形のid
+        self.zoom_step = 0 # 拡縮回数 (拡大率 = 1.1 ** 拡縮回数)
+        self.drawn_scale = 1.0 # 描画済み四角形の拡大率
+        self.resample = Image.LANCZOS # 新しく表示するタイルの補間方法
+        self.render_job = None # 描画待ちの処理 (連続した操作をまとめて描画する)
+        self.refine_job = None # 高画質描き直し待ちの処理
+        self.rescale_pending = False # 描画待ちの処理で拡大率を反映するか
+        self.pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS) # 読み込み、拡縮用ワーカースレッド
+        self.results = queue.Queue() # ワーカースレッドの処理結果 (メインループで受け取る)
+        self.poll_job = None # 処理結果確認待ちの処理
+        self.generation = 0 # 描画世代 (拡大率、画像が変わるたびに更新し、古い要求の結果を破棄する)
+        self.load_generation = 0 # 画像、プロジェクトの座標情報の読み込み世代 (読み込みを始めるたびに更新し、古い読み込み結果を破棄する)
+        self.project_generation = None # 読み込み中のプロジェクトの座標情報の読み込み世代
+        self.pending = set() # 拡縮中のタイル (タイル番号, 補間方法)
+        self.stale_tiles = [] # 拡縮前のタイル画像 (新しいタイルが揃うまで表示しておく)
+        self.loading = False # 画像、プロジェクトの座標情報の読み込み中か (読み込み中は座標情報を編集しない)
+        self.message = "" # 処理中でない時に表示するメッセージ
+        self.io_cancel = None # ファイル読み書きの中止フラグ (処理中のみ)
+        self.io_status = "" # ファイル読み書きの進捗表示
+        self.import_errors = [] # CSV読み込みで読み込めなかった行 (行番号, 理由)
+        self.annotations = AnnotationStore() # 座標情報
+        self.items = {} # 四角形のキャンバス上の識別番号 (座標情報キー -> 四角形, 番号)
+        self.history = UndoLog(on_discard=self.request_compact) # 取り消し、再実行用の操作の記録
+        self.compact_job = None # 削除済みの行を詰め直す処理 (取り消し記録を破棄した後に実行)
+        self.import_changes = None # 読み込み中のCSVの取り消し用に記録した変更 (読み込み中のみ。記録前は空のリスト)
+        self.list_job = None # リスト表示更新待ちの処理
+        self.list_sort = None # リストの並べ替え (列名, 降順か)
+        self.list_filter = "" # リストの絞り込み条件
+        self.session = None # フォルダ内の画像を順に表示するセッション (フォルダを開いた場合のみ)
+        self.session_index = None # 座標情報を表示中のセッション内の画像の位置
+        self.saves_pending = 0 # 書き込み中の座標情報の数
+        self.image_path = None # 表示中の画像ファイルのパス
+        self.project = None # 座標情報を保存するプロジェクトデータベース (開いている場合のみ)
         self.rect_preview = None # 描画中四角形格納用
         self.start_x = self.start_y = 0 # 四角形描画開始位置
         self.number_color = 'blue' # 四角形内数字描画色
         self.square_color = 'yellowgreen' # 四角形枠描画色
         self.modify_ann = None # 調整中四角形の座標情報保持用
+        self.band = False # 範囲選択のドラッグ中か
+        self.highlighted = set() # 選択中として枠線を強調表示している四角形のキー
+        self.conflicts = None # 座標情報の検証結果 (重なり、反転、範囲外。検証済みの場合のみ)
+        self.conflicts_only = False # リストに問題のある四角形のみ表示するか
+        self.validating = False # 検証中か
+        self.validate_job = None # 検証し直し待ちの処理
+        self.overview_loading = False # 全体表示用の縮小画像の作成中か
+        self.crop_options = CROP_OPTIONS # 前回の切り抜き画像の出力設定
 
         self.build_ui() # UI作成
+        self.annotations.listeners.append(self.minimap.boxes) # 座標情報の変更を全体表示に反映
         #self.new_image()
         self.update_image() # 描画更新
+        self.restore_project() # 前回のプロジェクトの復元
 
 
     # 初期UI作成
@@ -39,9 +110,17 @@ class AnnotatorApp(tk.Frame):
         file_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label='ファイル', menu=file_menu)
         file_menu.add_command(label='ファイルを開く', command=self.new_image)
+        file_menu.add_command(label='フォルダを開く', command=self.open_folder)
+        file_menu.add_command(label='次の画像 (Ctrl+→)', command=self.next_image)
+        file_menu.add_command(label='前の画像 (Ctrl+←)', command=self.prev_image)
+        file_menu.add_separator()
+        file_menu.add_command(label='プロジェクトを開く', command=self.open_project)
+        file_menu.add_command(label='プロジェクトを閉じる', command=self.close_project)
         file_menu.add_separator()
         file_menu.add_command(label='CSV Export', command=self.export_csv)
         file_menu.add_command(label='CSV Import', command=self.import_csv)
+        file_menu.add_command(label='切り抜き画像を出力', command=self.export_crop_images)
+        file_menu.add_command(label='読み書きを中止 (Esc)', command=self.cancel_io)
 
         # 色設定メニュー
         color_menu = tk.Menu(menubar, tearoff=0)
@@ -49,6 +128,13 @@ class AnnotatorApp(tk.Frame):
         color_menu.add_command(label='描画する番号', command=self.number_set_color)
         color_menu.add_command(label='描画する枠線', command=self.square_set_color)
 
+        # 処理時間計測メニュー
+        profile_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label='計測', menu=profile_menu)
+        self.profile_var = tk.BooleanVar(value=False)
+        profile_menu.add_checkbutton(label='処理時間を表示 (F12)', variable=self.profile_var, command=self.toggle_profile)
+        profile_menu.add_command(label='計測結果を保存 (Chrome trace)', command=self.save_profile)
+
         # 画面の左右分割
         self.left_frame = tk.Frame(self)
         self.left_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -56,28 +142,46 @@ class AnnotatorApp(tk.Frame):
         self.right_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=3)
         self.right_frame.pack_propagate(False)
 
+        # 処理状況表示
+        self.status_label = tk.Label(self.left_frame, anchor='w')
+        self.status_label.pack(side=tk.BOTTOM, fill=tk.X)
+
         # 画像表示 (Canvas)
         self.canvas = tk.Canvas(self.left_frame, bg='gray')
-        self.hbar = tk.Scrollbar(self.left_frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
-        self.vbar = tk.Scrollbar(self.left_frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.hbar = tk.Scrollbar(self.left_frame, orient=tk.HORIZONTAL, command=self.scroll_x)
+        self.vbar = tk.Scrollbar(self.left_frame, orient=tk.VERTICAL, command=self.scroll_y)
         self.canvas.config(xscrollcommand=self.hbar.set, yscrollcommand=self.vbar.set)
         self.hbar.pack(side=tk.BOTTOM, fill=tk.X)
         self.vbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
-        # 座標情報リスト表示 (Treeview)
-        self.tree = ttk.Treeview(self.right_frame, columns=("ID", "Name", "X1", "Y1", "X2", "Y2"), show='headings')
-        for col in self.tree["columns"]:
-            self.tree.heading(col, text=col)
+        # 全体表示 (クリック、ドラッグで表示範囲を移動)
+        self.minimap = Minimap(self.right_frame, on_jump=self.center_view)
+        self.minimap.pack(pady=3)
+
+        # 座標情報リストの絞り込み、id指定での移動
+        self.list_frame = tk.Frame(self.right_frame)
+        self.list_frame.pack(fill=tk.X)
+        tk.Label(self.list_frame, text="絞り込み").pack(side=tk.LEFT)
+        self.filter_entry = tk.Entry(self.list_frame, width=14)
+        self.filter_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.filter_entry.bind("<Return>", self.apply_filter)
+        tk.Label(self.list_frame, text="ID").pack(side=tk.LEFT)
+        self.jump_entry = tk.Entry(self.list_frame, width=7)
+        self.jump_entry.pack(side=tk.LEFT)
+        self.jump_entry.bind("<Return>", self.jump_to_id)
+        self.conflicts_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.list_frame, text="問題のみ", variable=self.conflicts_var, command=self.toggle_conflicts).pack(side=tk.LEFT)
+
+        # 座標情報リスト表示 (表示範囲の行のみ作成する仮想リスト)
         # 各列の幅を設定
-        self.tree.column("ID", width=40, anchor="center")
-        self.tree.column("Name", width=100, anchor="w")
-        self.tree.column("X1", width=40, anchor="center")
-        self.tree.column("Y1", width=40, anchor="center")
-        self.tree.column("X2", width=40, anchor="center")
-        self.tree.column("Y2", width=40, anchor="center")    
+        self.tree = VirtualList(self.right_frame, columns=[("ID", 40, "center"), ("Name", 100, "w"),
+                                                           ("X1", 40, "center"), ("Y1", 40, "center"),
+                                                           ("X2", 40, "center"), ("Y2", 40, "center"),
+                                                           ("Check", 90, "w")],
+                                rows=self.list_rows, on_sort=self.sort_list)
         self.tree.pack(fill=tk.BOTH, expand=True)
-        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<<ListSelect>>", self.on_select)
 
         # 座標情報編集用エリア
         self.edit_frame = tk.Frame(self.right_frame)
@@ -93,89 +197,489 @@ class AnnotatorApp(tk.Frame):
         self.delete_btn = tk.Button(self.edit_frame, text="Delete", command=self.delete_annotation_from_ui)
         self.delete_btn.pack(fill=tk.X)
 
+        # 選択中の四角形の一括編集 (複数選択時、名前は Update で一括変更)
+        self.bulk_frame = tk.Frame(self.right_frame)
+        self.bulk_frame.pack(fill=tk.X)
+        self.bulk_frame.columnconfigure(1, weight=1)
+        tk.Label(self.bulk_frame, text="dX,dY").grid(row=0, column=0)
+        self.offset_entry = tk.Entry(self.bulk_frame, width=10)
+        self.offset_entry.grid(row=0, column=1, sticky='ew')
+        tk.Button(self.bulk_frame, text="Move", command=self.move_selected).grid(row=0, column=2, sticky='ew')
+        tk.Label(self.bulk_frame, text="倍率").grid(row=1, column=0)
+        self.factor_entry = tk.Entry(self.bulk_frame, width=10)
+        self.factor_entry.grid(row=1, column=1, sticky='ew')
+        tk.Button(self.bulk_frame, text="Scale", command=self.scale_selected).grid(row=1, column=2, sticky='ew')
+
         # イベント設定
         self.canvas.bind("<MouseWheel>", self.zoom)
+        self.canvas.bind("<Configure>", lambda event: self.request_render())
         self.canvas.bind("<ButtonPress-1>", self.start_draw)
         self.canvas.bind("<B1-Motion>", self.update_draw)
         self.canvas.bind("<ButtonRelease-1>", self.finish_draw)
         self.master.bind("<Control-z>", self.undo)
         self.master.bind("<Control-y>", self.redo)
+        self.master.bind("<Escape>", self.cancel_io)
+        self.master.bind("<Control-Right>", self.next_image)
+        self.master.bind("<Control-Left>", self.prev_image)
+        self.master.bind("<F12>", self.toggle_profile)
+        self.canvas.bind("<Delete>", lambda event: self.delete_annotation_from_ui())
+        self.tree.tree.bind("<Delete>", lambda event: self.delete_annotation_from_ui())
+        self.master.protocol("WM_DELETE_WINDOW", self.close)
 
     # 描画更新
+    @profiled('update_image')
     def update_image(self):     
         # 画像を読み込んでいない場合、処理を行わない
         if not self.image:
             return
 
-        # 読み込み画像の拡縮
-        w, h = self.image.size
-        resized = self.image.resize((int(w * self.scale), int(h * self.scale)), Image.LANCZOS)
-        self.tkimage = ImageTk.PhotoImage(resized)
-
-        # キャンバスのリセット、拡縮後画像表示
+        # キャンバスのリセット、拡縮後画像のうち表示範囲のタイルのみ表示
         self.canvas.delete("all")
-        self.img_id = self.canvas.create_image(0, 0, anchor='nw', image=self.tkimage)
-        self.canvas.config(scrollregion=self.canvas.bbox(tk.ALL))
-
-        # 四角形の描画
-        for ann in self.annotations:
-            self.draw_annotation(ann)
+        self.tiles.clear()
+        self.stale_tiles.clear()
+        self.items.clear()
+        self.new_generation()
+        self.drawn_scale = self.scale
+        sw, sh = self.renderer.scaled_size(self.scale)
+        self.canvas.config(scrollregion=(0, 0, sw, sh))
+        self.render_visible()
+
+        self.draw_all_annotations()
         self.refresh_tree() # 座標情報リストの更新
+
+    # 拡大率変更時の描画更新 (画像タイルのみ作り直し、四角形は座標変換のみ)
+    @profiled('update_scale')
+    def update_scale(self):
+        # 画像を読み込んでいない場合、処理を行わない
+        if not self.image:
+            return
+
+        # 拡縮前のタイルは新しいタイルが揃うまで下に残し、表示範囲のタイルを作り直す
+        self.canvas.delete('stale')
+        self.canvas.itemconfig('tile', tags='stale')
+        self.stale_tiles = [tile[1] for tile in self.tiles.values()]
+        self.tiles.clear()
+        self.new_generation()
+        sw, sh = self.renderer.scaled_size(self.scale)
+        self.canvas.config(scrollregion=(0, 0, sw, sh))
+        self.render_visible()
+
+        # 描画済み四角形を拡大率の変化分まとめて座標変換
+        factor = self.scale / self.drawn_scale
+        self.canvas.scale('annotation', 0, 0, factor, factor)
+        self.drawn_scale = self.scale
     
+    # 表示範囲のタイル描画
+    @profiled('render_visible')
+    def render_visible(self, event=None):
+        # 画像を読み込んでいない場合、処理を行わない
+        if not self.image:
+            return
+
+        # キャンバス上の表示範囲を取得
+        x0 = self.canvas.canvasx(0)
+        y0 = self.canvas.canvasy(0)
+        x1 = self.canvas.canvasx(self.canvas.winfo_width())
+        y1 = self.canvas.canvasy(self.canvas.winfo_height())
+        visible = set(self.renderer.visible_tiles(self.scale, x0, y0, x1, y1))
+        sw, sh = self.renderer.scaled_size(self.scale)
+        self.minimap.show_view(x0 / sw, y0 / sh, x1 / sw, y1 / sh)
+
+        # 表示範囲外になったタイルを削除
+        for key in list(self.tiles):
+            if key not in visible:
+                self.canvas.delete(self.tiles.pop(key)[0])
+
+        # 新しく表示範囲に入ったタイル、高画質で描き直すタイルのみ拡縮して表示
+        for key in visible:
+            if key in self.tiles and self.tiles[key][2] in (self.resample, Image.LANCZOS):
+                continue
+            # 高画質で描画済みのタイルがあればそれを使う
+            resample = Image.LANCZOS
+            image = self.renderer.cached_tile(self.scale, *key)
+            if image is None:
+                resample = self.resample
+                image = self.renderer.cached_tile(self.scale, *key, resample)
+            # 未描画のタイルはワーカースレッドで拡縮
+            if image is None:
+                self.submit_tile(key, resample)
+            else:
+                self.show_tile(key, image, resample)
+
+        # 全タイルがキャッシュから揃った場合は拡縮前のタイルをすぐに削除
+        if not self.pending:
+            self.canvas.delete('stale')
+            self.stale_tiles.clear()
+        self.update_status()
+
+    # タイルの表示 (表示済みの場合は画像のみ差し替え)
+    def show_tile(self, key, image, resample):
+        with self.profiler.stage('photo_image'):
+            tile = ImageTk.PhotoImage(image)
+        if key in self.tiles:
+            item_id = self.tiles[key][0]
+            self.canvas.itemconfig(item_id, image=tile)
+        else:
+            cx0, cy0, _, _ = self.renderer.tile_bounds(self.scale, *key)
+            item_id = self.canvas.create_image(cx0, cy0, anchor='nw', image=tile, tags='tile')
+            self.canvas.tag_lower('tile') # 四角形より下に表示
+            self.canvas.tag_lower('stale') # 拡縮前のタイルはさらに下に表示
+        self.tiles[key] = (item_id, tile, resample)
+
+    # タイルの拡縮をワーカースレッドに依頼
+    def submit_tile(self, key, resample):
+        job = (key, resample)
+        if job in self.pending:
+            return
+        self.pending.add(job)
+        self.run_in_worker(partial(self.tile_done, self.generation, job),
+                           self.renderer.render_tile, self.scale, *key, resample,
+                           name=f"render_tile ({RESAMPLE_NAMES.get(resample, resample)})")
+
+    # タイルの拡縮完了 (メインループで実行)
+    def tile_done(self, generation, job, future):
+        # 拡大率、画像が変わる前の要求の結果は破棄
+        if generation != self.generation:
+            return
+        self.pending.discard(job)
+        if future.exception():
+            return
+        key, resample = job
+        if key in self.tiles and self.tiles[key][2] == Image.LANCZOS:
+            return
+        self.show_tile(key, future.result(), resample)
+
+        # 全タイルが揃ったら拡縮前のタイルを削除
+        if not self.pending:
+            self.canvas.delete('stale')
+            self.stale_tiles.clear()
+
+    # 描画世代の更新 (処理中の要求の結果は破棄される)
+    def new_generation(self):
+        self.generation += 1
+        self.pending.clear()
+
+    # ワーカースレッドで処理を実行し、完了後メインループで callback(future) を呼び出す
+    # name : 処理時間の計測での名前 (省略時は関数名)
+    def run_in_worker(self, callback, func, *args, name=None):
+        future = self.pool.submit(self.profiler.wrap(name or getattr(func, '__name__', 'worker'), func), *args)
+        future.add_done_callback(lambda f: self.post(callback, f))
+        self.start_polling()
+
+    # ワーカースレッドからメインループへの処理結果の受け渡し (メインループで callback(value) を呼び出す)
+    def post(self, callback, value):
+        self.results.put((callback, value))
+
+    def start_polling(self):
+        if self.poll_job is None:
+            self.poll_job = self.after(POLL_INTERVAL, self.poll_results)
+
+    # ワーカースレッドの処理結果の受け取り (PhotoImage作成、キャンバス更新はメインループでのみ行う)
+    # 処理結果1件の反映に失敗した場合も失敗を表示して残りの結果を受け取り、確認を続ける
+    @profiled('poll_results')
+    def poll_results(self):
+        self.poll_job = None
+        while True:
+            try:
+                callback, value = self.results.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                callback(value)
+            except Exception as e:
+                self.message = f"処理結果の反映に失敗しました: {type(e).__name__}: {e}"
+                traceback.print_exc()
+        self.update_status()
+
+        # 処理中の要求がある間は確認を続ける
+        if self.pending or self.loading or self.io_cancel is not None or self.saves_pending or self.validating or self.overview_loading:
+            self.poll_job = self.after(POLL_INTERVAL, self.poll_results)
+
+    # 処理状況の表示
+    def update_status(self):
+        if self.loading:
+            text = "読み込み中…"
+        elif self.io_status:
+            text = self.io_status
+        elif self.pending:
+            text = f"描画中… (残り{len(self.pending)}タイル)"
+        else:
+            text = self.message
+        if self.status_label.cget("text") != text:
+            self.status_label.config(text=text)
+
+    # 描画要求 (連続した要求はまとめ、処理が空いた時点で最新の状態のみ描画する)
+    # rescale : 拡大率の変更を反映するか
+    def request_render(self, rescale=False):
+        if rescale:
+            self.rescale_pending = True
+            # 拡大率が変わった場合、古い拡大率の高画質描き直しは取り消す
+            if self.refine_job:
+                self.after_cancel(self.refine_job)
+                self.refine_job = None
+        if self.render_job is None:
+            self.render_job = self.after_idle(self.flush_render)
+
+    # 描画待ちの処理の実行
+    @profiled('flush_render')
+    def flush_render(self):
+        self.render_job = None
+        if self.rescale_pending:
+            # 拡縮直後は高速な補間で仮描画し、操作が止まってから高画質で描き直す
+            self.rescale_pending = False
+            self.resample = Image.BILINEAR
+            self.update_scale()
+            self.refine_job = self.after(REFINE_DELAY, self.refine)
+        else:
+            self.render_visible()
+
+    # 高画質での描き直し
+    @profiled('refine')
+    def refine(self):
+        self.refine_job = None
+        self.resample = Image.LANCZOS
+        self.render_visible()
+
+    # 横スクロール
+    def scroll_x(self, *args):
+        self.canvas.xview(*args)
+        self.request_render()
+
+    # 縦スクロール
+    def scroll_y(self, *args):
+        self.canvas.yview(*args)
+        self.request_render()
+
+    # 全体表示のクリック位置を中心に表示 (fx, fy : 画像全体に対する位置の割合)
+    def center_view(self, fx, fy):
+        # 画像を読み込んでいない場合、処理を行わない
+        if not self.image:
+            return
+        x0, x1 = self.canvas.xview()
+        y0, y1 = self.canvas.yview()
+        self.canvas.xview_moveto(fx - (x1 - x0) / 2)
+        self.canvas.yview_moveto(fy - (y1 - y0) / 2)
+        self.request_render()
+
+    # 全体表示の切り替え (縮小画像はワーカースレッドで作成し、四角形の範囲は保持している座標情報から作り直す)
+    def show_overview(self):
+        keys = self.annotations.keys()
+        self.minimap.reset(self.image.size, keys, self.annotations.coords[keys])
+        self.overview_loading = True
+        self.run_in_worker(partial(self.overview_done, self.renderer), self.renderer.overview, self.minimap.size)
+
+    # 全体表示用の縮小画像の作成完了 (メインループで実行)
+    def overview_done(self, renderer, future):
+        # 作成中に別の画像に切り替わった場合は破棄
+        if renderer is not self.renderer:
+            return
+        self.overview_loading = False
+        if not future.exception():
+            self.minimap.set_image(future.result())
+
+    # 全ての四角形の描画 (キャンバス座標への変換は全件まとめて行う)
+    @profiled('draw_all_annotations')
+    def draw_all_annotations(self):
+        keys = self.annotations.keys()
+        canvas_coords = self.annotations.canvas_coords(self.scale, keys)
+        for iid, (key, coords) in enumerate(zip(keys.tolist(), canvas_coords.tolist()), 1):
+            self.draw_items(key, iid, coords)
+
     # 四角形描画
-    def draw_annotation(self, ann):
+    # iid : 表示するid (省略時は座標情報から取得)
+    @profiled('draw_annotation')
+    def draw_annotation(self, ann, iid=None):
         # 座標取得後、拡縮率分変換し、四角形を描画
         x1, y1, x2, y2 = ann['image_coords']
         canvas_coords = [coord * self.scale for coord in (x1, y1, x2, y2)]
-        rect_id = self.canvas.create_rectangle(*canvas_coords, width=2, outline=self.square_color)
+        if iid is None:
+            iid = self.annotations.id_of(ann['key'])
+        self.draw_items(ann['key'], iid, canvas_coords)
+
+    # キャンバス座標への変換済みの四角形、番号を描画
+    def draw_items(self, key, iid, canvas_coords):
+        if key in self.highlighted:
+            rect_id = self.canvas.create_rectangle(*canvas_coords, width=2, outline=SELECT_COLOR, tags=('annotation', 'square', 'selected'))
+        else:
+            rect_id = self.canvas.create_rectangle(*canvas_coords, width=2, outline=self.square_color, tags=('annotation', 'square'))
         
         # 四角形の中に描画番号を描画
         text_x = (canvas_coords[0] + canvas_coords[2]) / 2
         text_y = (canvas_coords[1] + canvas_coords[3]) / 2
-        text_id = self.canvas.create_text(text_x, text_y, text=str(ann['id']), fill=self.number_color,  font=("Arial", 12))
+        text_id = self.canvas.create_text(text_x, text_y, text=str(iid), fill=self.number_color,  font=("Arial", 12), tags=('annotation', 'number'))
 
-        # キャンバス上での識別番号をデータに追加
-        ann['rect_id'] = rect_id
-        ann['text_id'] = text_id
+        # キャンバス上での識別番号を保持
+        self.items[key] = (rect_id, text_id)
 
-    # リスト表示の更新
+    # 描画済み四角形の座標、番号のみ更新
+    def redraw_annotation(self, ann):
+        rect_id, text_id = self.items[ann['key']]
+        x1, y1, x2, y2 = [coord * self.scale for coord in ann['image_coords']]
+        self.canvas.coords(rect_id, x1, y1, x2, y2)
+        self.canvas.coords(text_id, (x1 + x2) / 2, (y1 + y2) / 2)
+
+    # 描画済み四角形の削除
+    def erase_annotation(self, ann):
+        items = self.items.pop(ann['key'], None)
+        if items:
+            self.canvas.delete(*items)
+
+    # リスト表示の更新要求 (連続した変更はまとめ、処理が空いた時点で表示対象を求め直す)
     def refresh_tree(self):
-        self.tree.delete(*self.tree.get_children()) # 既存のデータを削除
+        if self.list_job is None:
+            self.list_job = self.after_idle(self.flush_tree)
+
+    # リスト表示の更新 (表示対象のキーのみ求め、行は表示範囲の分のみ作成される)
+    @profiled('flush_tree')
+    def flush_tree(self):
+        self.list_job = None
+        keys = self.annotations.keys()
+        if self.list_filter:
+            region = self.parse_region(self.list_filter)
+            if region:
+                keys = self.annotations.keys_in_region(*region)
+            else:
+                keys = self.annotations.keys_named(self.list_filter, keys)
+        if self.conflicts_only and self.conflicts is not None:
+            keys = keys[np.isin(keys, self.conflicts.keys)]
+        if self.list_sort:
+            keys = self.annotations.sort_keys(keys, self.list_sort[0].lower(), self.list_sort[1])
+        self.tree.set_view(keys)
+        self.highlight(self.tree.selected_keys())
+        # 検証済みの座標情報が変更されていたら検証し直す
+        if self.conflicts is not None and self.conflicts.version != self.annotations.version:
+            self.request_validation()
+
+    # リスト表示する行の値 (表示範囲のキーのみ渡される)
+    def list_rows(self, keys):
+        names = self.annotations.names
+        conflicts = self.conflicts
+        return [(self.annotations.id_of(key), names[key], *coords,
+                 conflicts.describe(key, self.annotations.id_of) if conflicts else "")
+                for key, coords in zip(keys, self.annotations.coords[keys].tolist())]
+
+    # 絞り込み条件が "X1,Y1,X2,Y2" の形式であれば範囲を返す (それ以外は名前で絞り込む)
+    def parse_region(self, text):
+        try:
+            region = tuple(map(int, text.split(',')))
+        except ValueError:
+            return None
+        return region if len(region) == 4 else None
+
+    # 絞り込み条件の変更
+    def apply_filter(self, event=None):
+        self.list_filter = self.filter_entry.get().strip()
+        self.refresh_tree()
+
+    # 見出しクリック時の並べ替え (同じ列を続けてクリックすると昇順、降順、表示順の順に切り替え)
+    def sort_list(self, column):
+        # 検証結果の列は問題のある四角形のみの表示を切り替え
+        if column == "Check":
+            self.conflicts_var.set(not self.conflicts_var.get())
+            self.toggle_conflicts()
+            return
+        if column == "ID":
+            self.list_sort = None
+        elif self.list_sort is None or self.list_sort[0] != column:
+            self.list_sort = (column, False)
+        elif not self.list_sort[1]:
+            self.list_sort = (column, True)
+        else:
+            self.list_sort = None
+        self.refresh_tree()
+
+    # 入力されたidの四角形を選択し、リストの表示位置を移動
+    def jump_to_id(self, event=None):
+        try:
+            key = self.annotations.key_of(int(self.jump_entry.get()))
+        except ValueError:
+            return
+        if key is None:
+            return
+        self.select_keys(np.array([key]))
+
+    # 四角形を選択し、先頭の四角形の行までリストをスクロール
+    # 絞り込み (文字列、問題のみ) で表示対象外の四角形がある場合は絞り込みを解除
+    def select_keys(self, keys):
+        self.flush_tree()
+        if (self.list_filter or self.conflicts_only) and not np.isin(keys, self.tree.keys).all():
+            self.list_filter = ""
+            self.filter_entry.delete(0, tk.END)
+            self.conflicts_only = False
+            self.conflicts_var.set(False)
+            self.flush_tree()
+        if len(keys):
+            self.tree.see(int(keys[0]))
+        self.tree.selection_set(keys.tolist())
+
+    # 選択中の四角形の枠線を強調表示 (選択が変わった四角形のみ更新)
+    def highlight(self, keys):
+        selected = set(keys.tolist())
+        for key in self.highlighted - selected:
+            items = self.items.get(key)
+            if items:
+                self.canvas.itemconfig(items[0], outline=self.square_color)
+                self.canvas.dtag(items[0], 'selected')
+        for key in selected - self.highlighted:
+            items = self.items.get(key)
+            if items:
+                self.canvas.itemconfig(items[0], outline=SELECT_COLOR)
+                self.canvas.addtag_withtag('selected', items[0])
+        self.highlighted = selected
+
+    # 変更した四角形より後ろの四角形の番号表示を現在のidに合わせる (削除、復元でidがずれた分のみ更新)
+    # keys : 削除、復元した四角形のキーの配列
+    @profiled('renumber')
+    def renumber(self, keys):
+        alive = self.annotations.keys()
+        after = alive[alive > keys.min()]
+        after = after[~np.isin(after, keys)]
+        ids = np.searchsorted(alive, after) + 1
+        for key, iid in zip(after.tolist(), ids.tolist()):
+            self.canvas.itemconfig(self.items[key][1], text=str(iid))
 
-        # 現在の座標情報を追加し、データを表示
-        for ann in self.annotations:
-            x1, y1, x2, y2 = ann['image_coords']
-            self.tree.insert("", "end", iid=str(ann['id']), values=(ann['id'], ann.get('name',''), x1, y1, x2, y2))
-    
     # リスト表示選択時
+    @profiled('on_select')
     def on_select(self, event):       
         selected = self.tree.selection() # 選択されているアイテムを取得
+        self.highlight(np.array([int(key) for key in selected], dtype=np.int64))
 
         # 選択されていたら
         if selected:           
-            # 選択されているアイテムのidの座標情報を取得
-            iid = int(selected[0])
-            ann = next((a for a in self.annotations if a['id'] == iid), None)
+            # 選択されているアイテムの座標情報を取得
+            ann = self.annotations.get(int(selected[0]))
 
-            # 座標情報が存在する場合、そのデータを編集エリアに表示
+            # 座標情報が存在する場合、そのデータを編集エリアに表示 (複数選択時は先頭の名前のみ)
             if ann:
                 self.name_entry.delete(0, tk.END)
                 self.name_entry.insert(0, ann.get('name',''))
                 x1, y1, x2, y2 = ann['image_coords']
                 self.coord_entry.delete(0, tk.END)
-                self.coord_entry.insert(0, f"{x1},{y1},{x2},{y2}")
+                if len(selected) == 1:
+                    self.coord_entry.insert(0, f"{x1},{y1},{x2},{y2}")
+            if len(selected) > 1:
+                self.message = f"{len(selected)}件選択中"
+                self.update_status()
 
     # 座標情報更新処理
+    @profiled('update_annotation_from_ui')
     def update_annotation_from_ui(self):
+        # 読み込み中は編集しない (読み込み完了時に座標情報が置き換えられるため)
+        if self.loading:
+            return
         selected = self.tree.selection() # 選択されているアイテムを取得
+
+        # 複数選択されている場合は名前のみ一括で変更
+        if len(selected) > 1:
+            self.rename_selected()
+            return
         
         # 選択されているアイテムがある場合
         if selected:
-            # 選択されているアイテムのidを取得
-            iid = int(selected[0])
-            ann = next((a for a in self.annotations if a['id'] == iid), None)
+            # 選択されているアイテムの座標情報を取得
+            ann = self.annotations.get(int(selected[0]))
 
-            # 選択されているアイテムのidが座標情報リストに存在する場合
+            # 選択されているアイテムが座標情報リストに存在する場合
             if ann:
                 # 入力されている座標を取得
                 old_ann = ann.copy()
@@ -187,51 +691,112 @@ class AnnotatorApp(tk.Frame):
                 x2, y2 = max(coords[0], coords[2]), min(coords[1], coords[3])
 
                 # 他の四角形と当たっていなければ座標データを更新
-                if not self.hit_square(x1, y1, x2, y2, ann['id']) :
-                    ann['name'] = name
-                    ann['image_coords'] = (x1, y1, x2, y2)
-                    self.undo_stack.append(('edit', old_ann))
-                    self.redo_stack.clear()
-                    self.update_image()                
+                if not self.hit_square(x1, y1, x2, y2, ann['key']) :
+                    self.annotations.update(ann['key'], name, (x1, y1, x2, y2))
+                    self.history.push([Change('edit', [ann['key']], [old_ann['name']], old_ann['image_coords'])])
+                    self.redraw_annotation(ann)
+                    self.refresh_tree()
 
 
 
 
     # 座標情報削除処理
+    @profiled('delete_annotation_from_ui')
     def delete_annotation_from_ui(self):
-        selected = self.tree.selection() # 選択されているアイテムを取得
-
-        # 選択されているアイテムがある場合
-        if selected:
-            # 選択されているアイテムのidを取得
-            iid = int(selected[0])
-            ann = next((a for a in self.annotations if a['id'] == iid), None)   
-
-            # 選択されているアイテムのidが座標情報リストに存在する場合
-            if ann:
-                # そのデータを削除する
-                self.annotations.remove(ann)
-                for a in self.annotations :
-                    if a['id'] > iid :
-                        a['id'] -= 1
-                self.undo_stack.append(('delete', ann))
-                self.redo_stack.clear()
-                self.update_image()
-                self.next_id -= 1         
+        keys = self.selected_keys() # 選択されているアイテムのキーを取得
+
+        # 選択されているアイテムがある場合 (読み込み中、ドラッグ中は編集しない)
+        if len(keys) and not self.loading and not self.dragging():
+            # まとめて削除し、1回の操作として記録 (後ろのidは表示順から求まるため番号表示の更新は1回)
+            self.annotations.remove_many(keys)
+            self.history.push([Change('delete', keys)])
+            self.erase_keys(keys)
+            self.refresh_tree()
+
+    # 選択中の四角形のキー (削除済みの四角形は除く、キー順)
+    def selected_keys(self):
+        keys = np.sort(self.tree.selected_keys())
+        return keys[self.annotations.alive[keys]]
+
+    # 選択中の四角形の名前の一括変更
+    @profiled('rename_selected')
+    def rename_selected(self):
+        keys = self.selected_keys()
+        if not len(keys) or self.loading:
+            return
+        names = [self.annotations.names[key] for key in keys.tolist()]
+        self.history.push([Change('edit', keys, names, self.annotations.coords[keys])])
+        self.annotations.update_many(keys, names=[self.name_entry.get()] * len(keys))
+        self.refresh_tree()
+
+    # 選択中の四角形の移動 (移動量 "dX,dY" を入力)
+    @profiled('move_selected')
+    def move_selected(self):
+        keys = self.selected_keys()
+        try:
+            dx, dy = map(int, self.offset_entry.get().split(','))
+        except ValueError:
+            return
+        if len(keys):
+            self.set_selected_coords(keys, self.annotations.coords[keys].astype(np.int64) + [dx, dy, dx, dy])
+
+    # 選択中の四角形の拡縮 (それぞれの中心を基準に、入力した倍率で拡縮)
+    @profiled('scale_selected')
+    def scale_selected(self):
+        keys = self.selected_keys()
+        try:
+            factor = float(self.factor_entry.get())
+        except ValueError:
+            return
+        if not len(keys) or factor <= 0:
+            return
+        x1, y1, x2, y2 = self.annotations.coords[keys].astype(np.float64).T
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        hw = np.maximum(np.abs(x2 - x1) * factor / 2, 0.5)
+        hh = np.maximum(np.abs(y1 - y2) * factor / 2, 0.5)
+        coords = np.rint(np.stack([cx - hw, cy + hh, cx + hw, cy - hh], axis=1)).astype(np.int64)
+        self.set_selected_coords(keys, coords)
+
+    # 複数の四角形の座標の一括変更
+    # 画像の範囲、他の四角形との当たり判定を全件まとめて1回行い、1件でも問題があれば変更しない
+    # 取り消しの記録、描き直し、リスト表示の更新も全件まとめて1回行う
+    def set_selected_coords(self, keys, coords):
+        if self.loading:
+            return
+        width, height = self.image.size if self.image else (None, None)
+        if width is not None and (coords.min() < 0 or coords[:, [0, 2]].max() > width or coords[:, [1, 3]].max() > height):
+            self.message = "画像の範囲外になるため変更できません"
+            self.update_status()
+            return
+        hits = self.annotations.batch_hits(keys, coords)
+        if len(hits):
+            self.message = f"{len(hits)}件が他の四角形と当たるため変更できません"
+            self.update_status()
+            return
+        names = [self.annotations.names[key] for key in keys.tolist()]
+        self.history.push([Change('edit', keys, names, self.annotations.coords[keys])])
+        self.annotations.update_many(keys, coords=coords)
+        for key in keys.tolist():
+            self.redraw_annotation(self.annotations.get(key))
+        self.refresh_tree()
 
     # 拡縮処理
+    @profiled('zoom')
     def zoom(self, event):
         cx = self.canvas.canvasx(event.x)
         cy = self.canvas.canvasy(event.y)
+        # 拡縮回数から拡大率を求め、同じ拡大率に戻った場合に描画済みタイルを再利用できるようにする
         if event.delta > 0:
-            self.scale *= 1.1
+            self.zoom_step += 1
         else:
-            self.scale /= 1.1
-        self.update_image()
-        #self.canvas.xview_moveto(cx / self.tkimage.width())
-        #self.canvas.yview_moveto(cy / self.tkimage.height())
+            self.zoom_step -= 1
+        self.scale = 1.1 ** self.zoom_step
+        self.request_render(rescale=True)
+        #self.canvas.xview_moveto(cx / self.renderer.scaled_size(self.scale)[0])
+        #self.canvas.yview_moveto(cy / self.renderer.scaled_size(self.scale)[1])
     
     # 四角形描画開始
+    @profiled('start_draw')
     def start_draw(self, event):
         # 画像を読み込んでいない場合、処理を行わない
         if not self.image:
@@ -244,6 +809,25 @@ class AnnotatorApp(tk.Frame):
         # 既存の描画中四角形がある場合はキャンバス上から削除
         if self.rect_preview:
             self.canvas.delete(self.rect_preview)
+            self.rect_preview = None
+        self.canvas.focus_set()
+
+        # Shiftキーを押しながらのドラッグは範囲選択
+        if event.state & SHIFT_MASK:
+            self.band = True
+            self.rect_preview = self.canvas.create_rectangle(self.start_x, self.start_y, self.start_x, self.start_y, width=1, dash=(4, 2), outline=SELECT_COLOR)
+            return
+
+        # Ctrlキーを押しながらのクリックは四角形の選択の追加、解除
+        if event.state & CONTROL_MASK:
+            ann = self.annotations.hit_point(int(self.start_x / self.scale), int(self.start_y / self.scale))
+            if ann:
+                self.select_keys(np.array(sorted(self.highlighted ^ {ann['key']}), dtype=np.int64))
+            return
+
+        # 読み込み中は四角形の追加、調整を行わない (範囲選択、選択の追加、解除のみ)
+        if self.loading:
+            return
 
         # 既存の四角形内をクリックしたか判定
         is_hit, coord, ann = self.hit_vertex(int(self.start_x / self.scale), int(self.start_y / self.scale)) 
@@ -251,8 +835,7 @@ class AnnotatorApp(tk.Frame):
         # 四角形内をクリックしていた場合
         if (is_hit) :
             # クリックした四角形をキャンバス上から削除
-            self.canvas.delete(ann['rect_id'])
-            self.canvas.delete(ann['text_id'])
+            self.erase_annotation(ann)
             # クリックした四角形の座標情報番号を保持した後、クリックした四角形の調整を開始
             self.modify_ann = ann
             end_x = self.start_x
@@ -265,17 +848,22 @@ class AnnotatorApp(tk.Frame):
             self.rect_preview = self.canvas.create_rectangle(self.start_x, self.start_y, self.start_x, self.start_y, width=2, outline=self.square_color)
 
     # 四角形描画中
+    @profiled('update_draw')
     def update_draw(self, event):
         # 画像を読み込んでいない場合、処理を行わない
         if not self.image:
             return
 
+        if not self.rect_preview:
+            return
+
         # 描画中の四角形を現在のマウス位置を元にサイズ変更    
         curr_x = self.canvas.canvasx(event.x)
         curr_y = self.canvas.canvasy(event.y)
         self.canvas.coords(self.rect_preview, self.start_x, self.start_y, curr_x, curr_y)
 
     # 四角形描画終了
+    @profiled('finish_draw')
     def finish_draw(self, event):
         # 画像を読み込んでいない場合、処理を行わない
         if not self.image:
@@ -285,37 +873,49 @@ class AnnotatorApp(tk.Frame):
             # ドラッグ終了時座標取得
             end_x = self.canvas.canvasx(event.x)
             end_y = self.canvas.canvasy(event.y)
+            # 範囲選択の場合、範囲に掛かる四角形を選択
+            if self.band:
+                self.band = False
+                self.canvas.delete(self.rect_preview)
+                self.rect_preview = None
+                self.select_keys(self.annotations.keys_in_region(int(self.start_x / self.scale), int(self.start_y / self.scale),
+                                                                 int(end_x / self.scale), int(end_y / self.scale)))
+                return
+            # 描画中に読み込みが始まった場合は描画を取り消す
+            if self.loading:
+                if self.modify_ann:
+                    self.draw_annotation(self.modify_ann)
+                    self.modify_ann = None
+                self.canvas.delete(self.rect_preview)
+                self.rect_preview = None
+                return
             # 左下座標、右上座標を拡縮分変換して取得
             x1, y1 = int(min(self.start_x, end_x) / self.scale), int(max(self.start_y, end_y) / self.scale)
             x2, y2 = int(max(self.start_x, end_x) / self.scale), int(min(self.start_y, end_y) / self.scale)
             # 既存四角形の調整操作の場合、調整した四角形の既存座標情報を削除
-            if self.modify_ann :
-                del self.annotations[self.modify_ann['id'] - 1]
+            # 既存四角形の調整操作の場合、調整した四角形自身とは当たり判定を取らない
+            skip_key = self.modify_ann['key'] if self.modify_ann else 0
             # 既存の座標の四角形と当たっていない四角形の場合、座標情報を追加し描画に反映
-            if not self.hit_square(x1, y1, x2, y2) :
-                ann = {'id': self.next_id, 'name':'', 'image_coords': (x1, y1, x2, y2)}
-
-                # 既存四角形の調整操作の場合、調整した四角形のidに設定
+            if not self.hit_square(x1, y1, x2, y2, skip_key) :
+                # 既存四角形の調整操作の場合、調整した四角形の座標を変更
                 if self.modify_ann :
-                    ann['id'] = self.modify_ann['id']
-                    ann['name'] = self.modify_ann['name']
-                    self.annotations.insert(self.modify_ann['id']-1, ann)
-                    self.undo_stack.append(('edit', self.modify_ann))
+                    old_ann = self.modify_ann.copy()
+                    ann = self.annotations.update(skip_key, coords=(x1, y1, x2, y2))
+                    self.history.push([Change('edit', [skip_key], [old_ann['name']], old_ann['image_coords'])])
                     self.modify_ann = None # 調整中座標情報をリセット
+                    self.refresh_tree()
                 # 新規四角形描画    
                 else :
-                    self.annotations.append(ann)
-                    self.undo_stack.append(('add', ann))    
-                    self.next_id += 1 
+                    ann = self.annotations.add('', (x1, y1, x2, y2))
+                    self.history.push([Change('add', [ann['key']])])
+                    self.refresh_tree()
 
-                self.redo_stack.clear()
-                self.update_image()
+                self.draw_annotation(ann)
 
             # 調整中の四角形が、既存の座標の四角形と当たっていた場合    
             elif self.modify_ann :
-                self.annotations.insert(self.modify_ann['id']-1 ,self.modify_ann)
+                self.draw_annotation(self.modify_ann)
                 self.modify_ann = None # 調整中座標情報をリセット
-                self.update_image()    
 
             # 描画中の四角形を削除  
             self.canvas.delete(self.rect_preview)
@@ -327,164 +927,675 @@ class AnnotatorApp(tk.Frame):
     # ax1,ay1 : 左下    ax2,ay2 : 右上
     # 戻り値： 当たり判定、最も遠い頂点座標、当たった四角形の座標情報
     def hit_vertex(self, x1, y1):
-        for ann in self.annotations:
+        # 空間インデックスで座標を含む四角形を絞り込み、最も表示順が先頭の四角形を採用
+        ann = self.annotations.hit_point(x1, y1)
+        if ann:
             ax1, ay1, ax2, ay2 = ann['image_coords']
             # 当たっていた場合、当たっていた四角形の頂点座標のうち、座標からもっと最も遠い頂点座標を返す
-            # 同じ値は当たっていると判断
-            if (x1 >= ax1 and x1 <= ax2) and (y1 <= ay1 and y1 >= ay2):
-                vertex = (x1, y1)
-                square_vertex = [(ax1, ay2), (ax2, ay2), (ax1, ay1), (ax2, ay1)]
-                length = self.calculate_distance(vertex, square_vertex[0])
-                coord = square_vertex[0]
-                for squvtx in square_vertex[1:]:
-                    length2 = self.calculate_distance(vertex, squvtx)
-                    if (length < length2):
-                        length = length2
-                        coord = squvtx
-                return True, coord, ann
+            # 距離の大小比較のみのため平方根は取らない
+            square_vertex = [(ax1, ay2), (ax2, ay2), (ax1, ay1), (ax2, ay1)]
+            length = -1
+            for vx, vy in square_vertex:
+                length2 = (vx - x1)**2 + (vy - y1)**2
+                if (length < length2):
+                    length = length2
+                    coord = (vx, vy)
+            return True, coord, ann
         return False, False, False      
 
-    # 2つのタプル型座標のユークリッド距離を計算            
-    def calculate_distance(self, coord1, coord2):
-        x1, y1 = coord1
-        x2, y2 = coord2
-        return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)            
-
     # 四角形同士の当たり判定
     # x1,y1 : 左下    x2,y2 : 右上
     # ax1,ay1 : 左下    ax2,ay2 : 右上
-    # skip_id：当たり判定を取らない四角形のid
+    # skip_key：当たり判定を取らない四角形のキー
     # 戻り値：当たり判定
-    def hit_square(self, x1, y1, x2, y2, skip_id=0):
-        for ann in self.annotations:
-            # スキップidの四角形とは当たり判定を取らない
-            if ann['id'] == skip_id :
-                continue
+    def hit_square(self, x1, y1, x2, y2, skip_key=0):
+        # 空間インデックスで当たっている四角形を取得 (同じ値は当たっていないと判断)
+        return self.annotations.hit_rect(x1, y1, x2, y2, skip_key)
 
-            ax1, ay1, ax2, ay2 = ann['image_coords'] # 座標取得
+    
+    # 四角形の描画、調整、範囲選択のドラッグ中か (ドラッグ中の四角形はキャンバス上から消しているため変更しない)
+    def dragging(self):
+        return self.rect_preview is not None or self.modify_ann is not None
 
-            # 同じ値は当たっていないと判断
-            if (x1 < ax2 and x2 > ax1) and (y1 > ay2 and y2 < ay1):
-                return True                
-        return False
+    # 座標情報を読み込み直した場合の取り消し記録の破棄 (読み込み中のCSVは中止)
+    def reset_history(self):
+        if self.import_changes is not None:
+            self.cancel_io()
+        self.history.clear()
 
-    
     # 直前の操作取り消し処理
+    @profiled('undo')
     def undo(self, event=None):
-        if not self.undo_stack:
-            return
-        action, data = self.undo_stack.pop()
-        # 座標情報追加操作の取り消し
-        if action == 'add':
-            ann = data
-            self.annotations = [a for a in self.annotations if a['id'] != ann['id']]
-            self.next_id -= 1
-            self.redo_stack.append(('add', ann))
-        # 座標情報修正操作の取り消し    
-        elif action == 'edit':
-            iid, old_ann = data['id'], data
-            current = next((a for a in self.annotations if a['id']==iid), None)
-            if current:
-                redo_ann = current.copy()
-                current.update(old_ann)
-                self.redo_stack.append(('edit', redo_ann))
-        # 座標情報削除操作の取り消し        
-        elif action == 'delete':
-            iid, ann = data['id'], data
-            for a in self.annotations :
-                if a['id'] >= iid :
-                    a['id'] += 1
-            self.annotations.insert(iid-1, ann)
-            self.next_id += 1      
-            self.redo_stack.append(('delete', ann))  
-        self.update_image()
+        # 読み込み中、ドラッグ中は取り消さない
+        if self.loading or self.dragging():
+            return
+        # CSV読み込み中は読み込みを中止し、読み込んだ分までを1回の操作として確定してから取り消す
+        if self.import_changes is not None:
+            self.cancel_io()
+        changes = self.history.pop_undo()
+        if changes is not None:
+            self.history.push_redo(self.revert(changes))
 
     # 取り消し処理の再実行
+    @profiled('redo')
     def redo(self, event=None):
-        if not self.redo_stack:
-            return
-        action, data = self.redo_stack.pop()
-        # 取り消した座標情報追加操作の実行
-        if action == 'add':
-            ann = data
-            self.annotations.append(ann)
-            self.undo_stack.append(('add', ann))
-            self.next_id += 1
-        # 取り消した座標情報修正操作の実行    
-        elif action == 'edit':
-            iid, new_ann = data['id'], data
-            current = next((a for a in self.annotations if a['id']==iid), None)
-            if current:
-                undo_ann = current.copy()
-                current.update(new_ann)
-                self.undo_stack.append(('edit', undo_ann))
-        # 取り消した座標情報削除操作の実行        
-        elif action == 'delete':
-            iid, ann = data['id'], data
-            self.annotations.remove(ann)
-            for a in self.annotations :
-                if a['id'] > iid :
-                    a['id'] -= 1
-            self.undo_stack.append(('delete', ann))
-            self.next_id -= 1      
-        self.update_image()
+        if self.loading or self.dragging():
+            return
+        if self.import_changes is not None:
+            self.cancel_io()
+        changes = self.history.pop_redo()
+        if changes is not None:
+            self.history.push_undo(self.revert(changes))
+
+    # 削除済みの行の回収要求 (取り消し記録を破棄した操作が終わってから、処理が空いた時点で行う)
+    def request_compact(self):
+        if self.compact_job is None:
+            self.compact_job = self.after_idle(self.compact_annotations)
+
+    # 取り消し記録から参照されなくなった削除済みの行を詰め、キーを振り直す
+    # 削除済みの行は取り消し用に配列に残すため、CSV読み込みを繰り返すと配列が伸び続けるのを防ぐ
+    # キャンバス上の図形、リスト、取り消し記録のキーも振り直す (表示順、idは変わらない)
+    @profiled('compact_annotations')
+    def compact_annotations(self):
+        self.compact_job = None
+        store = self.annotations
+        dead = store.next_key - 1 - len(store)
+        if dead <= max(len(store), COMPACT_ROWS):
+            return
+        referenced = self.history.keys()
+        referenced = np.unique(referenced[~store.alive[referenced]])
+        if dead - len(referenced) <= max(len(store), COMPACT_ROWS):
+            return
+        # 読み込み中、ドラッグ中は次の機会に行う
+        if self.loading or self.dragging():
+            return
+        mapping = store.compact(referenced)
+        self.history.remap(mapping)
+        self.items = {int(mapping[key]): items for key, items in self.items.items()}
+        self.highlighted = set(mapping[list(self.highlighted)].tolist()) if self.highlighted else set()
+        self.tree.remap(mapping)
+        self.conflicts = None
+        self.refresh_tree()
+        self.validate_annotations()
+
+    # 記録した1回分の操作を逆順に打ち消し、打ち消した操作を戻す操作を返す
+    # 変更した四角形のキャンバス上の図形のみ更新する
+    def revert(self, changes):
+        inverse = []
+        for change in reversed(changes):
+            keys = change.keys
+            # 座標情報追加操作の取り消し (削除の再実行も同じ処理)
+            if change.action == 'add':
+                self.annotations.remove_many(keys)
+                self.erase_keys(keys)
+                inverse.append(Change('delete', keys))
+            # 座標情報削除操作の取り消し (キーの順位から元の表示位置に戻る)
+            elif change.action == 'delete':
+                self.annotations.restore_many(keys)
+                self.draw_keys(keys)
+                inverse.append(Change('add', keys))
+            # 座標情報修正操作の取り消し (現在の値と入れ替える)
+            elif change.action == 'edit':
+                names = [self.annotations.names[key] for key in keys.tolist()]
+                coords = self.annotations.coords[keys].copy()
+                self.annotations.update_many(keys, change.names, change.coords)
+                for key in keys.tolist():
+                    self.redraw_annotation(self.annotations.get(key))
+                inverse.append(Change('edit', keys, names, coords))
+        self.refresh_tree()
+        return inverse
+
+    # 復元した四角形の描画 (後ろの四角形の番号表示もidに合わせる)
+    @profiled('draw_keys')
+    def draw_keys(self, keys):
+        keys = np.sort(keys)
+        alive = self.annotations.keys()
+        ids = np.searchsorted(alive, keys) + 1
+        for key, iid, coords in zip(keys.tolist(), ids.tolist(), self.annotations.canvas_coords(self.scale, keys).tolist()):
+            self.draw_items(key, iid, coords)
+        self.renumber(keys)
+
+    # 削除した四角形の図形の削除 (後ろの四角形の番号表示もidに合わせる)
+    @profiled('erase_keys')
+    def erase_keys(self, keys):
+        if len(keys) > len(self.annotations):
+            # 残りの方が少ない場合は描き直す
+            self.canvas.delete('annotation')
+            self.items.clear()
+            self.draw_all_annotations()
+            return
+        for key in keys.tolist():
+            items = self.items.pop(key, None)
+            if items:
+                self.canvas.delete(*items)
+        self.renumber(keys)
 
     # 新規画像読み込み
     def new_image(self):        
         # 画像ファイルの読み込み
-        filepath = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg *.png *.bmp")]) 
+        filepath = filedialog.askopenfilename(filetypes=IMAGE_FILETYPES)
 
         if (filepath):
-            self.image = Image.open(filepath) # 読み込み画像の変更
-
-            # パラメータ、既存座標情報のリセット
-            self.scale = 1.0
-            self.annotations.clear()
-            self.undo_stack.clear()
-            self.redo_stack.clear()
-            self.next_id = 1
-
-            self.update_image() # 更新
-
+            self.close_session()
+            self.open_image(filepath)
             return True
         return False    
 
-
-    # CSV出力
+    # 画像ファイルを開く (画像のデコードはワーカースレッドで行い、完了後に表示を更新)
+    def open_image(self, filepath):
+        self.loading = True
+        self.new_generation()
+        self.load_generation += 1
+        self.run_in_worker(partial(self.image_loaded, self.load_generation, filepath), load_image, filepath)
+        self.update_status()
+
+    # 画像読み込み完了 (メインループで実行)
+    def image_loaded(self, generation, filepath, future):
+        # 読み込み中に別の画像が選択された場合は破棄
+        if generation != self.load_generation:
+            return
+        self.loading = False
+        if future.exception():
+            self.message = f"読み込みに失敗しました: {future.exception()}"
+            return
+        self.message = ""
+        self.renderer = future.result()
+        self.image = self.renderer.image # 読み込み画像の変更
+        self.image_path = filepath
+
+        # パラメータ、既存座標情報のリセット (前の画像のプロジェクトへの記録は止めてから消す)
+        self.scale = 1.0
+        self.zoom_step = 0
+        self.annotations.journal = None
+        self.annotations.clear()
+        self.reset_history()
+        self.conflicts = None
+        self.show_overview()
+
+        self.update_image() # 更新
+        self.attach_project()
+
+    # フォルダを開き、フォルダ内の画像を順に表示する
+    def open_folder(self):
+        directory = filedialog.askdirectory()
+        if not directory:
+            return
+        paths = list_images(directory)
+        if not paths:
+            messagebox.showinfo("フォルダを開く", "画像ファイルがありません")
+            return
+        self.close_session()
+        self.session = ImageSession(paths, self.pool.submit)
+        self.show_session_image(0)
+
+    # 次の画像
+    def next_image(self, event=None):
+        if self.session and self.session.index + 1 < len(self.session):
+            self.show_session_image(self.session.index + 1)
+
+    # 前の画像
+    def prev_image(self, event=None):
+        if self.session and self.session.index > 0:
+            self.show_session_image(self.session.index - 1)
+
+    # セッション内の画像の表示 (先読み済みの場合はすぐに表示し、前後の画像の先読みを依頼)
+    def show_session_image(self, index):
+        self.cancel_io()
+        self.save_session_image()
+        self.session.index = index
+        view = (0, 0, self.canvas.winfo_width(), self.canvas.winfo_height())
+        future = self.session.get(index, self.scale, view)
+        self.new_generation()
+        self.load_generation += 1
+        if future.done():
+            self.session_image_loaded(self.load_generation, index, future)
+        else:
+            self.loading = True
+            callback = partial(self.session_image_loaded, self.load_generation, index)
+            future.add_done_callback(lambda f: self.post(callback, f))
+            self.start_polling()
+        self.session.prefetch(self.scale, view)
+        self.update_status()
+
+    # セッション内の画像の読み込み完了 (メインループで実行)
+    def session_image_loaded(self, generation, index, future):
+        # 読み込み中に別の画像に移動した場合は破棄
+        if generation != self.load_generation:
+            return
+        self.loading = False
+        path = self.session.path(index)
+        if future.cancelled() or future.exception():
+            self.message = f"読み込みに失敗しました: {path}: {future.exception() if not future.cancelled() else ''}"
+            self.update_status()
+            return
+        image = future.result()
+        self.renderer = image.renderer
+        self.image = self.renderer.image # 読み込み画像の変更
+
+        # 拡大率はセッション内で引き継ぎ、座標情報は画像ごとに保存したものを読み込む
+        self.image_path = path
+        self.annotations.journal = None
+        self.annotations.clear()
+        self.show_overview()
+        self.annotations.extend(image.names, image.coords)
+        self.reset_history()
+        self.conflicts = None
+        self.session_index = index
+        self.message = f"{os.path.basename(path)} ({index + 1}/{len(self.session)})"
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        self.update_image() # 更新
+        self.update_status()
+        self.validate_annotations()
+        self.attach_project()
+
+    # 表示中の画像の座標情報の保存 (書き込みはワーカースレッドで行う)
+    def save_session_image(self):
+        if self.session is None or self.session_index is None:
+            return
+        # 四角形がなく保存済みのファイルもない画像はファイルを作らない
+        index, self.session_index = self.session_index, None
+        path = self.session.path(index)
+        if not len(self.annotations) and not os.path.exists(annotation_path(path)) and path not in self.session.saving:
+            return
+        keys = self.annotations.keys()
+        names = [self.annotations.names[key] for key in keys.tolist()]
+        future = self.session.save(index, names, self.annotations.coords[keys])
+        self.saves_pending += 1
+        future.add_done_callback(lambda f: self.post(self.session_saved, f))
+        self.start_polling()
+
+    # 座標情報の保存完了 (メインループで実行)
+    def session_saved(self, future):
+        self.saves_pending -= 1
+        if future.exception():
+            self.message = f"座標情報の保存に失敗しました: {future.exception()}"
+            self.update_status()
+
+    # セッションの終了 (表示中の画像の座標情報を保存)
+    def close_session(self):
+        if self.session is not None:
+            self.save_session_image()
+            self.session.close()
+            self.session = None
+
+    # ウィンドウを閉じる (保存中の座標情報の書き込みが済んでから終了)
+    def close(self):
+        self.cancel_io()
+        self.close_session()
+        self.pool.shutdown(wait=True)
+        # プロジェクトは次回起動時に復元できるよう記録を残したまま閉じる
+        if self.project is not None:
+            self.annotations.journal = None
+            self.project.close()
+        self.master.destroy()
+
+    # プロジェクトを開く (無い場合は新規作成)
+    def open_project(self):
+        path = filedialog.asksaveasfilename(defaultextension=".db", filetypes=[("Project files", "*.db")],
+                                            confirmoverwrite=False)
+        if path:
+            self.open_project_file(path)
+            self.attach_project()
+
+    def open_project_file(self, path):
+        self.close_project()
+        try:
+            self.project = ProjectDB(path, on_error=lambda e: self.post(self.project_error, e))
+        except Exception as e:
+            self.message = f"プロジェクトを開けませんでした: {e}"
+            self.update_status()
+            return
+        remember_project(path)
+
+    # プロジェクトを閉じる (書き込み待ちの変更を反映してから閉じる)
+    def close_project(self):
+        if self.project is not None:
+            # 座標情報の読み込み中の場合は読み込み結果を破棄し、読み込み中の状態を解除
+            if self.loading and self.project_generation == self.load_generation:
+                self.load_generation += 1
+                self.loading = False
+                self.update_status()
+            self.annotations.journal = None
+            self.project.close()
+            self.project = None
+            remember_project(None)
+
+    # 起動時、前回開いていたプロジェクトと画像を復元
+    def restore_project(self):
+        path = last_project()
+        if not path:
+            return
+        self.open_project_file(path)
+        image_path = self.project.get_meta('last_image') if self.project else None
+        if image_path and os.path.exists(image_path):
+            self.open_image(image_path)
+
+    # 表示中の画像の座標情報をプロジェクトと結び付ける
+    # プロジェクトに保存済みの画像は保存済みの座標情報を読み込み、未保存の画像は現在の座標情報を保存する
+    # 読み込み中は記録を止めるため、座標情報の編集も止める (loading)
+    def attach_project(self):
+        self.annotations.journal = None
+        if self.project is None or self.image_path is None:
+            return
+        self.project.set_meta('last_image', self.image_path)
+        self.loading = True
+        self.load_generation += 1
+        self.project_generation = self.load_generation
+        self.run_in_worker(partial(self.project_loaded, self.load_generation, self.project, self.image_path),
+                           self.project.load, self.image_path)
+        self.update_status()
+
+    # プロジェクトからの座標情報の読み込み完了 (メインループで実行)
+    def project_loaded(self, generation, project, path, future):
+        # 読み込み中に別の画像、プロジェクトに切り替わった場合は破棄
+        if generation != self.load_generation or project is not self.project or path != self.image_path:
+            return
+        self.loading = False
+        if future.exception():
+            self.message = f"プロジェクトの読み込みに失敗しました: {future.exception()}"
+            self.update_status()
+            return
+        saved = future.result()
+        journal = project.journal(path)
+        if saved is None:
+            keys = self.annotations.keys()
+            journal.put(keys.tolist(), [self.annotations.names[key] for key in keys.tolist()], self.annotations.coords[keys])
+        else:
+            keys, names, coords = saved
+            self.annotations.clear()
+            self.annotations.extend(names, coords, keys)
+            self.reset_history()
+            self.conflicts = None
+            self.update_image()
+            self.validate_annotations()
+        self.annotations.journal = journal
+        self.update_status()
+
+    # プロジェクトへの書き込み失敗 (メインループで実行)
+    def project_error(self, error):
+        self.message = f"プロジェクトへの保存に失敗しました: {error}"
+        self.update_status()
+
+
+    # CSV出力 (書き込みはワーカースレッドで行う)
+    # プロジェクトに保存している場合はデータベースから読み出しながら書き込み、それ以外は現在の座標情報を複製して書き込む
     def export_csv(self):
         filename = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
         if filename:
-            # 書き込みモードでファイルを開く
-            with open(filename, "w", newline='') as f:
-                writer = csv.writer(f)
-                # 座標データの書き込み
-                writer.writerow(["id","name","x1","y1","x2","y2"]) # ヘッダー
-                for ann in self.annotations:
-                    x1, y1, x2, y2 = ann['image_coords']
-                    writer.writerow([ann['id'], ann.get('name',''), x1, y1, x2, y2])
-            print(f"Exported to {filename}")
-
-    # CSV読み込み
+            if self.annotations.journal is not None:
+                write = partial(write_csv_chunks, filename, self.project.iter_csv_chunks(self.image_path), len(self.annotations))
+            else:
+                keys = self.annotations.keys()
+                names = [self.annotations.names[key] for key in keys.tolist()]
+                coords = self.annotations.coords[keys]
+                write = partial(write_csv, filename, names, coords)
+            self.start_io(partial(self.write_csv_worker, filename, write))
+
+    # CSV書き込み (ワーカースレッドで実行)
+    # write : 中止フラグ、進捗表示関数を受け取って書き込む関数
+    def write_csv_worker(self, filename, write, cancel):
+        def progress(done, total):
+            self.post(partial(self.io_progress, cancel), f"CSV書き込み中… {done * 100 // total}% ({done}/{total}件)")
+        try:
+            write(cancel=cancel, progress=progress)
+            error = None
+        except Exception as e:
+            error = e
+        self.post(partial(self.csv_export_done, cancel, filename), error)
+
+    # CSV書き込み完了 (メインループで実行)
+    def csv_export_done(self, cancel, filename, error):
+        if cancel is not self.io_cancel:
+            return
+        self.finish_io(f"CSV書き込みに失敗しました: {error}" if error else f"Exported to {filename}")
+        print(self.message)
+
+    # 四角形ごとの切り抜き画像の出力 (切り抜き、書き込みはワーカースレッドで並列に行う)
+    # 元画像はワーカースレッドで開き直し (表示用の画像に元の解像度の画像を残さない)、現在の座標情報を複製して書き込む
+    def export_crop_images(self):
+        # 画像を読み込んでいない場合、処理を行わない
+        if not self.image:
+            return
+        directory = filedialog.askdirectory()
+        if not directory:
+            return
+        text = simpledialog.askstring("切り抜き画像を出力",
+                                      "余白,幅x高さ,形式 (サイズ空欄で切り抜いたまま、形式は png/jpg/tif/webp/bmp)",
+                                      initialvalue=self.crop_options, parent=self.master)
+        if text is None:
+            return
+        try:
+            options = parse_options(text)
+        except ValueError as e:
+            messagebox.showerror("切り抜き画像を出力", str(e))
+            return
+        self.crop_options = text
+        keys = self.annotations.keys()
+        names = [self.annotations.names[key] for key in keys.tolist()]
+        coords = self.annotations.coords[keys]
+        write = partial(export_crops, self.image_path, directory, range(1, len(keys) + 1), names, coords,
+                        workers=RENDER_WORKERS, **options)
+        self.start_io(partial(self.write_crops_worker, directory, write))
+
+    # 切り抜き画像の書き込み (ワーカースレッドで実行)
+    def write_crops_worker(self, directory, write, cancel):
+        def progress(done, total):
+            self.post(partial(self.io_progress, cancel), f"切り抜き画像を書き込み中… {done * 100 // total}% ({done}/{total}件)")
+        try:
+            result = write(cancel=cancel, progress=progress)
+        except Exception as e:
+            result = e
+        self.post(partial(self.crops_export_done, cancel, directory), result)
+
+    # 切り抜き画像の書き込み完了 (メインループで実行)
+    def crops_export_done(self, cancel, directory, result):
+        if cancel is not self.io_cancel:
+            return
+        if isinstance(result, Exception):
+            self.finish_io(f"切り抜き画像の書き込みに失敗しました: {result}")
+            return
+        written, errors = result
+        self.finish_io(f"{written}件の切り抜き画像を {directory} に出力しました")
+        if errors:
+            lines = [f"id {iid}: {reason}" for iid, reason in errors[:MAX_REPORTED_ERRORS]]
+            if len(errors) > MAX_REPORTED_ERRORS:
+                lines.append(f"他 {len(errors) - MAX_REPORTED_ERRORS}件")
+            messagebox.showwarning("切り抜き画像を出力", f"{len(errors)}件を出力できませんでした\n" + "\n".join(lines))
+
+    # CSV読み込み (読み込みはワーカースレッドで行い、読み込んだ分から順に画面に反映する)
     def import_csv(self):
         filename = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
         if filename:
-            # 読み込みモードでファイルを開く
-            with open(filename, "r") as f:
-                reader = csv.reader(f)
-                # 既存リスト、描画番号のリセット
-                self.annotations.clear()
-                self.undo_stack.clear()
-                self.redo_stack.clear()
-                self.next_id = 1
-
-                next(reader) # ヘッダー行をスキップ
-
-                # 座標データの読み込み
-                for row in reader:
-                    ann = {'id': int(row[0]), 'name':row[1], 'image_coords': tuple(map(int, row[2:]))}
-                    self.annotations.append(ann)
-                    self.next_id += 1
-            self.update_image() # 読み込んだデータを画面表示に反映
+            self.import_csv_file(filename)
+
+    # CSVファイルの読み込み開始
+    def import_csv_file(self, filename):
+        # 読み込み中は読み込まない (読み込み完了時に座標情報が置き換えられるため)
+        if self.loading:
+            self.message = "画像、プロジェクトの読み込み中はCSVを読み込めません"
+            self.update_status()
+            return
+        # 既存リスト、描画番号のリセット (読み込み全体を1回の操作として取り消せるよう、既存の四角形は削除として記録)
+        self.cancel_io()
+        keys = self.annotations.keys()
+        self.annotations.remove_many(keys)
+        self.import_changes = []
+        self.record_import(Change('delete', keys))
+        self.canvas.delete('annotation')
+        self.items.clear()
+        self.refresh_tree()
+        self.import_errors = []
+
+        self.start_io(partial(self.read_csv_worker, filename))
+
+    # CSV読み込みの取り消し用の変更の記録
+    # 読み込み中の編集、取り消しが読み込み前後の状態と食い違わないよう、読み込み開始時から記録し、チャンクごとに追加する
+    def record_import(self, change):
+        if self.import_changes and self.history.amend(self.import_changes, self.import_changes + [change]):
+            return
+        # 記録前、または古い操作として破棄された場合は新しい操作として記録
+        self.import_changes = self.history.push([change]) or []
+
+    # CSV読み込み (ワーカースレッドで実行)
+    # 画面に未反映のチャンクが IMPORT_QUEUE_CHUNKS を超えないよう待ちながら読み込む
+    def read_csv_worker(self, filename, cancel):
+        slots = threading.Semaphore(IMPORT_QUEUE_CHUNKS)
+        error = None
+        try:
+            for chunk in read_csv_chunks(filename, IMPORT_CHUNK_ROWS, cancel):
+                while not slots.acquire(timeout=0.1):
+                    if cancel.is_set():
+                        return
+                self.post(partial(self.csv_chunk_loaded, cancel, slots), chunk)
+        except Exception as e:
+            error = e
+        self.post(partial(self.csv_import_done, cancel), error)
+
+    # CSV読み込み1チャンク分の反映 (メインループで実行)
+    @profiled('csv_chunk_loaded')
+    def csv_chunk_loaded(self, cancel, slots, chunk):
+        slots.release()
+        if cancel is not self.io_cancel:
+            return
+
+        # 座標情報を一括で追加し、追加分のみ描画 (リストは表示範囲の行のみ作り直す)
+        first_id = len(self.annotations) + 1
+        keys = self.annotations.extend(chunk.names, chunk.coords)
+        self.record_import(Change('add', keys))
+        canvas_coords = self.annotations.canvas_coords(self.scale, keys)
+        for iid, key, coords in zip(range(first_id, first_id + len(keys)), keys.tolist(), canvas_coords.tolist()):
+            self.draw_items(key, iid, coords)
+        self.refresh_tree()
+        self.import_errors.extend(chunk.errors)
+        self.io_status = f"CSV読み込み中… {chunk.done_bytes * 100 // max(chunk.total_bytes, 1)}% ({len(self.annotations)}件)"
+
+    # CSV読み込み完了 (メインループで実行)
+    def csv_import_done(self, cancel, error):
+        if cancel is not self.io_cancel:
+            return
+        if error:
+            self.finish_io(f"CSV読み込みに失敗しました: {error}")
+        else:
+            self.finish_io(f"{len(self.annotations)}件読み込みました")
+        self.validate_annotations()
+
+        # 読み込めなかった行を行番号付きで表示
+        if self.import_errors:
+            lines = [f"{line}行目: {reason}" for line, reason in self.import_errors[:MAX_REPORTED_ERRORS]]
+            if len(self.import_errors) > MAX_REPORTED_ERRORS:
+                lines.append(f"他 {len(self.import_errors) - MAX_REPORTED_ERRORS}行")
+            messagebox.showwarning("CSV Import", f"{len(self.import_errors)}行を読み込めませんでした\n" + "\n".join(lines))
+
+    # ファイル読み書き (CSV、切り抜き画像) の開始 (ワーカースレッドで func(cancel) を実行)
+    def start_io(self, func):
+        self.cancel_io()
+        cancel = threading.Event()
+        self.io_cancel = cancel
+        self.io_status = "読み書き中…"
+        self.pool.submit(func, cancel)
+        self.start_polling()
+        self.update_status()
+
+    # ファイル読み書きの進捗表示更新 (メインループで実行)
+    def io_progress(self, cancel, text):
+        if cancel is self.io_cancel:
+            self.io_status = text
+
+    # ファイル読み書きの終了
+    def finish_io(self, message):
+        # CSV読み込みは途中で中止した場合も読み込んだ分までを1回の操作とし、チャンクごとの追加をまとめる
+        if self.import_changes is not None:
+            added = [change.keys for change in self.import_changes if change.action == 'add']
+            if len(added) > 1:
+                changes = [change for change in self.import_changes if change.action != 'add']
+                self.history.amend(self.import_changes, changes + [Change('add', np.concatenate(added))])
+            self.import_changes = None
+        self.io_cancel = None
+        self.io_status = ""
+        self.message = message
+        self.update_status()
+
+    # ファイル読み書きの中止
+    def cancel_io(self, event=None):
+        if self.io_cancel is not None:
+            self.io_cancel.set()
+            self.finish_io("読み書きを中止しました")
+
+    # 座標情報の一括検証をワーカースレッドで開始 (重なり、反転、大きさ0、画像の範囲外)
+    def validate_annotations(self):
+        if self.validate_job is not None:
+            self.after_cancel(self.validate_job)
+            self.validate_job = None
+        keys = self.annotations.keys()
+        size = self.image.size if self.image else None
+        self.validating = True
+        self.run_in_worker(self.validation_done, find_conflicts, keys, self.annotations.coords[keys], size,
+                           self.annotations.version)
+
+    # 検証し直しの要求 (連続した変更はまとめ、変更が止まってから検証する)
+    def request_validation(self):
+        if self.validate_job is not None:
+            self.after_cancel(self.validate_job)
+        self.validate_job = self.after(VALIDATE_DELAY, self.validate_annotations)
+
+    # 検証完了 (メインループで実行)
+    def validation_done(self, future):
+        self.validating = False
+        if future.exception():
+            self.message = f"検証に失敗しました: {future.exception()}"
+            self.update_status()
+            return
+        conflicts = future.result()
+        # 検証中に変更された場合は検証し直す
+        if conflicts.version != self.annotations.version:
+            self.request_validation()
+            return
+        if len(conflicts):
+            self.message = f"検証: {conflicts.summary()}"
+        elif self.conflicts is not None and len(self.conflicts):
+            self.message = "検証: 問題ありません"
+        self.conflicts = conflicts
+        self.refresh_tree()
+        self.update_status()
+
+    # 問題のある四角形のみのリスト表示の切り替え
+    def toggle_conflicts(self):
+        self.conflicts_only = self.conflicts_var.get()
+        self.refresh_tree()
+
+    # 処理時間の計測、表示の切り替え (メニューのチェック、F12キー)
+    def toggle_profile(self, event=None):
+        if event is not None:
+            self.profile_var.set(not self.profile_var.get())
+        self.profiler.set_enabled(self.profile_var.get())
+        self.canvas.delete('profile')
+
+    # 直前のフレームの処理時間の内訳をキャンバス左上に表示 (フレーム終了時に呼び出される)
+    def draw_profile(self, total, stages):
+        self.canvas.delete('profile')
+        lines = [f"frame {total * 1000:7.1f} ms"]
+        lines += [f"{name:<28} {seconds * 1000:7.1f}" for name, seconds in stages[:PROFILE_STAGES]]
+        x, y = self.canvas.canvasx(0) + 5, self.canvas.canvasy(0) + 5
+        text_id = self.canvas.create_text(x, y, text="\n".join(lines), anchor='nw', fill='white',
+                                          font=("Courier", 9), tags='profile')
+        bbox = self.canvas.bbox(text_id)
+        if bbox:
+            rect_id = self.canvas.create_rectangle(bbox[0] - 3, bbox[1] - 3, bbox[2] + 3, bbox[3] + 3,
+                                                   fill='black', outline='', tags='profile')
+            self.canvas.tag_lower(rect_id, text_id)
+
+    # 計測結果を Chrome の trace 形式の JSON で保存
+    def save_profile(self):
+        filename = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Trace JSON", "*.json")])
+        if filename:
+            try:
+                count = self.profiler.dump(filename)
+            except OSError as e:
+                messagebox.showerror("計測結果の保存", f"保存に失敗しました: {e}")
+                return
+            self.message = f"計測結果を保存しました ({count}件)"
+            self.update_status()
 
     # 番号色設定
     def number_set_color(self):
@@ -492,7 +1603,7 @@ class AnnotatorApp(tk.Frame):
         color_code = colorchooser.askcolor(title="描画される番号の色を選択")[1]
         if color_code:  # ユーザーが色を選択した場合
             self.number_color = color_code
-            self.update_image() # 画面を再描画
+            self.canvas.itemconfig('number', fill=color_code) # 描画済み番号の色のみ変更
 
     # 枠線色設定
     def square_set_color(self):
@@ -500,7 +1611,8 @@ class AnnotatorApp(tk.Frame):
         color_code = colorchooser.askcolor(title="描画される枠線の色を選択")[1]
         if color_code:  # ユーザーが色を選択した場合
             self.square_color = color_code   
-            self.update_image() # 画面を再描画     
+            self.canvas.itemconfig('square', outline=color_code) # 描画済み枠線の色のみ変更
+            self.canvas.itemconfig('selected', outline=SELECT_COLOR)
 
 
 # メイン実行処理
@@ -0,0 +1,170 @@
+import tkinter as tk
+import numpy as np
+from PIL import Image, ImageTk
+from tileRenderer import OVERVIEW_SIZE, overview_size
+
+BACKGROUND = 128 # 縮小画像の作成前に表示する背景の明るさ
+BOX_COLOR = (255, 64, 0) # 四角形がある範囲の色
+BOX_ALPHA = 0.5 # 四角形がある範囲の色の不透明度
+VIEW_COLOR = 'red' # 表示範囲の枠線の色
+SMALL_UPDATE = 16 # 範囲ごとに加減算する四角形の数の上限 (超える場合は差分配列でまとめて加減算)
+
+
+# 全体表示上の四角形がある範囲
+# 縮小画像の画素ごとに掛かっている四角形の数を保持し、変更された四角形の範囲のみ加減算する
+# AnnotationStore.listeners に登録し、put, delete, clear の通知で更新する
+class OverviewBoxes:
+    # on_change : 変更時に呼び出す関数 (画面への反映の要求用)
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.factor = 0.0 # 元画像座標 -> 縮小画像座標の倍率 (画像を読み込んでいない場合0)
+        self.counts = np.zeros((0, 0), dtype=np.int32) # 画素ごとに掛かっている四角形の数
+        self.rects = np.zeros((0, 4), dtype=np.int32) # キー -> 縮小画像上の範囲 x0,y0,x1,y1 (x1,y1 は含まない)
+        self.present = np.zeros(0, dtype=bool) # キー -> 範囲を加算済みか
+
+    # 縮小画像のサイズ、倍率の設定 (保持している範囲は全て破棄)
+    def reset(self, shape, factor):
+        self.factor = factor
+        self.counts = np.zeros(shape, dtype=np.int32)
+        self.present[:] = False
+
+    # 四角形の追加、変更 (変更前の範囲を減算してから変更後の範囲を加算)
+    def put(self, keys, names, coords):
+        if not self.factor:
+            return
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(keys):
+            return
+        last = int(keys.max()) + 1
+        if last > len(self.present):
+            self.grow(last)
+        old = keys[self.present[keys]]
+        self.add(self.rects[old], -1)
+        rects = self.map_rects(coords)
+        self.rects[keys] = rects
+        self.present[keys] = True
+        self.add(rects, 1)
+        self.changed()
+
+    def delete(self, keys):
+        keys = np.asarray(keys, dtype=np.int64)
+        keys = keys[keys < len(self.present)]
+        keys = keys[self.present[keys]]
+        if not len(keys):
+            return
+        self.add(self.rects[keys], -1)
+        self.present[keys] = False
+        self.changed()
+
+    def clear(self):
+        self.counts[:] = 0
+        self.present[:] = False
+        self.changed()
+
+    def changed(self):
+        if self.on_change:
+            self.on_change()
+
+    # 配列の容量拡張
+    def grow(self, last):
+        capacity = max(last, len(self.present) * 2, 1024)
+        rects = np.zeros((capacity, 4), dtype=np.int32)
+        rects[:len(self.rects)] = self.rects
+        present = np.zeros(capacity, dtype=bool)
+        present[:len(self.present)] = self.present
+        self.rects, self.present = rects, present
+
+    # 元画像座標の四角形の縮小画像上の範囲 (小さい四角形も1画素以上とし、画像の範囲内に収める)
+    def map_rects(self, coords):
+        h, w = self.counts.shape
+        c = np.asarray(coords, dtype=np.float64).reshape(-1, 4) * self.factor
+        x0 = np.clip(np.floor(np.minimum(c[:, 0], c[:, 2])), 0, w - 1)
+        x1 = np.clip(np.ceil(np.maximum(c[:, 0], c[:, 2])), x0 + 1, w)
+        y0 = np.clip(np.floor(np.minimum(c[:, 1], c[:, 3])), 0, h - 1)
+        y1 = np.clip(np.ceil(np.maximum(c[:, 1], c[:, 3])), y0 + 1, h)
+        return np.stack([x0, y0, x1, y1], axis=1).astype(np.int32)
+
+    # 範囲ごとの四角形の数の加減算 (件数が多い場合は差分配列の累積和でまとめて加減算)
+    def add(self, rects, sign):
+        if len(rects) <= SMALL_UPDATE:
+            for x0, y0, x1, y1 in rects.tolist():
+                self.counts[y0:y1, x0:x1] += sign
+            return
+        h, w = self.counts.shape
+        x0, y0, x1, y1 = rects.T.astype(np.int64)
+        stride = w + 1
+        index = np.concatenate([y0 * stride + x0, y0 * stride + x1, y1 * stride + x0, y1 * stride + x1])
+        weights = np.repeat(np.array([sign, -sign, -sign, sign], dtype=np.float64), len(rects))
+        diff = np.bincount(index, weights, minlength=(h + 1) * stride).reshape(h + 1, stride)
+        self.counts += diff.cumsum(axis=0).cumsum(axis=1)[:h, :w].astype(np.int32)
+
+
+# 画像全体の縮小表示 (表示範囲の枠を表示し、クリック、ドラッグした位置に表示範囲を移動)
+# 四角形がある範囲は boxes (OverviewBoxes) の変更をまとめて縮小画像に重ねて表示する
+class Minimap(tk.Canvas):
+    # on_jump : 表示範囲の中心を移動する関数 (画像全体に対する位置の割合 fx, fy を受け取る)
+    def __init__(self, master, on_jump=None, size=OVERVIEW_SIZE):
+        super().__init__(master, width=size, height=size, bg='gray', highlightthickness=0)
+        self.size = size
+        self.on_jump = on_jump
+        self.boxes = OverviewBoxes(self.request_draw) # 四角形がある範囲 (座標情報の変更の通知先)
+        self.base = None # 縮小画像 (高さ, 幅, 3) の配列
+        self.photo = None # 表示中の画像
+        self.draw_job = None # 描画待ちの処理
+        self.image_item = self.create_image(0, 0, anchor='nw')
+        self.view_item = self.create_rectangle(0, 0, 0, 0, outline=VIEW_COLOR, state='hidden')
+
+        # イベント設定
+        self.bind("<ButtonPress-1>", self.jump)
+        self.bind("<B1-Motion>", self.jump)
+
+    # 画像の切り替え (縮小画像は set_image で後から設定し、四角形の範囲は keys, coords から作り直す)
+    # size : 元画像の (幅, 高さ)
+    def reset(self, size, keys, coords):
+        w, h = overview_size(size, self.size)
+        self.base = np.full((h, w, 3), BACKGROUND, dtype=np.uint8)
+        self.boxes.reset((h, w), w / size[0])
+        self.boxes.put(keys, None, coords)
+        self.itemconfig(self.view_item, state='hidden')
+        self.request_draw()
+
+    # 縮小画像の設定 (ワーカースレッドで作成した画像)
+    def set_image(self, image):
+        h, w = self.boxes.counts.shape
+        if image.size != (w, h):
+            image = image.resize((w, h), Image.BILINEAR)
+        self.base = np.asarray(image.convert('RGB'))
+        self.request_draw()
+
+    # 描画要求 (連続した変更はまとめ、処理が空いた時点で描画する)
+    def request_draw(self):
+        if self.draw_job is None:
+            self.draw_job = self.after_idle(self.draw)
+
+    # 縮小画像に四角形がある範囲の色を重ねて表示
+    def draw(self):
+        self.draw_job = None
+        if self.base is None:
+            return
+        image = self.base.copy()
+        mask = self.boxes.counts > 0
+        image[mask] = image[mask] * (1 - BOX_ALPHA) + np.array(BOX_COLOR) * BOX_ALPHA
+        self.photo = ImageTk.PhotoImage(Image.fromarray(image))
+        self.itemconfig(self.image_item, image=self.photo)
+        self.tag_raise(self.view_item)
+
+    # 表示範囲の枠の表示 (画像全体に対する割合)
+    def show_view(self, fx0, fy0, fx1, fy1):
+        if not self.boxes.factor:
+            return
+        h, w = self.boxes.counts.shape
+        self.coords(self.view_item, max(0, fx0) * w, max(0, fy0) * h,
+                    min(1, fx1) * w - 1, min(1, fy1) * h - 1)
+        self.itemconfig(self.view_item, state='normal')
+
+    # クリック、ドラッグした位置に表示範囲の中心を移動
+    def jump(self, event):
+        if not self.boxes.factor or self.on_jump is None:
+            return
+        h, w = self.boxes.counts.shape
+        self.on_jump(min(max(event.x / w, 0), 1), min(max(event.y / h, 0), 1))
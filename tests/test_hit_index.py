@@ -0,0 +1,203 @@
+import random
+from types import SimpleNamespace
+import numpy as np
+from annotations import AnnotationStore, GridIndex
+from imageViewer import AnnotatorApp
+
+STEPS = 150 # 1回の試行で行う操作数
+QUERIES = 20 # 操作ごとの当たり判定の回数
+GRID = 10 # 座標を揃える間隔 (同じ値の辺が多く現れるようにする)
+SPAN = 400 # 座標の範囲
+
+
+# 一括処理化前の全件走査による頂点の当たり判定 (表示順で最初に当たった四角形、同じ値は当たっていると判断)
+def linear_hit_point(store, x, y):
+    for ann in store:
+        ax1, ay1, ax2, ay2 = ann['image_coords']
+        if (x >= ax1 and x <= ax2) and (y <= ay1 and y >= ay2):
+            return ann['key']
+    return None
+
+
+# 一括処理化前の全件走査による四角形同士の当たり判定 (同じ値は当たっていないと判断)
+def linear_hit_rect(store, x1, y1, x2, y2, skip_key=0):
+    for ann in store:
+        if ann['key'] == skip_key:
+            continue
+        ax1, ay1, ax2, ay2 = ann['image_coords']
+        if (x1 < ax2 and x2 > ax1) and (y1 > ay2 and y2 < ay1):
+            return True
+    return False
+
+
+# 一括処理化前の最も遠い頂点の選択 (距離が同じ場合は先に見つかった頂点)
+def linear_far_vertex(x, y, coords):
+    ax1, ay1, ax2, ay2 = coords
+    square_vertex = [(ax1, ay2), (ax2, ay2), (ax1, ay1), (ax2, ay1)]
+    length = ((x - ax1) ** 2 + (y - ay2) ** 2) ** 0.5
+    coord = square_vertex[0]
+    for vx, vy in square_vertex[1:]:
+        length2 = ((x - vx) ** 2 + (y - vy) ** 2) ** 0.5
+        if length < length2:
+            length = length2
+            coord = (vx, vy)
+    return coord
+
+
+def random_value(rng):
+    return rng.randrange(-GRID, SPAN + GRID, GRID) if rng.random() < 0.8 else rng.randrange(-GRID, SPAN + GRID)
+
+
+# 四角形の座標 (x1,y1 : 左下    x2,y2 : 右上。大きさ0、左右上下の反転も混ぜる)
+def random_box(rng):
+    x1, x2 = sorted((random_value(rng), random_value(rng)))
+    y2, y1 = sorted((random_value(rng), random_value(rng)))
+    r = rng.random()
+    if r < 0.05:
+        x2 = x1
+    elif r < 0.1:
+        y1 = y2
+    elif r < 0.13:
+        x1, x2 = x2, x1
+    elif r < 0.2:
+        # 広い範囲に掛かる四角形
+        x1, y1, x2, y2 = -GRID, SPAN, SPAN, -GRID
+    return x1, y1, x2, y2
+
+
+# 追加、削除、変更、一括操作を無作為に行う
+def random_operation(rng, store, removed):
+    keys = store.keys().tolist()
+    r = rng.random()
+    if r < 0.3 or not keys:
+        store.add(f"n{rng.randrange(5)}", random_box(rng))
+    elif r < 0.4:
+        n = rng.randint(1, 20)
+        store.extend([""] * n, [random_box(rng) for _ in range(n)])
+    elif r < 0.5:
+        key = rng.choice(keys)
+        store.remove(key)
+        removed.append(key)
+    elif r < 0.6:
+        picked = rng.sample(keys, rng.randint(1, min(len(keys), 40)))
+        store.remove_many(picked)
+        removed.extend(picked)
+    elif r < 0.7 and removed:
+        picked = list({rng.choice(removed) for _ in range(rng.randint(1, 5))})
+        store.restore_many(picked)
+        removed[:] = [key for key in removed if key not in picked]
+    elif r < 0.85:
+        store.update(rng.choice(keys), coords=random_box(rng))
+    else:
+        picked = rng.sample(keys, rng.randint(1, min(len(keys), 10)))
+        store.update_many(picked, coords=[random_box(rng) for _ in picked])
+
+
+def check_queries(rng, store):
+    app = SimpleNamespace(annotations=store)
+    keys = store.keys().tolist()
+    for _ in range(QUERIES):
+        x, y = random_value(rng), random_value(rng)
+        expected = linear_hit_point(store, x, y)
+        ann = store.hit_point(x, y)
+        assert (ann['key'] if ann else None) == expected, (x, y)
+
+        # 頂点の当たり判定 (最も遠い頂点の選択も全件走査と一致するか)
+        hit, coord, ann = AnnotatorApp.hit_vertex(app, x, y)
+        assert hit == (expected is not None)
+        if hit:
+            assert ann['key'] == expected
+            assert coord == linear_far_vertex(x, y, store.coords[expected].tolist())
+
+        box = random_box(rng)
+        skip_key = rng.choice(keys) if keys and rng.random() < 0.5 else 0
+        assert store.hit_rect(*box, skip_key) == linear_hit_rect(store, *box, skip_key), (box, skip_key)
+        assert AnnotatorApp.hit_square(app, *box, skip_key) == linear_hit_rect(store, *box, skip_key)
+
+
+def run(seed, cell_size):
+    rng = random.Random(seed)
+    store = AnnotationStore(capacity=4)
+    store.index = GridIndex(cell_size)
+    removed = []
+    for _ in range(STEPS):
+        random_operation(rng, store, removed)
+        check_queries(rng, store)
+        # 表示されるidとキーの対応 (フェニック木を1件ずつ更新した場合と作り直した場合)
+        keys = store.keys().tolist()
+        assert [store.id_of(key) for key in keys] == list(range(1, len(keys) + 1))
+        assert [store.key_of(iid) for iid in range(1, len(keys) + 1)] == keys
+
+
+# 格子が四角形より小さい場合 (1つの四角形が多数の格子に掛かる)
+def test_small_cells():
+    for seed in range(2):
+        run(seed, 16)
+
+
+# 既定の格子の大きさ (負の座標の格子を含む)
+def test_default_cells():
+    for seed in range(2):
+        run(seed, 256)
+
+
+# 同じ値の辺は四角形同士では当たらず、頂点では当たる
+def test_equal_edges():
+    store = AnnotationStore()
+    store.add("a", (0, 10, 10, 0))
+    assert not store.hit_rect(10, 10, 20, 0)
+    assert not store.hit_rect(0, 20, 10, 10)
+    assert store.hit_rect(9, 10, 20, 0)
+    assert store.hit_point(10, 10)['key'] == 1
+    assert store.hit_point(0, 0)['key'] == 1
+    assert store.hit_point(11, 10) is None
+
+
+# 重なった四角形では表示順が先頭 (キーが最小) の四角形が選ばれる
+def test_smallest_key_first():
+    store = AnnotationStore()
+    keys = store.extend(["a", "b", "c"], [(0, 100, 100, 0), (10, 90, 90, 10), (20, 80, 80, 20)])
+    assert store.hit_point(50, 50)['key'] == keys[0]
+    store.remove(int(keys[0]))
+    assert store.hit_point(50, 50)['key'] == keys[1]
+    store.restore_many([keys[0]])
+    assert store.hit_point(50, 50)['key'] == keys[0]
+    store.update_many([keys[0]], coords=[(200, 300, 300, 200)])
+    assert store.hit_point(50, 50)['key'] == keys[1]
+    assert np.array_equal(store.keys(), keys)
+
+
+# 格子に展開しない大きな四角形 (int32 の範囲の巨大な座標も格子を展開せずに登録、判定する)
+def test_huge_boxes():
+    store = AnnotationStore()
+    keys = store.extend(["a", "b"], [(0, 100000000, 100000000, 0), (-2000000000, 2000000, -1999990000, 0)])
+    assert store.index.large == set(keys.tolist())
+    assert store.hit_point(50000000, 50000000)['key'] == keys[0]
+    assert store.hit_rect(-2000000000, 2000000000, 2000000000, -2000000000)
+    assert not store.hit_rect(-10, 0, 0, -10)
+    small = store.add("c", (200000000, 10, 200000010, 0))
+    assert store.hit_rect(0, 2000000000, 2000000000, -2000000000, keys[0])
+    assert len(store.batch_hits([small['key']], [(10, 20, 20, 10)])) == 1
+    assert not len(store.batch_hits(keys[:1], [(200000020, 10, 200000030, 0)]))
+    store.remove_many(keys)
+    assert not store.index.large
+    assert store.hit_point(50000000, 50000000) is None
+
+
+# 削除済みの行を詰めた後も当たり判定、表示順が変わらず、残した削除済みの行は元に戻せる
+def test_compact():
+    rng = random.Random(5)
+    store = AnnotationStore(capacity=4)
+    removed = []
+    for _ in range(STEPS):
+        random_operation(rng, store, removed)
+    keys = store.keys()
+    keep = np.array(removed[:5], dtype=np.int64)
+    coords = store.coords[keep].copy()
+    mapping = store.compact(keep)
+    assert np.array_equal(store.keys(), mapping[keys])
+    assert store.next_key == len(keys) + len(np.unique(keep)) + 1
+    check_queries(rng, store)
+    store.restore_many(mapping[keep])
+    assert np.array_equal(store.coords[mapping[keep]], coords)
+    check_queries(rng, store)
@@ -0,0 +1,334 @@
+from collections import OrderedDict
+import math
+import threading
+import numpy as np
+from PIL import Image
+
+TILE_SIZE = 256 # タイル1枚の一辺 (拡縮後キャンバス上のピクセル数)
+CACHE_BYTES = 256 * 1024 * 1024 # タイルキャッシュの上限バイト数
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp', '.pgm', '.ppm') # 対象とする画像の拡張子
+IMAGE_FILETYPES = [("Image files", " ".join("*" + ext for ext in IMAGE_EXTENSIONS)), ("All files", "*.*")] # ファイル選択ダイアログ用
+DRAFT_LEVELS = 3 # JPEGのDCT縮小で直接デコードできる縮小段階 (1/8 まで)
+BAND_ROWS = 512 # 分割読み込みできる画像を帯状に読み込む際の1回の行数
+REGION_MARGIN = 8 # 範囲を指定して読み込む際に補間用に余分に読み込むピクセル数
+OVERVIEW_SIZE = 200 # 全体表示用の縮小画像の長辺の最大ピクセル数
+
+
+# 16bit、32bit整数、浮動小数点画像の画素値の範囲 (8bitへの変換用)
+def value_range(image):
+    a = np.asarray(image, dtype=np.float64)
+    a = a[np.isfinite(a)]
+    return (float(a.min()), float(a.max())) if a.size else (0.0, 1.0)
+
+
+# 全体表示用の縮小画像のサイズ (長辺が max_size 以下、元画像より大きくはしない)
+def overview_size(size, max_size=OVERVIEW_SIZE):
+    w, h = size
+    factor = min(1.0, max_size / max(w, h))
+    return max(1, round(w * factor)), max(1, round(h * factor))
+
+
+# 表示用の8bit画像への変換
+# 16bit、32bit整数、浮動小数点画像は values (最小値, 最大値) の範囲を 0-255 に割り当てる
+def to_display(image, values=None):
+    if image.mode in ('L', 'LA', 'RGB', 'RGBA'):
+        return image
+    if image.mode.startswith('I') or image.mode == 'F':
+        lo, hi = values if values else value_range(image)
+        a = np.nan_to_num(np.asarray(image, dtype=np.float32), nan=lo)
+        a = (a - lo) * (255.0 / (hi - lo if hi > lo else 1.0))
+        return Image.fromarray(a.clip(0, 255).astype(np.uint8), 'L')
+    # パレット画像などは縮小できないため変換
+    return image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+
+# 元画像の読み込み
+# ヘッダーのみ読み込んでおき、必要な縮小段階、範囲のみデコードする
+#  JPEG : DCT縮小 (draft) で 1/2, 1/4, 1/8 の解像度で直接デコード
+#  非圧縮のタイル分割、ストリップ分割TIFF : 表示範囲に掛かるタイルのみ読み込み、縮小段階は帯状に読み込みながら縮小
+#  16bit、浮動小数点画像 : 画素値の範囲を一度だけ求め、8bitに変換した画像を縮小段階として保持
+class ImageSource:
+    # image : 読み込み済み、またはヘッダーのみ読み込んだ画像    filepath : 読み直し用のファイルパス
+    def __init__(self, image, filepath=None):
+        self.image = image
+        self.filepath = filepath
+        self.size = image.size
+        self.mode = image.mode
+        self.values = None # 8bitへの変換に使う画素値の範囲 (一度求めたら以後同じ範囲で変換)
+
+        # 分割読み込みできる画像 (非圧縮で複数のタイル、ストリップに分かれている画像) のタイル一覧
+        # 範囲の読み込みは Pillow の内部の値を書き換えて行うため、先頭のタイルを読み込めない版では画像全体をデコードする
+        tiles = list(getattr(image, 'tile', None) or ())
+        self.tiles = tiles if filepath and len(tiles) > 1 and all(t[0] == 'raw' for t in tiles) else None
+        if self.tiles and not self.can_read_region():
+            self.tiles = None
+
+    @classmethod
+    def open(cls, filepath):
+        return cls(Image.open(filepath), filepath)
+
+    # 8bitに変換する必要がある画像か
+    def high_depth(self):
+        return self.mode.startswith('I') or self.mode == 'F'
+
+    # 表示用の8bit画像への変換 (画素値の範囲は最初に変換した画像全体から求める)
+    def display(self, image):
+        if self.high_depth() and self.values is None:
+            self.values = self.measure_values() if self.tiles else value_range(image)
+        return to_display(image, self.values)
+
+    # 分割読み込みできる画像の画素値の範囲 (帯状に読み込みながら求め、画像全体は保持しない)
+    def measure_values(self):
+        w, h = self.size
+        lo, hi = math.inf, -math.inf
+        for y in range(0, h, BAND_ROWS):
+            band_lo, band_hi = value_range(self.region(0, y, w, min(y + BAND_ROWS, h)))
+            lo, hi = min(lo, band_lo), max(hi, band_hi)
+        return lo, hi
+
+    # 元画像の範囲の読み込み (分割読み込みできる画像のみ、範囲に掛かるタイルのみデコード)
+    def region(self, x0, y0, x1, y1):
+        tiles = [t for t in self.tiles if t[1][0] < x1 and t[1][2] > x0 and t[1][1] < y1 and t[1][3] > y0]
+        ox, oy = min(t[1][0] for t in tiles), min(t[1][1] for t in tiles)
+        ex, ey = max(t[1][2] for t in tiles), max(t[1][3] for t in tiles)
+        with Image.open(self.filepath) as part:
+            # 読み込むタイルを囲む範囲の画像として、タイルの位置をずらしてデコード
+            # タイルは (デコーダー名, 範囲, ファイル内の位置, 引数) の組として、元のタイルと同じ型で作り直す (版により NamedTuple、tuple)
+            make = tiles[0]._make if hasattr(tiles[0], '_make') else tuple
+            part._size = (ex - ox, ey - oy)
+            part.tile = [make((t[0], (t[1][0] - ox, t[1][1] - oy, t[1][2] - ox, t[1][3] - oy), t[2], t[3])) for t in tiles]
+            part.load()
+            return part.crop((x0 - ox, y0 - oy, x1 - ox, y1 - oy))
+
+    # 範囲を読み込めるか (先頭のタイルの範囲を読み込み、大きさが合うか確認)
+    def can_read_region(self):
+        x0, y0, x1, y1 = self.tiles[0][1]
+        try:
+            return self.region(x0, y0, x1, y1).size == (x1 - x0, y1 - y0)
+        except Exception:
+            return False
+
+    # 1/2^k に縮小した表示用画像のデコード
+    def decode(self, k):
+        factor = 2 ** k
+        if self.tiles:
+            return self.decode_bands(factor)
+        if self.filepath is None:
+            return self.reduce(self.display(self.image), factor)
+
+        with Image.open(self.filepath) as image:
+            # JPEGは縮小段階に近い解像度で直接デコード
+            if image.format == 'JPEG' and k > 0:
+                draft = 2 ** min(k, DRAFT_LEVELS)
+                image.draft(image.mode, (-(-self.size[0] // draft), -(-self.size[1] // draft)))
+                factor //= max(1, round(self.size[0] / image.size[0]))
+            image.load()
+            return self.reduce(self.display(image), factor)
+
+    # 帯状に読み込みながら縮小し、元の解像度の画像全体を保持せずに縮小段階を作成
+    def decode_bands(self, factor):
+        w, h = self.size
+        rows = max(1, BAND_ROWS // factor) * factor # 帯の境界が縮小後の画素の境界に揃うよう factor の倍数にする
+        level = None
+        for y in range(0, h, rows):
+            band = self.region(0, y, w, min(y + rows, h))
+            band = self.reduce(self.display(band), factor)
+            if level is None:
+                level = Image.new(band.mode, (-(-w // factor), -(-h // factor)))
+            level.paste(band, (0, y // factor))
+        return level
+
+    @staticmethod
+    def reduce(image, factor):
+        return image.reduce(factor) if factor > 1 else image
+
+
+# 2の累乗で縮小した画像ピラミッド
+# levels[0] : 元画像    levels[k] : 1/2^k に縮小した画像 (いずれも表示用の8bit画像)
+# 必要になった段階のみ作成し、作成済みのより大きい段階があればそこから縮小、なければ元画像から直接デコードする
+class ImagePyramid:
+    def __init__(self, source):
+        self.source = source if isinstance(source, ImageSource) else ImageSource(source)
+        self.levels = {}
+        self.lock = threading.Lock() # 複数のワーカースレッドから同じ段階を作成しないよう排他
+
+    # 縮小段階の画像を取得
+    def level(self, k):
+        image = self.levels.get(k)
+        if image is not None:
+            return image
+        with self.lock:
+            return self.build_level(k)
+
+    # 縮小段階の作成 (排他取得済みの状態で呼び出す)
+    def build_level(self, k):
+        if k not in self.levels:
+            larger = [j for j in self.levels if j < k]
+            if larger:
+                j = max(larger)
+                self.levels[k] = self.levels[j].reduce(2 ** (k - j))
+            else:
+                self.levels[k] = self.source.decode(k)
+        return self.levels[k]
+
+    # 元画像全体をデコードせず範囲を読み込めるか (元の解像度が未作成で、分割読み込みできる画像)
+    def lazy_regions(self):
+        return 0 not in self.levels and self.source.tiles is not None
+
+    # 元の解像度の表示用画像の範囲の読み込み
+    def region(self, x0, y0, x1, y1):
+        with self.lock:
+            if self.source.high_depth() and self.source.values is None:
+                self.source.values = self.source.measure_values()
+        return self.source.display(self.source.region(x0, y0, x1, y1))
+
+    # 作成済みの縮小段階のおおよそのメモリ使用量
+    def bytes(self):
+        return sum(TileCache.image_bytes(image) for image in list(self.levels.values()))
+
+    # 拡大率に対して、拡大率以上で最も小さい縮小段階を取得
+    def level_for(self, scale):
+        k = 0
+        w, h = self.source.size
+        while scale <= 0.5 ** (k + 1) and min(w, h) >> (k + 1) >= 1:
+            k += 1
+        return k
+
+
+# 描画済みタイルのLRUキャッシュ
+# (縮小段階, 拡大率, タイル番号, 補間方法) をキーとし、上限バイト数を超えたら古いものから破棄
+class TileCache:
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock() # ワーカースレッドからの同時操作の排他
+
+    # 画像のおおよそのメモリ使用量
+    @staticmethod
+    def image_bytes(image):
+        w, h = image.size
+        return w * h * len(image.getbands())
+
+    def get(self, key):
+        with self.lock:
+            image = self.items.get(key)
+            if image is not None:
+                self.items.move_to_end(key) # 最近使用したものとして末尾に移動
+            return image
+
+    def put(self, key, image):
+        with self.lock:
+            self.store(key, image)
+
+    def store(self, key, image):
+        if key in self.items:
+            self.bytes -= self.image_bytes(self.items.pop(key))
+        self.items[key] = image
+        self.bytes += self.image_bytes(image)
+
+        # 上限を超えた分を古いものから破棄
+        while self.bytes > self.max_bytes and len(self.items) > 1:
+            _, old = self.items.popitem(last=False)
+            self.bytes -= self.image_bytes(old)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.bytes = 0
+
+
+# 表示範囲にかかるタイルのみを拡縮するレンダラー
+class TileRenderer:
+    # image : 拡縮元画像 (ImageSource、または PIL の画像)
+    def __init__(self, image, tile_size=TILE_SIZE, cache=None):
+        self.pyramid = ImagePyramid(image)
+        self.image = self.pyramid.source.image # 拡縮元画像 (ファイルから開いた場合はヘッダーのみ読み込み済み)
+        self.cache = cache if cache is not None else TileCache()
+        self.tile_size = tile_size
+        self.overviews = {} # 全体表示用の縮小画像 (長辺の最大ピクセル数 -> 画像)
+
+    # 拡縮後の画像サイズ
+    def scaled_size(self, scale):
+        w, h = self.image.size
+        return max(1, int(w * scale)), max(1, int(h * scale))
+
+    # 表示範囲 (キャンバス座標) にかかるタイル番号の一覧を取得
+    # margin : 表示範囲の外側に余分に確保するタイル数
+    def visible_tiles(self, scale, x0, y0, x1, y1, margin=1):
+        sw, sh = self.scaled_size(scale)
+        ts = self.tile_size
+        cols = (sw + ts - 1) // ts
+        rows = (sh + ts - 1) // ts
+
+        # 画像範囲外のタイルは対象外
+        tx0 = max(0, int(x0 // ts) - margin)
+        ty0 = max(0, int(y0 // ts) - margin)
+        tx1 = min(cols - 1, int(x1 // ts) + margin)
+        ty1 = min(rows - 1, int(y1 // ts) + margin)
+        return [(tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+
+    # タイルのキャンバス上の範囲
+    def tile_bounds(self, scale, tx, ty):
+        sw, sh = self.scaled_size(scale)
+        ts = self.tile_size
+        cx0, cy0 = tx * ts, ty * ts
+        return cx0, cy0, min(cx0 + ts, sw), min(cy0 + ts, sh)
+
+    # 描画済みのタイルをキャッシュから取得 (未描画の場合None)
+    def cached_tile(self, scale, tx, ty, resample=Image.LANCZOS):
+        return self.cache.get((self.pyramid.level_for(scale), scale, tx, ty, resample))
+
+    # タイル1枚分の拡縮処理 (描画済みのタイルはキャッシュから取得)
+    # resample : 補間方法 (拡縮直後の仮描画では高速な補間を指定)
+    def render_tile(self, scale, tx, ty, resample=Image.LANCZOS):
+        k = self.pyramid.level_for(scale)
+        key = (k, scale, tx, ty, resample)
+        tile = self.cache.get(key)
+        if tile is not None:
+            return tile
+
+        # 拡大率以上で最も近い縮小段階から拡縮
+        sw, sh = self.scaled_size(scale)
+        cx0, cy0, cx1, cy1 = self.tile_bounds(scale, tx, ty)
+        if k == 0 and self.pyramid.lazy_regions():
+            # 元の解像度は画像全体をデコードせず、タイルに掛かる範囲 (補間用の余白を含む) のみ読み込む
+            w, h = self.pyramid.source.size
+            box = (cx0 * w / sw, cy0 * h / sh, cx1 * w / sw, cy1 * h / sh)
+            x0, y0 = max(0, int(box[0]) - REGION_MARGIN), max(0, int(box[1]) - REGION_MARGIN)
+            x1, y1 = min(w, math.ceil(box[2]) + REGION_MARGIN), min(h, math.ceil(box[3]) + REGION_MARGIN)
+            src = self.pyramid.region(x0, y0, x1, y1)
+            box = (box[0] - x0, box[1] - y0, box[2] - x0, box[3] - y0)
+        else:
+            src = self.pyramid.level(k)
+            w, h = src.size
+            # キャンバス上のタイル範囲に対応する縮小段階画像上の範囲のみを拡縮
+            box = (cx0 * w / sw, cy0 * h / sh, cx1 * w / sw, cy1 * h / sh)
+        tile = src.resize((cx1 - cx0, cy1 - cy0), resample, box=box)
+        self.cache.put(key, tile)
+        return tile
+
+    # 全体表示用の縮小画像 (RGB) の作成 (ワーカースレッドで実行、作成済みの場合はそのまま返す)
+    # 縮小後のサイズ以上で最も小さい縮小段階から縮小し、元の解像度の画像はデコードしない
+    def overview(self, max_size=OVERVIEW_SIZE):
+        image = self.overviews.get(max_size)
+        if image is not None:
+            return image
+        size = overview_size(self.image.size, max_size)
+        w, h = self.image.size
+        k = 0
+        while (w >> (k + 1)) >= size[0] and (h >> (k + 1)) >= size[1]:
+            k += 1
+        image = self.pyramid.level(k).resize(size, Image.LANCZOS).convert('RGB')
+        self.overviews[max_size] = image
+        return image
+
+    # おおよそのメモリ使用量 (作成済みの縮小段階、描画済みタイル)
+    def bytes(self):
+        return self.pyramid.bytes() + self.cache.bytes
+
+
+# 画像ファイルの読み込み (ワーカースレッドで実行)
+# ヘッダーのみ読み込み、デコードは表示に必要な縮小段階、範囲の描画時に行う
+def load_image(filepath):
+    return TileRenderer(ImageSource.open(filepath))
@@ -0,0 +1,122 @@
+from collections import deque
+import numpy as np
+
+UNDO_DEPTH = 500 # 取り消し、再実行できる操作数の上限
+UNDO_BYTES = 64 * 1024 * 1024 # 取り消し用に保持する変更のおおよその上限バイト数
+
+
+# 四角形の変更1件分 (複数の四角形をまとめて保持する)
+# action : 'add' 追加, 'delete' 削除, 'edit' 名前、座標の変更
+# keys : 変更した四角形のキーの配列
+# names, coords : 'edit' の場合のみ、変更前の名前のリスト、(n, 4) の座標配列
+# 追加、削除した四角形の名前、座標は AnnotationStore の配列に残るため、キーのみ保持する
+class Change:
+    __slots__ = ('action', 'keys', 'names', 'coords')
+
+    def __init__(self, action, keys, names=None, coords=None):
+        self.action = action
+        self.keys = np.asarray(keys, dtype=np.int64).reshape(-1)
+        self.names = names
+        self.coords = None if coords is None else np.asarray(coords, dtype=np.int32).reshape(-1, 4)
+
+    # おおよそのメモリ使用量
+    def bytes(self):
+        size = 64 + self.keys.nbytes
+        if self.coords is not None:
+            size += self.coords.nbytes + sum(len(name) + 50 for name in self.names)
+        return size
+
+
+# 取り消し、再実行用の操作の記録
+# 1回の操作 (複数の Change のリスト) を1件とし、件数、バイト数の上限を超えたら古い操作から破棄する
+# on_discard : 記録を破棄した時に呼び出す関数 (参照されなくなった削除済みの行の回収用)
+class UndoLog:
+    def __init__(self, depth=UNDO_DEPTH, max_bytes=UNDO_BYTES, on_discard=None):
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.on_discard = on_discard
+        self.undo_stack = deque()
+        self.redo_stack = deque()
+        self.bytes = 0
+
+    @staticmethod
+    def size(changes):
+        return sum(change.bytes() for change in changes)
+
+    # 新しい操作の記録 (再実行できる操作は破棄)
+    # 戻り値 : 記録した操作 (amend で後から変更を差し替えられる。変更が無く記録しなかった場合 None)
+    def push(self, changes):
+        changes = [change for change in changes if len(change.keys)]
+        if not changes:
+            return None
+        if self.redo_stack:
+            self.bytes -= sum(self.size(entry) for entry in self.redo_stack)
+            self.redo_stack.clear()
+            self.discarded()
+        self.push_undo(changes)
+        return changes
+
+    # 記録済みの操作の変更の差し替え (CSV読み込みなど、少しずつ進む操作用)
+    # entry : push の戻り値    戻り値 : 差し替えたか (取り消し済み、破棄済みの場合は差し替えず False)
+    def amend(self, entry, changes):
+        if not any(recorded is entry for recorded in self.undo_stack):
+            return False
+        self.bytes += self.size(changes) - self.size(entry)
+        entry[:] = changes
+        self.trim()
+        return True
+
+    def push_undo(self, changes):
+        self.undo_stack.append(changes)
+        self.bytes += self.size(changes)
+        self.trim()
+
+    def push_redo(self, changes):
+        self.redo_stack.append(changes)
+        self.bytes += self.size(changes)
+        self.trim()
+
+    def pop_undo(self):
+        return self.pop(self.undo_stack)
+
+    def pop_redo(self):
+        return self.pop(self.redo_stack)
+
+    def pop(self, stack):
+        if not stack:
+            return None
+        changes = stack.pop()
+        self.bytes -= self.size(changes)
+        return changes
+
+    # 上限を超えた分を古い操作から破棄 (取り消し側の最も古い操作、再実行側の最も先の操作の順)
+    # 直前の1件は上限を超えても残す
+    def trim(self):
+        trimmed = False
+        while ((len(self.undo_stack) + len(self.redo_stack) > self.depth or self.bytes > self.max_bytes)
+               and len(self.undo_stack) + len(self.redo_stack) > 1):
+            stack = self.undo_stack if len(self.undo_stack) > 1 or not self.redo_stack else self.redo_stack
+            self.bytes -= self.size(stack.popleft())
+            trimmed = True
+        if trimmed:
+            self.discarded()
+
+    def discarded(self):
+        if self.on_discard:
+            self.on_discard()
+
+    # 記録している全ての変更のキー
+    def keys(self):
+        keys = [change.keys for entry in self.undo_stack + self.redo_stack for change in entry]
+        return np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+
+    # キーの振り直しの反映 (mapping : 元のキー -> 新しいキーの配列)
+    def remap(self, mapping):
+        for entry in self.undo_stack + self.redo_stack:
+            for change in entry:
+                change.keys = mapping[change.keys]
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.bytes = 0
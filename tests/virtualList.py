@@ -0,0 +1,188 @@
+import tkinter as tk
+from tkinter import ttk
+from functools import partial
+import numpy as np
+
+ROW_HEIGHT = 20 # 1行の高さ (スタイルから取得できない場合)
+SHIFT_MASK = 0x0001 # イベントの state のShiftキーのビット
+CONTROL_MASK = 0x0004 # イベントの state のCtrlキーのビット
+
+# 表示範囲の行のみを作成する仮想リスト
+# 表示対象はキーの配列のみ保持し、各行の値は表示時に rows(keys) から取得する
+# 選択が変わると <<ListSelect>> イベントを発生させる
+class VirtualList(tk.Frame):
+    # columns : (列名, 幅, 配置) のリスト
+    # rows : キーのリストを受け取り、各行の値のリストを返す関数
+    # on_sort : 列名を受け取る並べ替え処理 (見出しクリック時)
+    def __init__(self, master, columns, rows, on_sort=None):
+        super().__init__(master)
+        self.rows = rows
+        self.on_sort = on_sort
+        self.keys = np.zeros(0, dtype=np.int64) # 表示対象のキー (表示順)
+        self.offset = 0 # 先頭に表示している行の位置
+        self.visible_rows = 1 # 一度に表示できる行数
+        self.selected = set() # 選択中のキー
+        self.anchor = None # 範囲選択の起点の行の位置
+        self.cursor = None # 最後に選択した行の位置
+
+        # 行の選択は独自に管理するため、Treeview標準の選択操作は無効にする
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in columns], show='headings', selectmode='none')
+        for name, width, anchor in columns:
+            self.tree.heading(name, text=name, command=partial(self.sort, name))
+            self.tree.column(name, width=width, anchor=anchor)
+        self.vbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.vbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        # イベント設定
+        self.tree.bind("<Configure>", self.resize)
+        self.tree.bind("<MouseWheel>", self.wheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda event: self.scroll(3))
+        self.tree.bind("<ButtonPress-1>", self.click)
+        self.tree.bind("<Up>", lambda event: self.move_selection(-1))
+        self.tree.bind("<Down>", lambda event: self.move_selection(1))
+        self.tree.bind("<Shift-Up>", lambda event: self.move_selection(-1, extend=True))
+        self.tree.bind("<Shift-Down>", lambda event: self.move_selection(1, extend=True))
+        self.tree.bind("<Control-a>", self.select_all)
+        self.tree.bind("<Prior>", lambda event: self.scroll(-self.visible_rows))
+        self.tree.bind("<Next>", lambda event: self.scroll(self.visible_rows))
+
+    # 表示対象のキーの設定 (表示対象から外れたキーは選択解除)
+    def set_view(self, keys):
+        self.keys = np.asarray(keys, dtype=np.int64)
+        if self.selected:
+            selected = np.fromiter(self.selected, dtype=np.int64)
+            self.selected = set(selected[np.isin(selected, self.keys)].tolist())
+        self.offset = self.clamp(self.offset)
+        self.render()
+
+    # キーの振り直しの反映 (並び順は変わらないため、表示位置、選択はそのまま)
+    # mapping : 元のキー -> 新しいキーの配列
+    def remap(self, mapping):
+        self.keys = mapping[self.keys]
+        if self.selected:
+            self.selected = set(mapping[np.fromiter(self.selected, dtype=np.int64)].tolist())
+        self.render()
+
+    # 表示範囲の行のみ作成
+    def render(self):
+        total = len(self.keys)
+        end = min(total, self.offset + self.visible_rows)
+        keys = self.keys[self.offset:end].tolist()
+        self.tree.delete(*self.tree.get_children())
+        for key, values in zip(keys, self.rows(keys)):
+            self.tree.insert("", "end", iid=str(key), values=values)
+        self.tree.selection_set([str(key) for key in keys if key in self.selected])
+        if total:
+            self.vbar.set(self.offset / total, end / total)
+        else:
+            self.vbar.set(0, 1)
+
+    # 先頭に表示する行の位置を範囲内に収める
+    def clamp(self, offset):
+        return max(0, min(offset, len(self.keys) - self.visible_rows))
+
+    # ウィンドウサイズ変更時、表示できる行数を更新
+    def resize(self, event):
+        row_height = ttk.Style().lookup("Treeview", "rowheight") or ROW_HEIGHT
+        rows = max(1, (event.height - int(row_height) - 5) // int(row_height))
+        if rows != self.visible_rows:
+            self.visible_rows = rows
+            self.offset = self.clamp(self.offset)
+            self.render()
+
+    # スクロールバー操作
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            self.offset = self.clamp(int(float(args[1]) * len(self.keys)))
+            self.render()
+        elif args[0] == 'scroll':
+            step = int(args[1]) * (self.visible_rows if args[2] == 'pages' else 1)
+            self.scroll(step)
+
+    def wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+
+    # 指定行数分スクロール
+    def scroll(self, step):
+        offset = self.clamp(self.offset + step)
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    # 行クリック時、その行を選択 (Ctrlキーで選択の追加、解除、Shiftキーで最後に選択した行からの範囲選択)
+    def click(self, event):
+        if self.tree.identify_region(event.x, event.y) == 'heading':
+            return
+        row = self.tree.identify_row(event.y)
+        if not row:
+            return
+        self.tree.focus_set()
+        self.select_index(self.offset + self.tree.index(row), toggle=bool(event.state & CONTROL_MASK),
+                          extend=bool(event.state & SHIFT_MASK))
+
+    # 選択行を上下に移動 (extend : 範囲選択を広げる)
+    def move_selection(self, step, extend=False):
+        if self.cursor is not None and len(self.keys):
+            self.select_index(max(0, min(self.cursor + step, len(self.keys) - 1)), extend=extend)
+        return "break"
+
+    # 指定位置の行を選択し、表示範囲に入るようスクロール
+    # toggle : 選択中の行に追加 (選択済みの場合は解除)
+    # extend : 最後に選択した行から指定位置までを選択
+    def select_index(self, index, toggle=False, extend=False):
+        key = int(self.keys[index])
+        if extend and self.anchor is not None:
+            first, last = sorted((min(self.anchor, len(self.keys) - 1), index))
+            self.selected = set(self.keys[first:last + 1].tolist())
+        elif toggle:
+            self.selected ^= {key}
+            self.anchor = index
+        else:
+            self.selected = {key}
+            self.anchor = index
+        self.cursor = index
+        self.see_index(index)
+        self.event_generate("<<ListSelect>>")
+
+    # 表示対象の全ての行を選択
+    def select_all(self, event=None):
+        self.selected = set(self.keys.tolist())
+        self.render()
+        self.event_generate("<<ListSelect>>")
+        return "break"
+
+    # 選択中のキー (Treeview.selection と同じく文字列のタプル)
+    def selection(self):
+        return tuple(str(key) for key in self.selected_keys().tolist())
+
+    # 選択中のキーの配列 (表示順)
+    def selected_keys(self):
+        if not self.selected:
+            return np.zeros(0, dtype=np.int64)
+        return self.keys[np.isin(self.keys, np.fromiter(self.selected, dtype=np.int64))]
+
+    # キーを指定して選択
+    def selection_set(self, keys):
+        self.selected = set(int(key) for key in keys)
+        self.render()
+        self.event_generate("<<ListSelect>>")
+
+    # キーの行が表示範囲に入るようスクロール (表示対象にない場合 False)
+    def see(self, key):
+        index = np.flatnonzero(self.keys == key)
+        if not len(index):
+            return False
+        self.see_index(int(index[0]))
+        return True
+
+    def see_index(self, index):
+        if not (self.offset <= index < self.offset + self.visible_rows):
+            self.offset = self.clamp(index - self.visible_rows // 2)
+        self.render()
+
+    # 見出しクリック時の並べ替え
+    def sort(self, column):
+        if self.on_sort:
+            self.on_sort(column)